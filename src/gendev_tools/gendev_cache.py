@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_cache.py
+~~~~~~~~~~~~~~~
+
+State of the devices shared by several processes.
+
+The fleet tools run several worker processes, and each one would check the
+identity of the same devices, and retrieve their information, again. The
+:py:class:`DeviceStateCache` keeps a compact state of each device (i.e. its
+identity, its *device_info*, its health and when it was seen for the last
+time) in a memory mapped file, shared by every process opening it. What a
+worker learns about a device is used by the rest of the workers.
+
+The file is a table of fixed-size slots, indexed by a hash of the device
+identifier (open addressing, with a short probe sequence). Each slot holds
+the state of a device as compact JSON, with a timestamp per field:
+
+- Reads don't take any lock. Each slot has a sequence number (a seqlock):
+  the writers make it odd while they write the slot, and even when they are
+  done. A reader retries when the number was odd or it changed while
+  reading, so it never gets a half written state.
+- Writes are serialized with flock on the file (and a lock for the threads
+  of the same process).
+- The fields older than the TTL are ignored. A slot whose fields are all
+  expired is reused for another device, and when the probe sequence is
+  full, the least recently updated device is evicted.
+
+Example:
+    >>> cache = DeviceStateCache("/dev/shm/gendev_state")
+    >>> mch = NATMCH("172.30.5.238", [ConnType.ETHER], state_cache=cache)
+    >>> mch.device_info()
+    >>> cache.get("172.30.5.238")["device_info"]["Board"]["fw_ver"]
+    'V2.21.8'
+"""
+
+import os
+import json
+import mmap
+import fcntl
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+from .gendev_clock import default_clock
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+_MAGIC = b"GDSTATE1"
+# Magic, number of slots and size of each slot
+_HEADER = struct.Struct("<8sII")
+_HEADER_SIZE = 64
+# Sequence number, hash of the device, time of the last write and length of
+# the state
+_SLOT = struct.Struct("<QQdI4x")
+_SEQ = struct.Struct("<Q")
+# Slots checked for each device
+_PROBES = 8
+# Lock-free attempts of a read before waiting for the writers
+_READ_RETRIES = 64
+
+
+def _key_hash(device: str) -> int:
+    digest = hashlib.blake2b(device.encode("utf-8"), digest_size=8).digest()
+    # 0 marks the empty slots
+    return int.from_bytes(digest, "little") or 1
+
+
+class DeviceStateCache:
+    """State of the devices, shared by the processes opening the same file."""
+
+    def __init__(
+        self,
+        path: str,
+        slots: int = 1024,
+        slot_size: int = 1024,
+        ttl: float = 300.0,
+        clock=None,
+    ):
+        """Class constructor.
+
+        Args:
+            path: file shared by the processes (i.e. under /dev/shm, so it's
+                  kept in memory). It is created when it doesn't exist.
+            slots: maximum number of devices. Ignored if the file exists.
+            slot_size: bytes of each slot, it limits the size of the state
+                       of a device. Ignored if the file exists.
+            ttl: seconds a field of the state is valid after it's written.
+            clock: clock for the timestamps (its wall clock, comparable among
+                   processes). The default clock of the library is used when
+                   not given.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock if clock is not None else default_clock
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with self._locked():
+                header = os.pread(self._fd, _HEADER.size, 0)
+                if len(header) == _HEADER.size and header.startswith(_MAGIC):
+                    _, slots, slot_size = _HEADER.unpack(header)
+                else:
+                    os.ftruncate(self._fd, _HEADER_SIZE + slots * slot_size)
+                    os.pwrite(self._fd, _HEADER.pack(_MAGIC, slots, slot_size), 0)
+            self.slots = slots
+            self.slot_size = slot_size
+            self._mm = mmap.mmap(self._fd, _HEADER_SIZE + slots * slot_size)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, index: int) -> int:
+        return _HEADER_SIZE + index * self.slot_size
+
+    def _probes(self, key_hash: int):
+        start = key_hash % self.slots
+        return [(start + i) % self.slots for i in range(min(_PROBES, self.slots))]
+
+    def _read_slot(self, index: int, locked: bool = False) -> tuple:
+        """Header and content of a slot, consistent with each other."""
+        offset = self._offset(index)
+        capacity = self.slot_size - _SLOT.size
+        for _ in range(1 if locked else _READ_RETRIES):
+            seq, key_hash, stamp, length = _SLOT.unpack_from(self._mm, offset)
+            if seq % 2:
+                continue
+            start = offset + _SLOT.size
+            payload = self._mm[start : start + min(length, capacity)]
+            if locked or _SEQ.unpack_from(self._mm, offset)[0] == seq:
+                return key_hash, stamp, payload
+        # Too many concurrent writes, wait for them
+        with self._locked():
+            return self._read_slot(index, locked=True)
+
+    def _write_slot(self, index: int, key_hash: int, stamp: float, payload: bytes):
+        offset = self._offset(index)
+        seq = _SEQ.unpack_from(self._mm, offset)[0]
+        _SEQ.pack_into(self._mm, offset, seq + 1)
+        _SLOT.pack_into(self._mm, offset, seq + 1, key_hash, stamp, len(payload))
+        start = offset + _SLOT.size
+        self._mm[start : start + len(payload)] = payload
+        _SEQ.pack_into(self._mm, offset, seq + 2)
+
+    def _find(self, device: str, locked: bool = False) -> tuple:
+        """Slot and stored fields of a device (None, {} if it's not stored)."""
+        key_hash = _key_hash(device)
+        for index in self._probes(key_hash):
+            slot_hash, _, payload = self._read_slot(index, locked)
+            if slot_hash == key_hash and payload:
+                entry = json.loads(payload)
+                if entry["key"] == device:
+                    return index, entry["fields"]
+        return None, dict()
+
+    def _fresh(self, fields: dict) -> dict:
+        now = self.clock.time()
+        return {
+            name: value
+            for name, (stamp, value) in fields.items()
+            if now - stamp < self.ttl
+        }
+
+    def get(self, device: str) -> dict:
+        """State of a device.
+
+        Returns:
+            A dictionary with the fields of the state that didn't expire, and
+            the time of the last update of the device (*last_seen*, seconds
+            since the epoch). None when there's nothing valid for the device.
+        """
+        _, fields = self._find(device)
+        state = self._fresh(fields)
+        if not state:
+            return None
+        state["last_seen"] = max(stamp for stamp, _ in fields.values())
+        return state
+
+    def _store(self, device: str, index: int, fields: dict):
+        now = self.clock.time()
+        payload = json.dumps(
+            {"key": device, "fields": fields}, separators=(",", ":")
+        ).encode("utf-8")
+        if len(payload) > self.slot_size - _SLOT.size:
+            raise ValueError(
+                "The state of {} doesn't fit in a slot ({} bytes)".format(
+                    device, len(payload)
+                )
+            )
+        key_hash = _key_hash(device)
+        if index is None:
+            # An empty slot, one whose state expired, or the oldest one
+            candidates = []
+            for probe in self._probes(key_hash):
+                slot_hash, stamp, _ = self._read_slot(probe, locked=True)
+                if slot_hash == 0 or now - stamp >= self.ttl:
+                    index = probe
+                    break
+                candidates.append((stamp, probe))
+            else:
+                index = min(candidates)[1]
+        self._write_slot(index, key_hash, now, payload)
+
+    def update(self, device: str, **fields):
+        """Set some fields of the state of a device, keeping the rest.
+
+        Example:
+            >>> cache.update("172.30.5.238", health="up", is_mch=True)
+        """
+        with self._locked():
+            index, stored = self._find(device, locked=True)
+            now = self.clock.time()
+            stored = {
+                name: entry
+                for name, entry in stored.items()
+                if now - entry[0] < self.ttl
+            }
+            for name, value in fields.items():
+                stored[name] = [now, value]
+            self._store(device, index, stored)
+
+    def discard(self, device: str, *fields):
+        """Remove some fields of the state of a device, or all of them."""
+        with self._locked():
+            index, stored = self._find(device, locked=True)
+            if index is None:
+                return
+            if fields:
+                for name in fields:
+                    stored.pop(name, None)
+                self._store(device, index, stored)
+            else:
+                self._write_slot(index, 0, 0.0, b"")
+
+    def close(self):
+        """Unmap the file. The state is kept for the other processes."""
+        if self._fd is not None:
+            self._mm.close()
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_clock.py
+~~~~~~~~~~~~~~~
+
+Clocks used for every wait and time measurement of the library.
+
+The operations with the devices are full of fixed waits: the seconds given to
+the CLI of the MCH to answer a command, the erase of the flash during a
+firmware update, or the reboot of the device. The classes of the library take
+the clock as an argument, so the waits can be simulated:
+
+- SystemClock: the real time, used by default.
+- VirtualClock: the time only moves when something sleeps on it (or when it
+  is advanced), so the waits take no real time. Use it with a scripted device
+  to test long operations (i.e. a firmware update) in milliseconds.
+
+The waits for I/O (the timeouts of the sockets) are not simulated: they are
+bounded by the clock (i.e. using a Deadline), but the devices are expected to
+answer in real time.
+
+Example:
+    >>> clock = VirtualClock()
+    >>> mch = NATMCHTelnet("172.30.5.238", session=fake_session, clock=clock)
+    >>> mch.update_fw("V2.21.8")
+    (True,)
+    >>> clock.monotonic()
+    85.0
+"""
+
+import time
+import threading
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class SystemClock:
+    """Clock following the real time."""
+
+    def monotonic(self) -> float:
+        """Seconds of a monotonic clock (see time.monotonic)."""
+        return time.monotonic()
+
+    def time(self) -> float:
+        """Seconds since the epoch (see time.time)."""
+        return time.time()
+
+    def sleep(self, seconds: float):
+        """Wait for the given seconds."""
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, event: threading.Event, timeout: float = None) -> bool:
+        """Wait until the event is set, or the timeout expires.
+
+        Returns:
+            True if the event is set.
+        """
+        return event.wait(timeout)
+
+
+class VirtualClock:
+    """Clock that only moves when something sleeps on it.
+
+    The clock can be shared by several threads: each sleep moves the time of
+    all of them.
+    """
+
+    def __init__(self, start: float = 0.0, epoch: float = 1609459200.0):
+        """Class constructor.
+
+        Args:
+            start: initial value of the monotonic clock.
+            epoch: value of the wall clock (time) when the monotonic clock
+                   is 0 (by default, 2021-01-01 00:00:00 UTC).
+        """
+        self._now = start
+        self._epoch = epoch
+        self._lock = threading.Lock()
+        # Every sleep, in order (seconds)
+        self.sleeps = list()
+
+    def monotonic(self) -> float:
+        with self._lock:
+            return self._now
+
+    def time(self) -> float:
+        with self._lock:
+            return self._epoch + self._now
+
+    def advance(self, seconds: float):
+        """Move the clock forward."""
+        with self._lock:
+            self._now += max(0.0, seconds)
+
+    def sleep(self, seconds: float):
+        """Move the clock forward, without waiting."""
+        with self._lock:
+            self.sleeps.append(seconds)
+            self._now += max(0.0, seconds)
+
+    def wait(self, event: threading.Event, timeout: float = None) -> bool:
+        """Wait until the event is set, or the timeout expires.
+
+        The clock moves to the timeout, unless the event is already set.
+        Without timeout, it waits in real time for the event.
+        """
+        if event.is_set():
+            return True
+        if timeout is None:
+            return event.wait()
+        self.sleep(timeout)
+        return event.is_set()
+
+    @property
+    def slept(self) -> float:
+        """Total of seconds slept on the clock."""
+        with self._lock:
+            return sum(s for s in self.sleeps if s > 0)
+
+
+# Clock used by the library unless another one is given
+default_clock = SystemClock()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_deadline.py
+~~~~~~~~~~~~~~~~~~
+
+Deadlines and adaptive timeouts for the operations with the devices.
+
+A Deadline bounds the total time of an operation. The same object is passed
+down to every step of the operation (i.e. the requests of a web page fetch, or
+the flashing and reboot steps of a firmware update), and each step waits, at
+most, the time left until the deadline.
+
+The timeout of each individual access to a device is derived from the round
+trip times measured in the previous accesses to the same device, following
+the same approach as the retransmission timeout of TCP (RFC 6298).
+"""
+
+import math
+import threading
+from .gendev_err import ConnTimeout
+from .gendev_clock import default_clock
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class Deadline:
+    """Point in time by which an operation has to be finished.
+
+    Example:
+        >>> deadline = Deadline(120)
+        >>> mch.update_fw("2.21.8", deadline=deadline)
+    """
+
+    def __init__(self, timeout: float = None, clock=None):
+        """Class constructor.
+
+        Args:
+            timeout: seconds from now until the deadline. When None, the
+                     deadline never expires.
+            clock: clock measuring the time (see gendev_clock). The default
+                   clock of the library is used when not given.
+        """
+        self.clock = clock if clock is not None else default_clock
+        self.expires_at = None if timeout is None else self.clock.monotonic() + timeout
+
+    def remaining(self) -> float:
+        """Seconds left until the deadline (math.inf if there's no limit)."""
+        if self.expires_at is None:
+            return math.inf
+        return max(0.0, self.expires_at - self.clock.monotonic())
+
+    def expired(self) -> bool:
+        """Check whether the deadline has passed."""
+        return self.remaining() <= 0
+
+    def check(self, step: str = "the operation"):
+        """Raise an exception if the deadline has passed.
+
+        Args:
+            step: description of the step being checked, for the message of
+                  the exception.
+
+        Raises:
+            gendev_err.ConnTimeout if the deadline has passed.
+        """
+        if self.expired():
+            raise ConnTimeout("Deadline exceeded during {}".format(step))
+
+    def bound(self, seconds: float = None, step: str = "the operation") -> float:
+        """Limit the timeout of a step to the time left until the deadline.
+
+        Args:
+            seconds: timeout of the step. None means no timeout.
+            step: description of the step, see :py:meth:`check`.
+
+        Returns:
+            The timeout for the step, None when neither the step nor the
+            deadline have a limit.
+
+        Raises:
+            gendev_err.ConnTimeout if the deadline has passed.
+        """
+        self.check(step)
+        remaining = self.remaining()
+        if seconds is None:
+            return None if remaining == math.inf else remaining
+        return min(seconds, remaining)
+
+
+class RTTEstimator:
+    """Round trip time estimator for a device.
+
+    The estimator keeps a smoothed RTT and its variation. The timeout is
+    computed as *srtt + k · rttvar*, clamped to the given limits.
+    """
+
+    def __init__(
+        self,
+        initial: float = 5.0,
+        min_timeout: float = 1.0,
+        max_timeout: float = 30.0,
+        k: float = 4.0,
+    ):
+        """Class constructor.
+
+        Args:
+            initial: timeout used while there are no measurements.
+            min_timeout: lower limit of the timeout.
+            max_timeout: upper limit of the timeout.
+            k: weight of the RTT variation in the timeout.
+        """
+        self.initial = initial
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.k = k
+        self.srtt = None
+        self.rttvar = None
+
+    def update(self, sample: float):
+        """Add a new RTT measurement (seconds)."""
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+
+    def timeout(self) -> float:
+        """Timeout for the next access to the device."""
+        if self.srtt is None:
+            return self.initial
+        timeout = self.srtt + self.k * self.rttvar
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+
+class LatencyRegistry:
+    """Registry of the RTT estimators of the devices.
+
+    The estimators are indexed by any hashable key, usually a tuple with the
+    IP address of the device and the communication interface, as the RTT of
+    each interface is quite different.
+    """
+
+    def __init__(self, **estimator_args):
+        """Class constructor.
+
+        Args:
+            estimator_args: arguments given to the RTTEstimator of each
+                            device. See :py:class:`RTTEstimator`.
+        """
+        self._estimator_args = estimator_args
+        self._estimators = dict()
+        self._lock = threading.Lock()
+
+    def _estimator(self, key) -> RTTEstimator:
+        estimator = self._estimators.get(key)
+        if estimator is None:
+            estimator = self._estimators[key] = RTTEstimator(**self._estimator_args)
+        return estimator
+
+    def record(self, key, sample: float):
+        """Add a new RTT measurement (seconds) for the given key."""
+        with self._lock:
+            self._estimator(key).update(sample)
+
+    def timeout(self, key) -> float:
+        """Timeout for the next access using the given key."""
+        with self._lock:
+            return self._estimator(key).timeout()
+
+
+# Registry shared by all the device connections unless another one is given
+default_latency = LatencyRegistry()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_digest.py
+~~~~~~~~~~~~~~~~
+
+Content hashing helpers for the configuration dictionaries returned by the
+GenDev interface.
+
+The configuration of a device is returned as nested dictionaries (usually
+OrderedDicts following the order of the web page of the device). In order to
+compare configurations without walking the whole tree, a stable digest is
+computed from a canonical serialization of the data.
+"""
+
+import json
+import hashlib
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+def canonical_bytes(data, ordered: bool = False) -> bytes:
+    """Serialize a configuration structure to a canonical byte string.
+
+    Args:
+        data: any JSON serializable structure (dicts, lists, strings, ...).
+        ordered: when True, the order of the keys is kept as given. Otherwise,
+                 keys are sorted so two dictionaries with the same content
+                 produce the same output regardless of their order.
+
+    Returns:
+        The compact JSON representation of *data* encoded as UTF-8.
+    """
+    return json.dumps(
+        data,
+        sort_keys=not ordered,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+
+def config_digest(data, ordered: bool = False) -> str:
+    """Compute the content digest of a configuration structure.
+
+    Args:
+        data: any JSON serializable structure.
+        ordered: see :py:func:`canonical_bytes`.
+
+    Returns:
+        The SHA-256 hex digest of the canonical serialization of *data*.
+    """
+    return hashlib.sha256(canonical_bytes(data, ordered)).hexdigest()
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_drift.py
+~~~~~~~~~~~~~~~
+
+Dry checks of the configuration of many devices against a golden
+configuration.
+
+The configuration of each device is pulled using the *get_configuration*
+method from the GenDev interface, so any implementation of the interface can
+be checked. Devices are checked concurrently, and each category is compared
+first by its content digest: a device matching the golden configuration only
+costs a digest comparison. A detailed diff is only computed for the categories
+that don't match.
+"""
+
+import enum
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from .gendev_digest import config_digest
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+# Separator used to build the path of a parameter within the configuration.
+# Some section names of the MCH contain "/", so it can't be used here.
+PATH_SEP = "::"
+
+
+class DriftStatus(enum.Enum):
+    """Result of checking a device against the golden configuration.
+
+    - MATCH: all the categories match the golden configuration.
+    - DRIFT: at least one category differs from the golden configuration.
+    - ERROR: the configuration couldn't be retrieved from the device.
+    - TIMEOUT: the check didn't finish within the given time.
+    """
+
+    MATCH = "match"
+    DRIFT = "drift"
+    ERROR = "error"
+    TIMEOUT = "timeout"
+
+
+def flatten_config(data, prefix: str = "") -> OrderedDict:
+    """Flatten a nested configuration dictionary.
+
+    Args:
+        data: nested dictionary as returned by *get_configuration*.
+        prefix: path of *data* within the parent dictionary.
+
+    Returns:
+        An OrderedDict indexed by the path of each parameter (keys joined
+        using PATH_SEP). Values that are not dictionaries (including lists)
+        are considered leaves.
+    """
+    flat = OrderedDict()
+    for key, value in data.items():
+        path = "{}{}{}".format(prefix, PATH_SEP, key) if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten_config(value, path))
+        else:
+            flat[path] = value
+    return flat
+
+
+def diff_config(expected: dict, given: dict) -> OrderedDict:
+    """Compare two configuration dictionaries.
+
+    Args:
+        expected: the reference configuration.
+        given: the configuration to check.
+
+    Returns:
+        An OrderedDict indexed by the path of the parameters that don't match.
+        For each key, the expected and the given values are provided. A
+        parameter missing on one side is reported as None.
+    """
+    flat_expected = flatten_config(expected)
+    flat_given = flatten_config(given)
+    diff = OrderedDict()
+
+    for path, value in flat_expected.items():
+        given_value = flat_given.get(path)
+        if given_value != value:
+            diff[path] = {"expected": value, "given": given_value}
+    for path, value in flat_given.items():
+        if path not in flat_expected:
+            diff[path] = {"expected": None, "given": value}
+
+    return diff
+
+
+class GoldenProfile:
+    """Golden configuration of a device type.
+
+    The profile contains, for each configuration category, the dictionary
+    that *get_configuration* should return for a well configured device. The
+    digest of each category is computed once, when the profile is built.
+    """
+
+    def __init__(self, categories: dict):
+        """Class constructor.
+
+        Args:
+            categories: dictionary indexed by the configuration category
+                        (i.e. basecfg, pcie, backplane) containing the expected
+                        output of *get_configuration* for that category.
+        """
+        self.categories = OrderedDict(categories)
+        self.digests = {
+            category: config_digest(data) for category, data in self.categories.items()
+        }
+
+    def check(self, category: str, given: dict) -> OrderedDict:
+        """Check the configuration of a category against the profile.
+
+        Args:
+            category: configuration category.
+            given: configuration retrieved from the device.
+
+        Returns:
+            An empty OrderedDict when the configuration matches, otherwise,
+            the output of :py:func:`diff_config`.
+        """
+        if config_digest(given) == self.digests[category]:
+            return OrderedDict()
+        return diff_config(self.categories[category], given)
+
+
+class DeviceDrift:
+    """Result of the dry check of a device."""
+
+    def __init__(self, name: str, status: DriftStatus, categories=None, error=None):
+        """Class constructor.
+
+        Args:
+            name: identifier of the device.
+            status: result of the check.
+            categories: dictionary indexed by the categories that don't match
+                        the golden configuration, with the diff as value.
+            error: message describing the failure when status is ERROR.
+        """
+        self.name = name
+        self.status = status
+        self.categories = categories if categories is not None else OrderedDict()
+        self.error = error
+
+    def to_dict(self) -> dict:
+        """Compact representation of the result."""
+        result = {"status": self.status.value}
+        if self.categories:
+            result["categories"] = self.categories
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+class DriftReport:
+    """Report of a dry check run over several devices."""
+
+    def __init__(self):
+        self.results = OrderedDict()
+
+    def add(self, result: DeviceDrift):
+        """Add the result of a device to the report."""
+        self.results[result.name] = result
+
+    def by_status(self, status: DriftStatus) -> list:
+        """Names of the devices whose check ended with the given status."""
+        return [name for name, res in self.results.items() if res.status == status]
+
+    def summary(self) -> dict:
+        """Number of devices for each status."""
+        return {status.value: len(self.by_status(status)) for status in DriftStatus}
+
+    def to_dict(self) -> dict:
+        """Compact representation of the report.
+
+        Devices matching the golden configuration are only listed by name, the
+        details are given for the rest.
+        """
+        return {
+            "summary": self.summary(),
+            "match": self.by_status(DriftStatus.MATCH),
+            "devices": OrderedDict(
+                (name, res.to_dict())
+                for name, res in self.results.items()
+                if res.status != DriftStatus.MATCH
+            ),
+        }
+
+
+class DriftEngine:
+    """Run dry checks against a golden configuration over many devices.
+
+    Example:
+        >>> golden = GoldenProfile({"basecfg": golden_basecfg})
+        >>> engine = DriftEngine(golden, max_workers=32)
+        >>> report = engine.run({"mch-01": mch1, "mch-02": mch2}, timeout=600)
+        >>> report.summary()
+        {'match': 1, 'drift': 1, 'error': 0, 'timeout': 0}
+    """
+
+    def __init__(self, golden: GoldenProfile, max_workers: int = 16):
+        """Class constructor.
+
+        Args:
+            golden: the golden configuration.
+            max_workers: maximum number of devices checked at the same time.
+        """
+        self.golden = golden
+        self.max_workers = max_workers
+
+    def check_device(self, name: str, device) -> DeviceDrift:
+        """Check a device against the golden configuration.
+
+        The categories of a device are retrieved one after the other, as the
+        web server of the MCHs doesn't cope well with concurrent access.
+
+        Args:
+            name: identifier of the device.
+            device: object implementing the *get_configuration* method.
+
+        Returns:
+            A DeviceDrift object with the result of the check.
+        """
+        drifted = OrderedDict()
+        try:
+            for category in self.golden.categories:
+                diff = self.golden.check(category, device.get_configuration(category))
+                if diff:
+                    drifted[category] = diff
+        except Exception as e:
+            return DeviceDrift(name, DriftStatus.ERROR, drifted, error=str(e))
+
+        status = DriftStatus.DRIFT if drifted else DriftStatus.MATCH
+        return DeviceDrift(name, status, drifted)
+
+    def run(self, devices: dict, timeout: float = None) -> DriftReport:
+        """Check a set of devices concurrently.
+
+        Args:
+            devices: dictionary indexed by the device identifier containing
+                     the objects implementing *get_configuration*.
+            timeout: maximum number of seconds for the whole run. The devices
+                     that are not checked in time are reported as TIMEOUT.
+
+        Returns:
+            A DriftReport with the results in the same order as *devices*.
+        """
+        report = DriftReport()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = OrderedDict(
+            (name, executor.submit(self.check_device, name, device))
+            for name, device in devices.items()
+        )
+        wait(futures.values(), timeout=timeout)
+
+        for name, future in futures.items():
+            if future.done() and not future.cancelled():
+                report.add(future.result())
+            else:
+                future.cancel()
+                report.add(DeviceDrift(name, DriftStatus.TIMEOUT))
+
+        # Don't block on the checks still running after the timeout
+        executor.shutdown(wait=False)
+
+        return report
@@ -12,6 +12,9 @@ __all__ = [
     "ConnTimeout",
     "NoRouteToDevice",
     "FeatureNotSupported",
+    "DeviceUnavailable",
+    "CassetteMismatch",
+    "DriverNotFound",
 ]
 __author__ = "Felipe Torres González"
 __copyright__ = "Copyright 2021, ESS MCH Tools"
@@ -113,3 +116,59 @@ class WebChanged(Exception):
             return "WebChanged, {0} ".format(self.message)
         else:
             return "WebChanged has been raised"
+
+
+class DeviceUnavailable(NoRouteToDevice):
+    """The device is known to be unreachable.
+
+    This exception is raised without trying to access the device when the
+    previous attempts failed and the device is still in its backoff period.
+    It is a subclass of NoRouteToDevice, so the code handling unreachable
+    devices doesn't need to distinguish both cases.
+    """
+
+    def __str__(self):
+        if self.message:
+            return "DeviceUnavailable, {0} ".format(self.message)
+        else:
+            return "DeviceUnavailable has been raised"
+
+
+class CassetteMismatch(Exception):
+    """The replayed session doesn't match the recorded one.
+
+    This exception is raised when replaying a recorded session, and the
+    operations requested to the transport differ from the recorded ones.
+    """
+
+    def __init__(self, *args):
+        if args:
+            self.message = args[0]
+        else:
+            self.message = None
+
+    def __str__(self):
+        if self.message:
+            return "CassetteMismatch, {0} ".format(self.message)
+        else:
+            return "CassetteMismatch has been raised"
+
+
+class DriverNotFound(Exception):
+    """Driver not found exception.
+
+    This exception is raised when there's no driver (implementation of the
+    GenDev interface) registered for the given manufacturer and device model.
+    """
+
+    def __init__(self, *args):
+        if args:
+            self.message = args[0]
+        else:
+            self.message = None
+
+    def __str__(self):
+        if self.message:
+            return "DriverNotFound, {0} ".format(self.message)
+        else:
+            return "DriverNotFound has been raised"
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_export.py
+~~~~~~~~~~~~~~~~
+
+Streaming export of the results of fleet operations as JSON Lines.
+
+The output of each device (*device_info* and/or *get_configuration*) is
+written as a line of JSON as soon as it is ready, instead of keeping the
+results of the whole fleet in memory until the end of the run:
+
+- The records are written by a single thread, fed through a bounded queue.
+  When the output is slower than the devices, the polling threads wait for
+  room in the queue (backpressure), so the memory used doesn't depend on the
+  number of devices.
+- Each record is flushed after it is written, so the records already written
+  survive a crash of the process. Compressed files (gzip) are flushed with a
+  sync flush, so they can be read even if they were never closed.
+- The records can be read back one by one with :py:func:`read_records`,
+  while the file is being written or after a crash (a truncated last record
+  is ignored).
+- A compressed file left by a crash can be appended to: its last gzip member
+  is closed first, keeping its complete records (see :py:func:`close_gzip`).
+
+Each record of :py:func:`export_fleet` looks like::
+
+    {"device": "mch-01", "timestamp": 1634567890.1,
+     "data": {"device_info": {...}, "basecfg": {...}},
+     "errors": {"pcie": "ConnTimeout, ..."}}
+
+Example:
+    >>> export_fleet({"mch-01": mch1, "mch-02": mch2}, "fleet.jsonl.gz",
+    ...              targets=["device_info", "basecfg"])
+    {'ok': 2, 'error': 0}
+    >>> for record in read_records("fleet.jsonl.gz"):
+    ...     print(record["device"])
+"""
+
+import os
+import gzip
+import json
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .gendev_interface import DEVICE_INFO, read_target
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+_GZIP_MAGIC = b"\x1f\x8b"
+# zlib window bits of the gzip format
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_CHUNK_SIZE = 64 * 1024
+# Record that stops the writer thread
+_STOP = object()
+
+
+class JSONLinesWriter:
+    """Writes records as JSON Lines, flushing each one."""
+
+    def __init__(self, path: str, compress: bool = None, append: bool = False):
+        """Class constructor.
+
+        Args:
+            path: path of the output file.
+            compress: compress the output with gzip. When not given, the
+                      output is compressed if *path* ends with ".gz".
+            append: add the records to an existing file.
+        """
+        self.path = path
+        self.compress = path.endswith(".gz") if compress is None else compress
+        mode = "ab" if append else "wb"
+        if append and self.compress and os.path.exists(path):
+            close_gzip(path)
+        self._file = open(path, mode)
+        self._gzip = (
+            gzip.GzipFile(fileobj=self._file, mode=mode) if self.compress else None
+        )
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        """Write a record, and flush it to the file."""
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        if self._gzip is not None:
+            self._gzip.write(line.encode("utf-8"))
+            # The data written so far can be decompressed without the trailer
+            self._gzip.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            self._file.write(line.encode("utf-8"))
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        if self._gzip is not None:
+            self._gzip.close()
+        self._file.close()
+
+
+def _unfinished_member(f) -> int:
+    """Offset of the first gzip member without its trailer, None if all the
+    members of the file are complete."""
+    start = offset = 0
+    decompressor = zlib.decompressobj(_GZIP_WBITS)
+    for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+        offset += len(chunk)
+        while chunk:
+            try:
+                decompressor.decompress(chunk)
+            except zlib.error:
+                return start
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data
+            start = offset - len(chunk)
+            decompressor = zlib.decompressobj(_GZIP_WBITS)
+    return start if start < offset else None
+
+
+def close_gzip(path: str) -> bool:
+    """Close the last member of a gzip file left unfinished by a crash.
+
+    The records of a member without its trailer can be read, but not the
+    members appended after it. The complete records of the unfinished member
+    are compressed again in a closed member, and the rest is dropped.
+
+    Args:
+        path: path of the file.
+
+    Returns:
+        True if the file had an unfinished member.
+    """
+    with open(path, "r+b") as f:
+        start = _unfinished_member(f)
+        if start is None:
+            return False
+        with tempfile.TemporaryFile() as records:
+            f.seek(start)
+            decompressor = zlib.decompressobj(_GZIP_WBITS)
+            tail = b""
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                try:
+                    data = tail + decompressor.decompress(chunk)
+                except zlib.error:
+                    break
+                end = data.rfind(b"\n") + 1
+                records.write(data[:end])
+                tail = data[end:]
+            f.seek(start)
+            f.truncate()
+            if records.tell():
+                records.seek(0)
+                with gzip.GzipFile(fileobj=f, mode="wb") as member:
+                    shutil.copyfileobj(records, member)
+    return True
+
+
+class StreamingExporter:
+    """Writes records from many threads through a bounded queue.
+
+    Example:
+        >>> with StreamingExporter(JSONLinesWriter("out.jsonl")) as exporter:
+        ...     exporter.put({"device": "mch-01", "data": {}})
+    """
+
+    def __init__(self, writer: JSONLinesWriter, max_pending: int = 64):
+        """Class constructor.
+
+        Args:
+            writer: destination of the records.
+            max_pending: maximum number of records waiting to be written.
+                         *put* blocks while the queue is full.
+        """
+        self.writer = writer
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._worker = threading.Thread(target=self._serve, daemon=True)
+        self._worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _serve(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                break
+            if self._error is not None:
+                # Keep draining, so no producer blocks forever
+                continue
+            try:
+                self.writer.write(record)
+            except Exception as e:
+                self._error = e
+
+    def put(self, record):
+        """Queue a record, waiting while the queue is full.
+
+        Raises:
+            The error of the writer, if a previous record couldn't be written.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(record)
+
+    def close(self):
+        """Write the queued records and close the writer.
+
+        Raises:
+            The error of the writer, if a record couldn't be written.
+        """
+        if self._worker.is_alive():
+            self._queue.put(_STOP)
+            self._worker.join()
+            self.writer.close()
+        if self._error is not None:
+            raise self._error
+
+
+def _collect(name: str, device, targets) -> OrderedDict:
+    record = OrderedDict(
+        [("device", name), ("timestamp", time.time()), ("data", OrderedDict())]
+    )
+    errors = OrderedDict()
+    for target in targets:
+        try:
+            record["data"][target] = read_target(device, target)
+        except Exception as e:
+            errors[target] = str(e)
+    if errors:
+        record["errors"] = errors
+    return record
+
+
+def export_fleet(
+    devices,
+    path: str,
+    targets=(DEVICE_INFO,),
+    max_workers: int = 16,
+    max_pending: int = 64,
+    compress: bool = None,
+    append: bool = False,
+) -> dict:
+    """Poll many devices, writing the output of each one as soon as it's ready.
+
+    Args:
+        devices: dictionary (or iterable of pairs) of device identifier ->
+                 object implementing the GenDev interface. An iterable is
+                 consumed as the devices are polled, so the inventory doesn't
+                 need to be loaded at once.
+        path: path of the output file (see JSONLinesWriter).
+        targets: *device_info* and/or configuration categories to export.
+        max_workers: maximum number of devices polled at the same time.
+        max_pending: maximum number of records waiting to be written.
+        compress: see JSONLinesWriter.
+        append: see JSONLinesWriter.
+
+    Returns:
+        The number of devices exported without errors (*ok*) and with errors
+        in any target (*error*).
+    """
+    items = devices.items() if isinstance(devices, dict) else devices
+    summary = {"ok": 0, "error": 0}
+    lock = threading.Lock()
+    # Devices submitted but not finished yet, so the pending work doesn't
+    # grow with the size of the fleet
+    slots = threading.BoundedSemaphore(max_workers * 2)
+    writer = JSONLinesWriter(path, compress=compress, append=append)
+
+    with StreamingExporter(writer, max_pending) as exporter:
+
+        def export(name, device):
+            try:
+                record = _collect(name, device, targets)
+                exporter.put(record)
+                with lock:
+                    summary["error" if "errors" in record else "ok"] += 1
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for name, device in items:
+                slots.acquire()
+                executor.submit(export, name, device)
+
+    return summary
+
+
+def read_records(path: str):
+    """Read the records of a JSON Lines file, one by one.
+
+    Compressed files are detected by their content. A file still being
+    written, or left by a crash, can be read: the records are read up to the
+    last complete one.
+
+    Args:
+        path: path of the file.
+
+    Yields:
+        Each record of the file.
+    """
+    with open(path, "rb") as raw:
+        compressed = raw.read(2) == _GZIP_MAGIC
+        raw.seek(0)
+        stream = gzip.GzipFile(fileobj=raw, mode="rb") if compressed else raw
+        try:
+            for line in stream:
+                if not line.endswith(b"\n"):
+                    # Truncated record
+                    break
+                yield json.loads(line)
+        except (EOFError, zlib.error):
+            # Compressed file without the trailer (not closed), maybe
+            # followed by other members (see close_gzip)
+            pass
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_governor.py
+~~~~~~~~~~~~~~~~~~
+
+Concurrency and rate limits for the operations with the devices.
+
+Running operations in parallel over a fleet of devices can overload the shared
+infrastructure: the server providing the firmware images, the links of the
+management network, or the devices themselves (i.e. the web server of the NAT
+MCHs rejects concurrent accesses).
+
+The governor keeps the limits of each resource. The resources are grouped in
+scopes, and each resource is identified by its scope and a key:
+
+- *global*: the whole fleet (the key is always None).
+- *server*: an external server used by the operation (i.e. the TFTP server).
+- *crate*: the devices sharing a crate, so its links.
+- *device*: a single device.
+
+Each resource can limit the number of operations running at the same time,
+and the rate at which they start (token bucket). An operation declares the
+resources it uses, and waits until all of them allow it to run. The resources
+are always acquired in the order of SCOPES, so operations sharing resources
+can't block each other.
+
+The resources can also be acquired in several nested *limit* calls, as long
+as each call only takes scopes after the ones already held. The NAT MCHs do
+it in two phases: the global, server and crate resources for the whole
+operation, and then the device for each communication interface tried. The
+operations that an interface multiplexes over its connection skip the second
+phase (see nat_mch.MULTIPLEXED_OPS).
+
+Example:
+    >>> governor = Governor()
+    >>> governor.set_limit("server", concurrency=4, rate=0.5, burst=2)
+    >>> with governor.limit({"device": "172.30.5.238",
+    ...                      "server": "172.30.4.69"}):
+    ...     mch.update_fw("V2.21.8")
+"""
+
+import math
+import threading
+from contextlib import contextmanager
+from .gendev_err import ConnTimeout
+from .gendev_deadline import Deadline
+from .gendev_clock import default_clock
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+# Order of acquisition of the resources
+SCOPES = ("global", "server", "crate", "device")
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    The bucket is refilled at *rate* tokens per second, up to *burst* tokens.
+    Each operation takes a token to start.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0, clock=None):
+        """Class constructor.
+
+        Args:
+            rate: tokens added per second.
+            burst: capacity of the bucket (it starts full).
+            clock: clock used to refill the bucket and to wait for tokens.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock if clock is not None else default_clock
+        self._tokens = burst
+        self._updated = self.clock.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens from the bucket, without waiting.
+
+        Returns:
+            0 if the tokens were taken, or the seconds to wait until they are
+            available.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0, deadline: Deadline = None):
+        """Take tokens from the bucket, waiting until they are available.
+
+        Raises:
+            gendev_err.ConnTimeout if the deadline expires while waiting.
+        """
+        deadline = Deadline(clock=self.clock) if deadline is None else deadline
+        wait = self.try_acquire(tokens)
+        while wait > 0:
+            if wait > deadline.remaining():
+                raise ConnTimeout("Rate limit exceeded until the deadline")
+            self.clock.sleep(wait)
+            wait = self.try_acquire(tokens)
+
+
+class ResourceLimit:
+    """Limits of a single resource."""
+
+    def __init__(
+        self,
+        concurrency: int = None,
+        rate: float = None,
+        burst: float = 1.0,
+        clock=None,
+    ):
+        """Class constructor.
+
+        Args:
+            concurrency: maximum number of operations running at the same
+                         time. None for no limit.
+            rate: maximum number of operations started per second. None for
+                  no limit.
+            burst: operations that can be started at once, in spite of the
+                   rate.
+            clock: clock of the rate limiter.
+        """
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self._slots = (
+            threading.BoundedSemaphore(concurrency) if concurrency is not None else None
+        )
+        self._bucket = TokenBucket(rate, burst, clock) if rate is not None else None
+
+    def acquire(self, deadline: Deadline):
+        if self._slots is not None:
+            remaining = deadline.remaining()
+            if not self._slots.acquire(
+                timeout=None if remaining == math.inf else max(remaining, 0)
+            ):
+                raise ConnTimeout("Concurrency limit exceeded until the deadline")
+        if self._bucket is not None:
+            try:
+                self._bucket.acquire(deadline=deadline)
+            except ConnTimeout:
+                self.release()
+                raise
+
+    def release(self):
+        if self._slots is not None:
+            self._slots.release()
+
+
+class Governor:
+    """Registry of the limits of the shared resources."""
+
+    def __init__(self, clock=None):
+        """Class constructor.
+
+        Args:
+            clock: clock of the rate limiters (see gendev_clock). The default
+                   clock of the library is used when not given.
+        """
+        self.clock = clock if clock is not None else default_clock
+        # Limits applied to every resource of a scope: scope -> arguments
+        self._defaults = dict()
+        # Limits set for specific resources: (scope, key) -> ResourceLimit
+        self._specific = dict()
+        # Limits created from the defaults: (scope, key) -> ResourceLimit
+        self._scoped = dict()
+        self._lock = threading.Lock()
+        # Resources held by each thread, so nested operations don't wait for
+        # themselves
+        self._held = threading.local()
+
+    def set_limit(
+        self,
+        scope: str,
+        key=None,
+        concurrency: int = None,
+        rate: float = None,
+        burst: float = 1.0,
+    ):
+        """Set the limits of a resource.
+
+        Args:
+            scope: one of SCOPES.
+            key: identifier of the resource within the scope. When it is not
+                 given, the limits apply to every resource of the scope (each
+                 one with its own counters) without specific limits.
+            concurrency: see ResourceLimit.
+            rate: see ResourceLimit.
+            burst: see ResourceLimit.
+        """
+        if scope not in SCOPES:
+            raise ValueError("Unknown scope {}".format(scope))
+        with self._lock:
+            if key is None and scope != "global":
+                self._defaults[scope] = dict(
+                    concurrency=concurrency, rate=rate, burst=burst, clock=self.clock
+                )
+                # Resources using the previous defaults get the new ones
+                for resource in [r for r in self._scoped if r[0] == scope]:
+                    del self._scoped[resource]
+            else:
+                self._specific[(scope, key)] = ResourceLimit(
+                    concurrency, rate, burst, self.clock
+                )
+
+    def _limit(self, scope: str, key) -> ResourceLimit:
+        with self._lock:
+            limit = self._specific.get((scope, key), self._scoped.get((scope, key)))
+            if limit is None:
+                defaults = self._defaults.get(scope)
+                if defaults is None:
+                    return None
+                limit = self._scoped[(scope, key)] = ResourceLimit(**defaults)
+            return limit
+
+    @contextmanager
+    def limit(self, resources: dict, deadline: Deadline = None):
+        """Context manager running an operation within the limits.
+
+        The resources are acquired in the order of SCOPES. The resources
+        already held by the thread (in an outer call) are not acquired again,
+        so the nested calls must only add scopes after the held ones.
+
+        Args:
+            resources: dictionary scope -> key of the resources used by the
+                       operation. The global scope is always used.
+            deadline: limit for waiting and running the operation.
+
+        Raises:
+            gendev_err.ConnTimeout if the deadline expires while waiting.
+        """
+        deadline = Deadline(clock=self.clock) if deadline is None else deadline
+        held = self._held.__dict__.setdefault("resources", set())
+        resources = dict(resources, **{"global": None})
+        acquired = list()
+        try:
+            for scope in SCOPES:
+                if scope not in resources or (scope, resources[scope]) in held:
+                    continue
+                limit = self._limit(scope, resources[scope])
+                if limit is None:
+                    continue
+                limit.acquire(deadline)
+                acquired.append(((scope, resources[scope]), limit))
+                held.add((scope, resources[scope]))
+            yield
+        finally:
+            for resource, limit in reversed(acquired):
+                held.discard(resource)
+                limit.release()
+
+
+# Governor shared by all the devices unless another one is given. The NAT
+# MCHs don't support concurrent accesses, but through the interfaces that
+# multiplex them (see nat_mch.MULTIPLEXED_OPS).
+default_governor = Governor()
+default_governor.set_limit("device", concurrency=1)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_health.py
+~~~~~~~~~~~~~~~~
+
+Health tracking of the devices using a circuit breaker per device.
+
+Accessing a device that is down costs the whole connection timeout. When
+running operations over many devices, that time adds up on every run. This
+module keeps track of the devices that failed recently, so the following
+attempts fail fast instead of waiting for the timeout again. The devices that
+are down are retried after a backoff period that grows exponentially while
+the device keeps failing.
+
+Each device goes through the following states:
+
+- CLOSED: the device is healthy, every access is allowed.
+- OPEN: the device failed, accesses fail fast until the backoff expires.
+- HALF_OPEN: the backoff expired, a single access (probe) is allowed. If it
+  succeeds, the device goes back to CLOSED, otherwise it goes back to OPEN
+  with a longer backoff.
+"""
+
+import enum
+import socket
+import threading
+from .gendev_err import DeviceUnavailable
+from .gendev_clock import default_clock
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class BreakerState(enum.Enum):
+    """States of the circuit breaker of a device."""
+
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+def tcp_probe(host: str, port: int = 80, timeout: float = 1.0) -> bool:
+    """Check whether a device accepts TCP connections.
+
+    Args:
+        host: IP address or hostname of the device.
+        port: TCP port to connect to (the web server by default).
+        timeout: maximum number of seconds to wait for the connection.
+
+    Returns:
+        True if the connection was established.
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class CircuitBreaker:
+    """Circuit breaker for a single device.
+
+    This class is not thread safe by itself, use it through the
+    HealthRegistry.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 1,
+        backoff: float = 5.0,
+        max_backoff: float = 600.0,
+        factor: float = 2.0,
+        clock=None,
+    ):
+        """Class constructor.
+
+        Args:
+            failure_threshold: number of consecutive failures that open the
+                               circuit.
+            backoff: seconds to wait after the first failure before allowing
+                     a new access to the device.
+            max_backoff: upper limit for the backoff period.
+            factor: multiplier applied to the backoff after each failed probe.
+            clock: clock measuring the backoff (see gendev_clock). The
+                   default clock of the library is used when not given.
+        """
+        self.failure_threshold = failure_threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.factor = factor
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.backoff = backoff
+        self.retry_at = 0.0
+        self.clock = clock if clock is not None else default_clock
+
+    def allow(self) -> bool:
+        """Check if an access to the device is allowed now.
+
+        When the backoff period of an open circuit has expired, the circuit
+        goes to HALF_OPEN and the caller is allowed to probe the device. The
+        rest of the callers keep failing fast until the probe finishes, or
+        until another backoff period passes without any result.
+        """
+        if self.state == BreakerState.CLOSED:
+            return True
+        now = self.clock.monotonic()
+        if now < self.retry_at:
+            return False
+        self.state = BreakerState.HALF_OPEN
+        # Don't let a probe that never reports block the device forever
+        self.retry_at = now + self.backoff
+        return True
+
+    def record_success(self):
+        """A device access succeeded."""
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.backoff = self.base_backoff
+
+    def record_failure(self):
+        """A device access failed."""
+        self.failures += 1
+        if (
+            self.state == BreakerState.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            if self.state == BreakerState.HALF_OPEN:
+                self.backoff = min(self.backoff * self.factor, self.max_backoff)
+            self.state = BreakerState.OPEN
+            self.retry_at = self.clock.monotonic() + self.backoff
+
+    def retry_in(self) -> float:
+        """Seconds until the device can be accessed again."""
+        if self.state == BreakerState.CLOSED:
+            return 0.0
+        return max(0.0, self.retry_at - self.clock.monotonic())
+
+
+def _describe(device) -> str:
+    if isinstance(device, tuple):
+        return "{} ({})".format(*device)
+    return str(device)
+
+
+class HealthRegistry:
+    """Registry with the health of the devices.
+
+    A single registry should be shared by all the connections of the program
+    (see default_registry). The devices are identified by any hashable key:
+    the interfaces of the NAT MCHs use a pair (device, transport), so a
+    transport that fails doesn't prevent trying the device with another one.
+
+    Example:
+        >>> registry.check("172.30.5.238")  # Raises if the device is down
+        >>> try:
+        ...     access_the_device()
+        ... except NoRouteToDevice:
+        ...     registry.record_failure("172.30.5.238")
+        ... else:
+        ...     registry.record_success("172.30.5.238")
+    """
+
+    def __init__(self, **breaker_args):
+        """Class constructor.
+
+        Args:
+            breaker_args: arguments given to the CircuitBreaker of each
+                          device. See :py:class:`CircuitBreaker`.
+        """
+        self._breaker_args = breaker_args
+        self._breakers = dict()
+        self._lock = threading.Lock()
+
+    def _breaker(self, device: str) -> CircuitBreaker:
+        breaker = self._breakers.get(device)
+        if breaker is None:
+            breaker = self._breakers[device] = CircuitBreaker(**self._breaker_args)
+        return breaker
+
+    def state(self, device: str) -> BreakerState:
+        """Current state of the circuit of a device."""
+        with self._lock:
+            return self._breaker(device).state
+
+    def check(self, device: str):
+        """Check whether a device can be accessed.
+
+        Args:
+            device: IP address (or any identifier) of the device.
+
+        Raises:
+            gendev_err.DeviceUnavailable if the device failed recently and it
+            is still within its backoff period.
+        """
+        with self._lock:
+            breaker = self._breaker(device)
+            if not breaker.allow():
+                raise DeviceUnavailable(
+                    "The device {} failed recently, next retry in {:.1f} s".format(
+                        _describe(device), breaker.retry_in()
+                    )
+                )
+
+    def record_success(self, device: str):
+        """Report a successful access to a device."""
+        with self._lock:
+            self._breaker(device).record_success()
+
+    def record_failure(self, device: str):
+        """Report a failed access to a device."""
+        with self._lock:
+            self._breaker(device).record_failure()
+
+    def unavailable(self) -> list:
+        """List of devices whose circuit is not closed."""
+        with self._lock:
+            return [
+                device
+                for device, breaker in self._breakers.items()
+                if breaker.state != BreakerState.CLOSED
+            ]
+
+    def probe_due(self, probe=tcp_probe) -> dict:
+        """Probe the devices whose backoff period expired.
+
+        This method is meant to be called periodically (i.e. before each
+        sweep over the devices) so the devices that recovered are detected
+        without waiting for a regular access to them.
+
+        Args:
+            probe: callable receiving the device identifier and returning
+                   True if the device is reachable. For the keys (device,
+                   transport), it receives the device.
+
+        Returns:
+            A dictionary indexed by the probed devices with the probe result.
+        """
+        with self._lock:
+            due = [
+                device
+                for device, breaker in self._breakers.items()
+                if breaker.state != BreakerState.CLOSED and breaker.allow()
+            ]
+
+        results = dict()
+        for device in due:
+            results[device] = bool(
+                probe(device[0] if isinstance(device, tuple) else device)
+            )
+            if results[device]:
+                self.record_success(device)
+            else:
+                self.record_failure(device)
+        return results
+
+
+# Registry shared by all the device connections unless another one is given
+default_registry = HealthRegistry()
@@ -31,6 +31,23 @@ __email__ = "felipe.torresgonzalez@ess.eu"
 __status__ = "Development"
 
 
+# Target of the fleet tools (i.e. gendev_watch, gendev_export) for the device
+# information, the rest of targets are configuration categories.
+DEVICE_INFO = "device_info"
+
+
+def read_target(device, target: str):
+    """Read a target of a device: its information or a configuration category.
+
+    Args:
+        device: object implementing the GenDev interface.
+        target: DEVICE_INFO or a configuration category.
+    """
+    if target == DEVICE_INFO:
+        return device.device_info()
+    return device.get_configuration(target)
+
+
 class ConnType(enum.Enum):
     """This enumeration specifies the allowed connection types.
 
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_registry.py
+~~~~~~~~~~~~~~~~~~
+
+Registry of the implementations of the GenDev interface (drivers).
+
+Each driver is identified by the manufacturer and the model of the device it
+supports. Drivers are discovered through the entry points of the installed
+packages, using the group *gendev_tools.drivers*. The name of each entry point
+is *<manufacturer>/<device model>* (case insensitive), and it points to the
+class implementing the GenDev interface. For example, in the setup.cfg of a
+package providing a new driver::
+
+    [options.entry_points]
+    gendev_tools.drivers =
+        acme/amc-42 = acme_gendev.amc42:ACMEAMC42
+
+Only the metadata of the entry points is read when looking for the drivers.
+The module of a driver is imported the first time a device using it is
+requested, so the startup time doesn't depend on the number of installed
+drivers.
+"""
+
+import importlib
+import threading
+from importlib import metadata
+from .gendev_interface import GenDevInterface
+from .gendev_err import DriverNotFound
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+ENTRY_POINT_GROUP = "gendev_tools.drivers"
+
+# Drivers shipped with the library. They are also declared as entry points,
+# but this allows using them when the library is not installed (i.e. running
+# from the source tree).
+_BUILTIN_DRIVERS = {
+    "nat/mch": "gendev_tools.nat_mch.nat_mch:NATMCH",
+}
+
+
+def _driver_key(manufacturer: str, device_model: str) -> tuple:
+    return manufacturer.strip().lower(), device_model.strip().lower()
+
+
+def _entry_points(group: str) -> list:
+    """Entry points of the given group from the installed packages."""
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return list(entry_points.select(group=group))
+    # Python < 3.10 returns a dictionary indexed by group
+    return list(entry_points.get(group, []))
+
+
+def _load_target(target: str):
+    """Import the object pointed by a string *module:attribute*."""
+    module_name, _, attributes = target.partition(":")
+    obj = importlib.import_module(module_name)
+    for attribute in attributes.split("."):
+        obj = getattr(obj, attribute)
+    return obj
+
+
+class DriverRegistry:
+    """Registry mapping (manufacturer, device model) to a driver.
+
+    Example:
+        >>> mch = drivers.create("NAT", "MCH", ip_address="172.30.5.238",
+        ...                      allowed_conn=[ConnType.TELNET])
+    """
+
+    def __init__(self, group: str = ENTRY_POINT_GROUP):
+        """Class constructor.
+
+        Args:
+            group: entry point group used to discover the drivers.
+        """
+        self.group = group
+        # Targets not loaded yet: a string "module:attribute", an entry point
+        # or a class.
+        self._targets = None
+        self._drivers = dict()
+        # Reentrant, a driver module might register drivers when imported
+        self._lock = threading.RLock()
+
+    def _discover(self) -> dict:
+        """Read the metadata of the available drivers (only the first time)."""
+        if self._targets is None:
+            targets = dict()
+            for name, target in _BUILTIN_DRIVERS.items():
+                targets[_driver_key(*name.split("/", 1))] = target
+            for entry_point in _entry_points(self.group):
+                if "/" in entry_point.name:
+                    targets[_driver_key(*entry_point.name.split("/", 1))] = entry_point
+            self._targets = targets
+        return self._targets
+
+    def register(self, manufacturer: str, device_model: str, driver):
+        """Register a driver manually.
+
+        Args:
+            manufacturer: manufacturer of the device.
+            device_model: model of the device.
+            driver: the class implementing the GenDev interface, or a string
+                    *module:class* pointing to it (imported on first use).
+        """
+        key = _driver_key(manufacturer, device_model)
+        with self._lock:
+            self._discover()[key] = driver
+            self._drivers.pop(key, None)
+
+    def available(self) -> list:
+        """List of (manufacturer, device model) with a registered driver."""
+        with self._lock:
+            return sorted(self._discover())
+
+    def loaded(self) -> list:
+        """List of (manufacturer, device model) whose driver was imported."""
+        with self._lock:
+            return sorted(self._drivers)
+
+    def get(self, manufacturer: str, device_model: str):
+        """Get the driver for a device, importing it if needed.
+
+        Args:
+            manufacturer: manufacturer of the device.
+            device_model: model of the device.
+
+        Returns:
+            The class implementing the GenDev interface for the device.
+
+        Raises:
+            gendev_err.DriverNotFound if there's no driver for the device.
+            TypeError if the registered object doesn't implement the GenDev
+            interface.
+        """
+        key = _driver_key(manufacturer, device_model)
+        with self._lock:
+            driver = self._drivers.get(key)
+            if driver is not None:
+                return driver
+
+            target = self._discover().get(key)
+            if target is None:
+                raise DriverNotFound(
+                    "No driver registered for {} {}".format(manufacturer, device_model)
+                )
+            if isinstance(target, str):
+                driver = _load_target(target)
+            elif isinstance(target, type):
+                driver = target
+            else:
+                driver = target.load()
+
+            if not (isinstance(driver, type) and issubclass(driver, GenDevInterface)):
+                raise TypeError(
+                    "The driver for {} {} doesn't implement the GenDev"
+                    " interface".format(manufacturer, device_model)
+                )
+            self._drivers[key] = driver
+
+        return driver
+
+    def create(self, manufacturer: str, device_model: str, **kwargs):
+        """Create a device using the registered driver.
+
+        Args:
+            manufacturer: manufacturer of the device.
+            device_model: model of the device.
+            kwargs: arguments for the constructor of the driver.
+
+        Returns:
+            An instance of the driver.
+        """
+        driver = self.get(manufacturer, device_model)
+        return driver(manufacturer=manufacturer, device_model=device_model, **kwargs)
+
+
+# Registry used by the library unless another one is given
+drivers = DriverRegistry()
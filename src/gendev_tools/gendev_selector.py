@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_selector.py
+~~~~~~~~~~~~~~~~~~
+
+Selection of the communication interface (transport) for each operation.
+
+Devices like the NAT MCH offer several transports, and each one supports a
+different subset of the operations. The selector keeps, per device and
+transport, the measured latency of each operation and the error rate, and
+ranks the transports supporting an operation:
+
+1. The healthy transports first, the fastest one first. The transports that
+   were never tried go before the rest, in the preference order given by the
+   device, so every transport gets measured.
+2. The transports with a high error rate last. After *retry_after* seconds
+   without being used, they are considered healthy again, so a recovered
+   transport is eventually chosen again.
+
+When the chosen transport fails, the call fails over to the next transport of
+the ranking. A transport whose circuit breaker is open (see gendev_health) is
+skipped without counting it as a new failure.
+"""
+
+import math
+import threading
+from .gendev_err import (
+    ConnTimeout,
+    DeviceUnavailable,
+    FeatureNotSupported,
+    NoRouteToDevice,
+    WebChanged,
+)
+from .gendev_deadline import Deadline
+from .gendev_clock import default_clock
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+# Failures of a transport, which allow trying the operation with another one
+TRANSPORT_ERRORS = (ConnTimeout, NoRouteToDevice, WebChanged, EOFError, OSError)
+
+
+class TransportScore:
+    """Measured performance of a transport for a device."""
+
+    def __init__(self, alpha: float = 0.3, clock=None):
+        """Class constructor.
+
+        Args:
+            alpha: weight of the new samples in the moving averages.
+            clock: clock measuring the time since the last failure.
+        """
+        self.alpha = alpha
+        self.clock = clock if clock is not None else default_clock
+        self.latencies = dict()
+        self.error_rate = 0.0
+        self.last_failure = None
+
+    def record_success(self, operation: str, elapsed: float):
+        previous = self.latencies.get(operation)
+        if previous is None:
+            self.latencies[operation] = elapsed
+        else:
+            self.latencies[operation] = previous + self.alpha * (elapsed - previous)
+        self.error_rate -= self.alpha * self.error_rate
+
+    def record_failure(self):
+        self.error_rate += self.alpha * (1.0 - self.error_rate)
+        self.last_failure = self.clock.monotonic()
+
+    def healthy(self, error_threshold: float, retry_after: float) -> bool:
+        if self.error_rate < error_threshold:
+            return True
+        return self.clock.monotonic() - self.last_failure >= retry_after
+
+
+class TransportSelector:
+    """Ranks the transports of the devices and runs the operations.
+
+    Example:
+        >>> selector.call(
+        ...     "172.30.5.238",
+        ...     "device_info",
+        ...     {"ETHER": web.device_info, "TELNET": telnet.device_info},
+        ... )
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.3,
+        error_threshold: float = 0.5,
+        retry_after: float = 30.0,
+        clock=None,
+    ):
+        """Class constructor.
+
+        Args:
+            alpha: weight of the new samples in the moving averages of the
+                   latency and the error rate.
+            error_threshold: error rate from which a transport is unhealthy.
+            retry_after: seconds after the last failure of an unhealthy
+                         transport to consider it healthy again.
+            clock: clock measuring the latencies (see gendev_clock). The
+                   default clock of the library is used when not given.
+        """
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.retry_after = retry_after
+        self.clock = clock if clock is not None else default_clock
+        self._scores = dict()
+        self._lock = threading.Lock()
+
+    def _score(self, device, transport) -> TransportScore:
+        score = self._scores.get((device, transport))
+        if score is None:
+            score = self._scores[(device, transport)] = TransportScore(
+                self.alpha, self.clock
+            )
+        return score
+
+    def record_success(self, device, transport, operation: str, elapsed: float):
+        """Add a successful operation (that took *elapsed* seconds)."""
+        with self._lock:
+            self._score(device, transport).record_success(operation, elapsed)
+
+    def record_failure(self, device, transport):
+        """Add a failed operation."""
+        with self._lock:
+            self._score(device, transport).record_failure()
+
+    def stats(self, device, transport) -> dict:
+        """Latencies and error rate of a transport of a device."""
+        with self._lock:
+            score = self._score(device, transport)
+            return {
+                "latency": dict(score.latencies),
+                "error_rate": score.error_rate,
+            }
+
+    def rank(self, device, transports: list, operation: str) -> list:
+        """Sort the transports for running an operation.
+
+        Args:
+            device: identifier of the device.
+            transports: transports supporting the operation, in order of
+                        preference.
+            operation: name of the operation.
+
+        Returns:
+            The transports, sorted by health and latency.
+        """
+        with self._lock:
+            keys = dict()
+            for position, transport in enumerate(transports):
+                score = self._score(device, transport)
+                latency = score.latencies.get(operation)
+                tried = latency is not None or score.last_failure is not None
+                if latency is None:
+                    latency = math.inf if tried else position
+                keys[transport] = (
+                    not score.healthy(self.error_threshold, self.retry_after),
+                    # The transports never tried go first, so every
+                    # transport gets measured once.
+                    tried,
+                    latency,
+                )
+            return sorted(transports, key=lambda transport: keys[transport])
+
+    def call(
+        self,
+        device,
+        operation: str,
+        candidates: dict,
+        failover: bool = True,
+        deadline: Deadline = None,
+    ):
+        """Run an operation using the best transport.
+
+        Args:
+            device: identifier of the device.
+            operation: name of the operation.
+            candidates: dictionary transport -> callable running the
+                        operation with that transport, in order of
+                        preference.
+            failover: when False, only the best transport is tried. Use it
+                      for the operations that can't be repeated safely.
+            deadline: limit for the operation. No more transports are tried
+                      once it expires.
+
+        Returns:
+            The value returned by the callable.
+
+        Raises:
+            gendev_err.FeatureNotSupported if there are no candidates.
+            The error of the last transport tried, if all of them failed.
+        """
+        if not candidates:
+            raise FeatureNotSupported(
+                "No allowed communication interface supports {}".format(operation)
+            )
+        ranking = self.rank(device, list(candidates), operation)
+        if not failover:
+            ranking = ranking[:1]
+
+        for transport in ranking:
+            start = self.clock.monotonic()
+            try:
+                result = candidates[transport]()
+            except DeviceUnavailable:
+                # The transport is still failing fast (see gendev_health), it
+                # isn't a new failure
+                if transport == ranking[-1] or (
+                    deadline is not None and deadline.expired()
+                ):
+                    raise
+                continue
+            except TRANSPORT_ERRORS:
+                self.record_failure(device, transport)
+                if transport == ranking[-1] or (
+                    deadline is not None and deadline.expired()
+                ):
+                    raise
+                continue
+            self.record_success(
+                device, transport, operation, self.clock.monotonic() - start
+            )
+            return result
+
+
+# Selector shared by all the devices unless another one is given
+default_selector = TransportSelector()
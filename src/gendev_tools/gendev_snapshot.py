@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_snapshot.py
+~~~~~~~~~~~~~~~~~~
+
+Content-addressed storage for configuration snapshots.
+
+The configuration of a device (a dictionary indexed by category, as returned
+by *get_configuration*) is split in sections, and each section is stored once
+in the store, indexed by its content digest. Sections shared among devices, or
+that don't change over time, are stored only once. Configuration scripts (like
+the backplane configuration of the NAT MCHs) are stored as line deltas against
+the previous version of the same script for the same device.
+
+The layout of the store in the file system is::
+
+    <path>/objects/<2 first digest chars>/<rest of the digest>
+    <path>/refs/<device>.log
+
+Each object is a zlib compressed file, and each log contains a line per
+change of the configuration of the device: a timestamp and the digest of the
+root of the snapshot. Taking a new snapshot of a device whose configuration
+didn't change doesn't write anything to the store.
+"""
+
+import os
+import json
+import zlib
+import time
+import difflib
+import hashlib
+from collections import OrderedDict
+from urllib.parse import quote
+from .gendev_digest import canonical_bytes
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+# Object types. A delta object represents a text object, so it is indexed
+# by the digest of the text that it encodes.
+OBJ_TREE = b"tree"
+OBJ_JSON = b"json"
+OBJ_TEXT = b"text"
+OBJ_DELTA = b"delta"
+
+
+def _is_script(value) -> bool:
+    """Scripts are multi-line strings, stored as text objects."""
+    return isinstance(value, str) and "\n" in value
+
+
+def _is_tree(value) -> bool:
+    """Dictionaries are split in child objects when every value is a
+    dictionary or a script. Otherwise, they are stored as a single object."""
+    return (
+        isinstance(value, dict)
+        and len(value) > 0
+        and all(isinstance(v, dict) or _is_script(v) for v in value.values())
+    )
+
+
+def _make_delta(base: str, text: str) -> list:
+    """Line based delta to build *text* from *base*.
+
+    Returns:
+        A list of operations: a pair [first, last] copies the lines from
+        *base*, and a string is inserted as is.
+    """
+    base_lines = base.splitlines(True)
+    text_lines = text.splitlines(True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, text_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append("".join(text_lines[j1:j2]))
+    return ops
+
+
+def _apply_delta(base: str, ops: list) -> str:
+    """Build the text encoded by a delta from its base text."""
+    base_lines = base.splitlines(True)
+    out = []
+    for op in ops:
+        if isinstance(op, list):
+            out.extend(base_lines[op[0] : op[1]])
+        else:
+            out.append(op)
+    return "".join(out)
+
+
+class SnapshotStore:
+    """Deduplicated storage of configuration snapshots.
+
+    Example:
+        >>> store = SnapshotStore("/var/lib/mchconfig/snapshots")
+        >>> store.put("mch-01", {"basecfg": basecfg, "backplane": backplane})
+        >>> store.get("mch-01")["basecfg"] == basecfg
+        True
+    """
+
+    def __init__(self, path: str, max_delta_chain: int = 16):
+        """Class constructor.
+
+        Args:
+            path: root directory of the store. It is created when missing.
+            max_delta_chain: maximum number of deltas that need to be applied
+                             to rebuild a script. When it is reached, the
+                             script is stored in full again.
+        """
+        self.path = path
+        self.max_delta_chain = max_delta_chain
+        self._objects = os.path.join(path, "objects")
+        self._refs = os.path.join(path, "refs")
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._refs, exist_ok=True)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self._objects, digest[:2], digest[2:])
+
+    def _ref_path(self, device: str) -> str:
+        return os.path.join(self._refs, "{}.log".format(quote(device, safe="")))
+
+    def _write(self, digest: str, kind: bytes, payload: bytes) -> bool:
+        """Write an object unless it already exists.
+
+        Returns:
+            True if the object was written.
+        """
+        obj_path = self._object_path(digest)
+        if os.path.exists(obj_path):
+            return False
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(obj_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(kind + b"\0" + payload))
+        os.replace(tmp_path, obj_path)
+        return True
+
+    def _read(self, digest: str) -> tuple:
+        """Read an object from the store.
+
+        Returns:
+            A tuple with the object type and its payload.
+        """
+        with open(self._object_path(digest), "rb") as f:
+            kind, _, payload = zlib.decompress(f.read()).partition(b"\0")
+        return kind, payload
+
+    def _put_text(self, text: str, base: str = None) -> str:
+        """Store a script, as a delta against *base* when it is worth it."""
+        payload = text.encode("utf-8")
+        digest = hashlib.sha256(OBJ_TEXT + b"\0" + payload).hexdigest()
+        if os.path.exists(self._object_path(digest)):
+            return digest
+
+        if base is not None:
+            kind, base_payload = self._read(base)
+            depth = json.loads(base_payload)["depth"] + 1 if kind == OBJ_DELTA else 1
+            # The previous value might not be a script (i.e. a single line)
+            if kind in (OBJ_TEXT, OBJ_DELTA) and depth <= self.max_delta_chain:
+                delta = canonical_bytes(
+                    {
+                        "base": base,
+                        "depth": depth,
+                        "ops": _make_delta(self._load(base), text),
+                    },
+                    ordered=True,
+                )
+                if len(delta) < len(payload):
+                    self._write(digest, OBJ_DELTA, delta)
+                    return digest
+
+        self._write(digest, OBJ_TEXT, payload)
+        return digest
+
+    def _put(self, value, previous: dict) -> str:
+        """Store a value recursively.
+
+        Args:
+            value: the value to be stored.
+            previous: digests of the previous snapshot of the same device,
+                      indexed by the same keys as *value* (if it is a tree).
+
+        Returns:
+            The digest of the stored object.
+        """
+        if _is_script(value):
+            return self._put_text(
+                value, previous if isinstance(previous, str) else None
+            )
+
+        if _is_tree(value):
+            previous = previous if isinstance(previous, dict) else {}
+            entries = OrderedDict(
+                (key, self._put(child, previous.get(key)))
+                for key, child in value.items()
+            )
+            kind, payload = OBJ_TREE, canonical_bytes(entries, ordered=True)
+        else:
+            kind, payload = OBJ_JSON, canonical_bytes(value, ordered=True)
+
+        digest = hashlib.sha256(kind + b"\0" + payload).hexdigest()
+        self._write(digest, kind, payload)
+        return digest
+
+    def _index(self, digest: str):
+        """Digests of the children of an object, following the same structure
+        as the stored value. Leaves are represented by their own digest."""
+        kind, payload = self._read(digest)
+        if kind != OBJ_TREE:
+            return digest
+        entries = json.loads(payload, object_pairs_hook=OrderedDict)
+        return OrderedDict((key, self._index(child)) for key, child in entries.items())
+
+    def _load(self, digest: str):
+        """Rebuild the value stored under the given digest."""
+        kind, payload = self._read(digest)
+
+        if kind == OBJ_TREE:
+            entries = json.loads(payload, object_pairs_hook=OrderedDict)
+            return OrderedDict(
+                (key, self._load(child)) for key, child in entries.items()
+            )
+        elif kind == OBJ_JSON:
+            return json.loads(payload, object_pairs_hook=OrderedDict)
+
+        # Resolve the chain of deltas down to the full text
+        chain = []
+        while kind == OBJ_DELTA:
+            delta = json.loads(payload)
+            chain.append(delta["ops"])
+            kind, payload = self._read(delta["base"])
+        text = payload.decode("utf-8")
+        for ops in reversed(chain):
+            text = _apply_delta(text, ops)
+        return text
+
+    def history(self, device: str) -> list:
+        """List the snapshots of a device.
+
+        Returns:
+            A list of tuples (timestamp, digest) sorted by time. Only the
+            snapshots that changed the configuration are listed.
+        """
+        ref_path = self._ref_path(device)
+        if not os.path.exists(ref_path):
+            return []
+        entries = []
+        with open(ref_path) as f:
+            for line in f:
+                timestamp, digest = line.split()
+                entries.append((float(timestamp), digest))
+        return entries
+
+    def put(self, device: str, config: dict, timestamp: float = None) -> str:
+        """Store a snapshot of the configuration of a device.
+
+        Args:
+            device: identifier of the device.
+            config: dictionary indexed by configuration category, containing
+                    the output of *get_configuration* for each category.
+            timestamp: time of the snapshot (seconds since the epoch). Now,
+                       if not given.
+
+        Returns:
+            The digest of the snapshot.
+        """
+        history = self.history(device)
+        previous = self._index(history[-1][1]) if history else {}
+        digest = self._put(OrderedDict(config), previous)
+
+        if not history or history[-1][1] != digest:
+            timestamp = time.time() if timestamp is None else timestamp
+            with open(self._ref_path(device), "a") as f:
+                f.write("{:.3f} {}\n".format(timestamp, digest))
+
+        return digest
+
+    def get(self, device: str, timestamp: float = None) -> OrderedDict:
+        """Retrieve a snapshot of the configuration of a device.
+
+        Args:
+            device: identifier of the device.
+            timestamp: when given, the configuration of the device at that
+                       time is returned. Otherwise, the latest one.
+
+        Returns:
+            The configuration of the device, or None if there's no snapshot
+            for the device at the given time.
+        """
+        digest = None
+        for entry_time, entry_digest in self.history(device):
+            if timestamp is not None and entry_time > timestamp:
+                break
+            digest = entry_digest
+        return self._load(digest) if digest is not None else None
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_transport.py
+~~~~~~~~~~~~~~~~~~~
+
+Recording and replaying of the sessions with the devices.
+
+The modules accessing the devices rely on two kinds of transports:
+
+- A CLI session with the API of telnetlib.Telnet: *write*, *read_until*,
+  *read_very_eager* and *close*.
+- An HTTP client with the API of requests: *get* and *post* methods returning
+  a response object.
+
+This module provides wrappers for both kinds of transports that record every
+operation (including how long it took) to a cassette, and fake transports that
+replay a cassette. A cassette is stored as a JSON Lines file, one operation per
+line. The replay can run at full speed, or reproducing the original timing of
+the device.
+
+Example:
+    >>> cassette = Cassette()
+    >>> session = RecordingTelnet(Telnet("172.30.5.238", 23), cassette)
+    >>> NATMCHTelnet("172.30.5.238", session=session).device_info()
+    >>> cassette.save("mch_device_info.jsonl")
+    >>> # Later on, without the MCH:
+    >>> session = ReplayTelnet(Cassette.load("mch_device_info.jsonl"))
+    >>> NATMCHTelnet("172.30.5.238", session=session).device_info()
+"""
+
+import json
+import time
+import socket
+import select
+import threading
+import requests as rq
+from .gendev_err import CassetteMismatch
+from .gendev_clock import default_clock
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+def _encode(data: bytes) -> str:
+    # Latin-1 maps each byte to a character, so the cassettes are readable
+    # and no information is lost.
+    return data.decode("latin-1")
+
+
+def _decode(data: str) -> bytes:
+    return data.encode("latin-1")
+
+
+class Cassette:
+    """Sequence of operations recorded from a session with a device."""
+
+    def __init__(self, events: list = None):
+        """Class constructor.
+
+        Args:
+            events: list of recorded operations. Each operation is a
+                    dictionary with, at least, the keys *op* (operation name)
+                    and *t* (seconds that the operation took).
+        """
+        self.events = list(events) if events is not None else []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a cassette from a JSON Lines file."""
+        with open(path) as f:
+            return cls(json.loads(line) for line in f if line.strip())
+
+    def save(self, path: str):
+        """Save the cassette to a JSON Lines file."""
+        with open(path, "w") as f:
+            for event in self.events:
+                f.write(json.dumps(event) + "\n")
+
+    def record(self, event: dict):
+        """Append an operation to the cassette."""
+        with self._lock:
+            self.events.append(event)
+
+
+class StreamSession:
+    """CLI session over a stream socket.
+
+    It offers the same API as telnetlib.Telnet on top of any object with the
+    socket methods *recv*, *sendall*, *fileno* and *close* (i.e. a socket or
+    an SSH channel), so it can be used by the modules written for Telnet.
+    """
+
+    def __init__(self, sock, name: str):
+        """Class constructor.
+
+        Args:
+            sock: connected socket-like object.
+            name: description of the peer, used in the error messages.
+        """
+        self.sock = sock
+        self.name = name
+        # Reads are driven by select, writes can block
+        self.sock.settimeout(None)
+        self._buffer = bytearray()
+        self.eof = False
+
+    def _fill(self, timeout: float = None) -> bool:
+        """Wait for data from the server and add it to the buffer.
+
+        Returns:
+            False if there was nothing to read within the timeout.
+        """
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return False
+        data = self.sock.recv(4096)
+        if not data:
+            self.eof = True
+            raise EOFError("Connection closed by {}".format(self.name))
+        self._buffer += data
+        return True
+
+    def write(self, data: bytes):
+        self.sock.sendall(data)
+
+    def read_until(self, match: bytes, timeout: float = None) -> bytes:
+        """Read until the given string is found or the timeout expires.
+
+        Returns:
+            The data read up to the match (included). When the timeout
+            expires, whatever was read (possibly nothing).
+        """
+        end_time = None if timeout is None else time.monotonic() + timeout
+        while True:
+            index = self._buffer.find(match)
+            if index >= 0:
+                index += len(match)
+                data = bytes(self._buffer[:index])
+                del self._buffer[:index]
+                return data
+            remaining = None if end_time is None else end_time - time.monotonic()
+            if (remaining is not None and remaining <= 0) or not self._fill(remaining):
+                return self.read_very_eager()
+
+    def read_very_eager(self) -> bytes:
+        """Read everything available without blocking."""
+        while self._fill(0):
+            pass
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    def close(self):
+        self.sock.close()
+
+
+class TCPSession(StreamSession):
+    """CLI session over a raw TCP connection.
+
+    This is the transport for serial ports exposed over TCP (i.e. a MOXA hub
+    in TCP server mode), which doesn't use the Telnet protocol.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = None):
+        """Class constructor.
+
+        Args:
+            host: address of the TCP server.
+            port: TCP port of the server.
+            timeout: timeout for establishing the connection.
+        """
+        self.host = host
+        self.port = port
+        super().__init__(
+            socket.create_connection((host, port), timeout),
+            "{}:{}".format(host, port),
+        )
+
+
+class RecordingTelnet:
+    """Telnet-like session that records the operations of another one."""
+
+    def __init__(self, session, cassette: Cassette):
+        """Class constructor.
+
+        Args:
+            session: the real session (i.e. a telnetlib.Telnet instance).
+            cassette: where the operations are recorded.
+        """
+        self._session = session
+        self.cassette = cassette
+
+    def _call(self, op: str, *args):
+        start = time.monotonic()
+        data = getattr(self._session, op)(*args)
+        self.cassette.record(
+            {"op": op, "data": _encode(data), "t": time.monotonic() - start}
+        )
+        return data
+
+    def write(self, data: bytes):
+        self._session.write(data)
+        self.cassette.record({"op": "write", "data": _encode(data), "t": 0.0})
+
+    def read_until(self, match: bytes, timeout: float = None) -> bytes:
+        return self._call("read_until", match, timeout)
+
+    def read_very_eager(self) -> bytes:
+        return self._call("read_very_eager")
+
+    def close(self):
+        self._session.close()
+
+
+class ReplayTelnet:
+    """Telnet-like session replaying a cassette."""
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        realtime: bool = False,
+        strict: bool = True,
+        clock=None,
+    ):
+        """Class constructor.
+
+        Args:
+            cassette: the recorded session.
+            realtime: when True, each read takes as long as it took when it
+                      was recorded.
+            strict: when True, the written data has to match the recording.
+            clock: clock used for the realtime replay. With a VirtualClock,
+                   the recorded times pass on the clock without waiting.
+        """
+        self.cassette = cassette
+        self.realtime = realtime
+        self.clock = clock if clock is not None else default_clock
+        self.strict = strict
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def _next(self, op: str) -> dict:
+        with self._lock:
+            if self._position >= len(self.cassette.events):
+                raise CassetteMismatch("No more recorded operations ({})".format(op))
+            event = self.cassette.events[self._position]
+            self._position += 1
+        if event["op"] != op:
+            raise CassetteMismatch(
+                "Expected operation {}, {} was recorded at position {}".format(
+                    op, event["op"], self._position - 1
+                )
+            )
+        if self.realtime:
+            self.clock.sleep(event["t"])
+        return event
+
+    def write(self, data: bytes):
+        event = self._next("write")
+        if self.strict and _decode(event["data"]) != data:
+            raise CassetteMismatch(
+                "Written {!r}, {!r} was recorded".format(data, event["data"])
+            )
+
+    def read_until(self, match: bytes, timeout: float = None) -> bytes:
+        return _decode(self._next("read_until")["data"])
+
+    def read_very_eager(self) -> bytes:
+        return _decode(self._next("read_very_eager")["data"])
+
+    def close(self):
+        pass
+
+
+class ReplayResponse:
+    """Response object with the subset of the API of requests.Response used by
+    the library."""
+
+    def __init__(self, url: str, status_code: int, headers: dict, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.headers = rq.structures.CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = rq.utils.get_encoding_from_headers(self.headers)
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def iter_content(self, chunk_size: int = 1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
+    def close(self):
+        pass
+
+
+def _form(data) -> list:
+    """Fields of a form submission, as a list of [name, value]."""
+    if data is None:
+        return []
+    items = data.items() if isinstance(data, dict) else data
+    return [[name, value] for name, value in items]
+
+
+class RecordingHTTP:
+    """HTTP client that records the requests done through another one."""
+
+    def __init__(self, client, cassette: Cassette):
+        """Class constructor.
+
+        Args:
+            client: the real HTTP client (the requests module or a Session).
+            cassette: where the requests are recorded.
+        """
+        self._client = client
+        self.cassette = cassette
+
+    def get(self, url: str, **kwargs):
+        return self._request("get", url, **kwargs)
+
+    def post(self, url: str, data=None, **kwargs):
+        return self._request("post", url, data=data, **kwargs)
+
+    def _request(self, op: str, url: str, **kwargs):
+        event = {"op": op, "url": url}
+        if op == "post":
+            # The submitted form is replayed only if it's the same
+            event["data"] = _form(kwargs["data"])
+        start = time.monotonic()
+        try:
+            response = getattr(self._client, op)(url, **kwargs)
+        except rq.exceptions.RequestException as e:
+            error = "timeout" if isinstance(e, rq.exceptions.Timeout) else "connection"
+            event.update(error=error, t=time.monotonic() - start)
+            self.cassette.record(event)
+            raise
+        event.update(
+            status=response.status_code,
+            headers=dict(response.headers),
+            body=_encode(response.content),
+            t=time.monotonic() - start,
+        )
+        self.cassette.record(event)
+        return response
+
+
+class ReplayHTTP:
+    """HTTP client replaying a cassette.
+
+    The requests are matched by method and URL: each URL replays its recorded
+    responses in the same order they were recorded. A form submission must
+    send the same fields that were recorded.
+    """
+
+    def __init__(self, cassette: Cassette, realtime: bool = False, clock=None):
+        """Class constructor.
+
+        Args:
+            cassette: the recorded requests.
+            realtime: when True, each request takes as long as it took when it
+                      was recorded.
+            clock: see ReplayTelnet.
+        """
+        self.realtime = realtime
+        self.clock = clock if clock is not None else default_clock
+        self._responses = dict()
+        self._lock = threading.Lock()
+        for event in cassette.events:
+            if event["op"] in ("get", "post"):
+                key = (event["op"], event["url"])
+                self._responses.setdefault(key, []).append(event)
+
+    def get(self, url: str, **kwargs):
+        return self._request("get", url)
+
+    def post(self, url: str, data=None, **kwargs):
+        return self._request("post", url, _form(data))
+
+    def _request(self, op: str, url: str, data: list = None):
+        with self._lock:
+            pending = self._responses.get((op, url))
+            if not pending:
+                raise CassetteMismatch(
+                    "No recorded response for {} {}".format(op.upper(), url)
+                )
+            event = pending.pop(0)
+        if data is not None and data != event["data"]:
+            raise CassetteMismatch(
+                "Submitted {!r} to {}, {!r} was recorded".format(
+                    data, url, event["data"]
+                )
+            )
+
+        if self.realtime:
+            self.clock.sleep(event["t"])
+        if event.get("error") == "timeout":
+            raise rq.exceptions.Timeout("Recorded timeout for {}".format(url))
+        elif event.get("error") is not None:
+            raise rq.exceptions.ConnectionError("Recorded error for {}".format(url))
+
+        return ReplayResponse(
+            url, event["status"], event["headers"], _decode(event["body"])
+        )
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_verify.py
+~~~~~~~~~~~~~~~~
+
+Verification of the firmware versions of many devices after an upgrade.
+
+After an upgrade, every device has to be checked: is it running the target
+versions of the firmware, the FPGA and the microcontroller? The devices are
+rebooting for a while, so a check done too early fails, and checking the
+devices one by one takes as long as the sum of their reboots.
+
+:py:func:`verify_fleet` checks all the devices at the same time, within a
+single deadline. Each device is polled until it answers *device_info* (or the
+deadline expires), and then its versions are compared with the expected
+ones. The devices are given as factories (a callable taking a Deadline and a
+HealthRegistry, and returning the object implementing the GenDev interface)
+because the interfaces check the device when they are built, and that fails
+while the device is rebooting. A new object is built after each failed
+attempt.
+
+The interfaces should be built with the given HealthRegistry. Its circuit
+breakers don't back off, so the device is attempted at every interval: the
+backoff of the default registry grows while the device is rebooting, and it
+would delay the attempts up to minutes after the device is back.
+
+The outcome of each device is a :py:class:`Verdict`:
+
+- PASS: every version matches.
+- FAIL: the device answered, but some version doesn't match. A mismatch is
+  final: the device is not polled again.
+- TIMEOUT: the device didn't answer before the deadline.
+
+The versions are compared without the prefix *V*, which depends on the
+interface (i.e. *V1.2* and *1.2* are the same version).
+
+Example:
+    >>> results = verify_fleet(
+    ...     {"mch-01": lambda deadline, health: NATMCHWeb(
+    ...         "172.30.5.238", deadline=deadline, health=health)},
+    ...     {"fw_ver": "V2.21.8", "fpga_ver": "V1.14"},
+    ...     timeout=300,
+    ... )
+    >>> verdict_matrix(results)
+    {'mch-01': {'fw_ver': 'pass', 'fpga_ver': 'pass'}}
+"""
+
+import enum
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .gendev_clock import default_clock
+from .gendev_deadline import Deadline
+from .gendev_health import HealthRegistry
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+# Fields of the Board section of device_info that can be verified
+VERSION_FIELDS = ("fw_ver", "fpga_ver", "mcu_ver")
+
+
+class Verdict(enum.Enum):
+    """Outcome of the verification of a device (or a version)."""
+
+    PASS = "pass"
+    FAIL = "fail"
+    TIMEOUT = "timeout"
+
+
+def _normalize(version) -> str:
+    return str(version).strip().lstrip("vV")
+
+
+class VerifyResult:
+    """Outcome of the verification of a device."""
+
+    def __init__(
+        self,
+        device: str,
+        verdict: Verdict,
+        expected: dict,
+        given: dict = None,
+        mismatches: dict = None,
+        error: str = None,
+        attempts: int = 0,
+        elapsed: float = 0.0,
+    ):
+        """Class constructor.
+
+        Args:
+            device: identifier of the device.
+            verdict: outcome of the verification.
+            expected: versions the device should report.
+            given: versions reported by the device (None if it didn't
+                   answer).
+            mismatches: versions that don't match, with the same format as
+                        the output of gendev_drift.diff_config:
+                        ``{"fw_ver": {"expected": ..., "given": ...}}``.
+            error: last error while polling the device.
+            attempts: number of times the device was polled.
+            elapsed: seconds until the outcome was known.
+        """
+        self.device = device
+        self.verdict = verdict
+        self.expected = expected
+        self.given = given
+        self.mismatches = mismatches if mismatches is not None else dict()
+        self.error = error
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    def fields(self) -> OrderedDict:
+        """Verdict of each expected version."""
+        verdicts = OrderedDict()
+        for field in self.expected:
+            if self.verdict == Verdict.TIMEOUT:
+                verdicts[field] = Verdict.TIMEOUT.value
+            elif field in self.mismatches:
+                verdicts[field] = Verdict.FAIL.value
+            else:
+                verdicts[field] = Verdict.PASS.value
+        return verdicts
+
+    def to_dict(self) -> dict:
+        return {
+            "device": self.device,
+            "verdict": self.verdict.value,
+            "expected": self.expected,
+            "given": self.given,
+            "mismatches": self.mismatches,
+            "error": self.error,
+            "attempts": self.attempts,
+            "elapsed": self.elapsed,
+        }
+
+    def __repr__(self):
+        return "VerifyResult({})".format(self.to_dict())
+
+
+def _close(device):
+    close = getattr(device, "close", None)
+    if close is not None:
+        close()
+
+
+def verify_device(
+    name: str,
+    factory,
+    expected: dict,
+    deadline: Deadline,
+    interval: float = 5.0,
+    clock=None,
+    health: HealthRegistry = None,
+) -> VerifyResult:
+    """Wait until a device answers, and compare its versions.
+
+    The device is attempted every *interval* seconds, and once more right
+    before the deadline (if the last attempt suggests it can finish in time).
+
+    Args:
+        name: identifier of the device.
+        factory: callable taking a Deadline and a HealthRegistry, and
+                 returning the object implementing the GenDev interface for
+                 the device.
+        expected: expected versions, indexed by the fields of the Board
+                  section of device_info (see VERSION_FIELDS).
+        deadline: limit for the device to answer.
+        interval: seconds between the attempts.
+        clock: clock for the waits. The default clock of the library is used
+               when not given.
+        health: registry given to the factory. A registry without backoff is
+                used when not given.
+
+    Returns:
+        A :py:class:`VerifyResult`.
+    """
+    clock = clock if clock is not None else default_clock
+    if health is None:
+        health = HealthRegistry(backoff=0.0, factor=1.0, clock=clock)
+    start = clock.monotonic()
+    attempts = 0
+    error = None
+
+    while True:
+        attempts += 1
+        attempt_start = clock.monotonic()
+        device = None
+        try:
+            device = factory(deadline, health)
+            board = device.device_info(deadline).get("Board")
+            if not board:
+                error = "The device didn't report its versions"
+        except Exception as e:
+            # Any failure is expected while the device is rebooting
+            board = None
+            error = "{}: {}".format(type(e).__name__, e)
+        finally:
+            if device is not None:
+                _close(device)
+
+        if board:
+            given = OrderedDict((field, board.get(field)) for field in expected)
+            mismatches = OrderedDict(
+                (field, {"expected": value, "given": given[field]})
+                for field, value in expected.items()
+                if given[field] is None or _normalize(given[field]) != _normalize(value)
+            )
+            return VerifyResult(
+                name,
+                Verdict.FAIL if mismatches else Verdict.PASS,
+                expected,
+                given=given,
+                mismatches=mismatches,
+                attempts=attempts,
+                elapsed=clock.monotonic() - start,
+            )
+
+        # Another attempt only when it could finish before the deadline
+        wait = min(interval, deadline.remaining() - (clock.monotonic() - attempt_start))
+        if wait < 0 or deadline.expired():
+            return VerifyResult(
+                name,
+                Verdict.TIMEOUT,
+                expected,
+                error=error,
+                attempts=attempts,
+                elapsed=clock.monotonic() - start,
+            )
+        clock.sleep(wait)
+
+
+def verify_fleet(
+    devices,
+    expected: dict,
+    timeout: float = 300.0,
+    interval: float = 5.0,
+    max_workers: int = 16,
+    clock=None,
+    on_result=None,
+) -> OrderedDict:
+    """Verify the versions of many devices at the same time.
+
+    Args:
+        devices: dictionary (or iterable of pairs) of device identifier ->
+                 factory of the device (see :py:func:`verify_device`).
+        expected: expected versions, the same for every device (i.e.
+                  ``{"fw_ver": "V2.21.8"}``).
+        timeout: seconds for the whole verification. Every device shares
+                 the same deadline.
+        interval: seconds between the attempts for a device.
+        max_workers: maximum number of devices checked at the same time.
+        clock: clock for the deadline and the waits.
+        on_result: callable receiving each VerifyResult as soon as it is
+                   known.
+
+    Returns:
+        An OrderedDict of device identifier -> VerifyResult, in the order
+        the devices were given.
+    """
+    clock = clock if clock is not None else default_clock
+    items = list(devices.items() if isinstance(devices, dict) else devices)
+    deadline = Deadline(timeout, clock=clock)
+    health = HealthRegistry(backoff=0.0, factor=1.0, clock=clock)
+    results = OrderedDict((name, None) for name, _ in items)
+    lock = threading.Lock()
+
+    def verify(name, factory):
+        result = verify_device(
+            name, factory, expected, deadline, interval, clock, health
+        )
+        with lock:
+            results[name] = result
+        if on_result is not None:
+            on_result(result)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        for future in [pool.submit(verify, name, factory) for name, factory in items]:
+            future.result()
+
+    return results
+
+
+def verdict_matrix(results: dict) -> OrderedDict:
+    """Matrix of verdicts: one row per device, one column per version.
+
+    Args:
+        results: output of :py:func:`verify_fleet`.
+
+    Returns:
+        An OrderedDict of device identifier -> {version field: verdict}, with
+        the values of :py:class:`Verdict` (*pass*, *fail* or *timeout*).
+    """
+    return OrderedDict((name, result.fields()) for name, result in results.items())
+
+
+def summarize(results: dict) -> dict:
+    """Number of devices with each verdict (i.e. {'pass': 9, 'fail': 0,
+    'timeout': 1})."""
+    summary = OrderedDict((verdict.value, 0) for verdict in Verdict)
+    for result in results.values():
+        summary[result.verdict.value] += 1
+    return summary
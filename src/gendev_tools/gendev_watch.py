@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""
+gendev_watch.py
+~~~~~~~~~~~~~~~
+
+Watch mode: periodic polling of many devices, reporting only the changes.
+
+Each device is polled on its own schedule. The polls are spread using a random
+jitter, so a fleet of devices added at the same time doesn't poll all at once.
+Every result (the device information, or a configuration category) is compared
+with the previous one by its content digest, so a device that didn't change
+only costs a digest comparison, and nothing is reported. When the digest
+changes, the parameters that changed are reported as change events (i.e. the
+firmware version, the IP address, or a parameter of the basecfg category).
+
+The device objects are kept between polls, so the connections they keep open
+(i.e. the sessions of NATMCH) are reused.
+
+Example:
+    >>> watcher = Watcher(interval=60, on_event=print)
+    >>> watcher.add("mch-01", mch1, targets=["device_info", "basecfg"])
+    >>> watcher.add("mch-02", mch2, targets=["device_info"], interval=300)
+    >>> watcher.run()
+"""
+
+import enum
+import heapq
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .gendev_digest import config_digest
+from .gendev_drift import diff_config
+from .gendev_clock import default_clock
+from .gendev_interface import DEVICE_INFO, read_target
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MCH Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class EventKind(enum.Enum):
+    """Kind of change reported by the watcher.
+
+    - CHANGED: the value of a parameter changed (or it was added/removed).
+    - UNREACHABLE: a target couldn't be polled, and it could the last time.
+    - RECOVERED: a target could be polled again.
+    """
+
+    CHANGED = "changed"
+    UNREACHABLE = "unreachable"
+    RECOVERED = "recovered"
+
+
+class ChangeEvent:
+    """Change detected in a device."""
+
+    def __init__(
+        self,
+        device: str,
+        target: str,
+        kind: EventKind,
+        path: str = None,
+        previous=None,
+        current=None,
+        timestamp: float = None,
+    ):
+        """Class constructor.
+
+        Args:
+            device: identifier of the device.
+            target: *device_info* or the configuration category.
+            kind: kind of change.
+            path: path of the parameter that changed (see gendev_drift).
+            previous: value in the previous poll (None if it was missing).
+            current: value in this poll (None if it is missing), or the error
+                     message for UNREACHABLE events.
+            timestamp: time of the poll (seconds since the epoch).
+        """
+        self.device = device
+        self.target = target
+        self.kind = kind
+        self.path = path
+        self.previous = previous
+        self.current = current
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "device": self.device,
+            "target": self.target,
+            "kind": self.kind.value,
+            "path": self.path,
+            "previous": self.previous,
+            "current": self.current,
+            "timestamp": self.timestamp,
+        }
+
+    def __repr__(self):
+        return "ChangeEvent({})".format(self.to_dict())
+
+
+class _WatchedDevice:
+    def __init__(self, name: str, device, targets: list, interval: float):
+        self.name = name
+        self.device = device
+        self.targets = list(targets)
+        self.interval = interval
+        # Last result of each target: (digest, value)
+        self.results = dict()
+        # Targets failing in the last poll
+        self.failing = set()
+        self.polling = False
+
+
+class Watcher:
+    """Polls many devices on per-device schedules, reporting the changes."""
+
+    def __init__(
+        self,
+        interval: float = 60.0,
+        jitter: float = 0.1,
+        max_workers: int = 16,
+        on_event=None,
+        clock=None,
+    ):
+        """Class constructor.
+
+        Args:
+            interval: default seconds between two polls of a device.
+            jitter: random variation of the interval, as a fraction of it.
+            max_workers: maximum number of devices polled at the same time.
+            on_event: callable receiving each ChangeEvent. It is called from
+                      the polling threads.
+            clock: clock of the schedule (see gendev_clock). The default
+                   clock of the library is used when not given.
+        """
+        self.interval = interval
+        self.jitter = jitter
+        self.max_workers = max_workers
+        self.on_event = on_event
+        self.clock = clock if clock is not None else default_clock
+        self._devices = dict()
+        self._schedule = list()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Set when the schedule changes, to wake up the run loop
+        self._wakeup = threading.Event()
+
+    def add(self, name: str, device, targets: list = (DEVICE_INFO,), interval=None):
+        """Start watching a device.
+
+        The first poll happens at a random time within the first interval,
+        and it only records the state of the device (no events).
+
+        Args:
+            name: identifier of the device.
+            device: object implementing the GenDev interface (at least
+                    *device_info* and/or *get_configuration*).
+            targets: *device_info* and/or configuration categories to watch.
+            interval: seconds between two polls of this device. The default
+                      interval of the watcher is used when not given.
+        """
+        interval = interval if interval is not None else self.interval
+        with self._lock:
+            self._devices[name] = _WatchedDevice(name, device, targets, interval)
+            due = self.clock.monotonic() + random.uniform(0, interval)
+            heapq.heappush(self._schedule, (due, name))
+        self._wakeup.set()
+
+    def remove(self, name: str):
+        """Stop watching a device."""
+        with self._lock:
+            self._devices.pop(name, None)
+
+    def _next_due(self, watched: _WatchedDevice) -> float:
+        spread = watched.interval * self.jitter
+        return (
+            self.clock.monotonic() + watched.interval + random.uniform(-spread, spread)
+        )
+
+    def poll(self, name: str) -> list:
+        """Poll all the targets of a device.
+
+        Args:
+            name: identifier of the device.
+
+        Returns:
+            The list of ChangeEvent detected (also passed to *on_event*).
+        """
+        watched = self._devices[name]
+        events = list()
+        timestamp = self.clock.time()
+
+        for target in watched.targets:
+            try:
+                value = read_target(watched.device, target)
+            except Exception as e:
+                if target not in watched.failing:
+                    watched.failing.add(target)
+                    events.append(
+                        ChangeEvent(
+                            name,
+                            target,
+                            EventKind.UNREACHABLE,
+                            current=str(e),
+                            timestamp=timestamp,
+                        )
+                    )
+                continue
+            if target in watched.failing:
+                watched.failing.discard(target)
+                events.append(
+                    ChangeEvent(name, target, EventKind.RECOVERED, timestamp=timestamp)
+                )
+
+            digest = config_digest(value)
+            previous = watched.results.get(target)
+            if previous is not None and previous[0] == digest:
+                continue
+            watched.results[target] = (digest, value)
+            if previous is None:
+                # First poll, nothing to compare with
+                continue
+
+            for path, change in diff_config(previous[1], value).items():
+                events.append(
+                    ChangeEvent(
+                        name,
+                        target,
+                        EventKind.CHANGED,
+                        path,
+                        change["expected"],
+                        change["given"],
+                        timestamp,
+                    )
+                )
+
+        if self.on_event is not None:
+            for event in events:
+                self.on_event(event)
+
+        return events
+
+    def _poll_and_reschedule(self, watched: _WatchedDevice):
+        try:
+            self.poll(watched.name)
+        finally:
+            with self._lock:
+                watched.polling = False
+                if self._devices.get(watched.name) is watched:
+                    heapq.heappush(
+                        self._schedule, (self._next_due(watched), watched.name)
+                    )
+            self._wakeup.set()
+
+    def run(self, duration: float = None):
+        """Poll the devices until stop is called (or the duration expires).
+
+        Args:
+            duration: seconds to run. None for no limit.
+        """
+        self._stop.clear()
+        end = None if duration is None else self.clock.monotonic() + duration
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while not self._stop.is_set():
+                now = self.clock.monotonic()
+                if end is not None and now >= end:
+                    break
+                with self._lock:
+                    due = list()
+                    while self._schedule and self._schedule[0][0] <= now:
+                        _, name = heapq.heappop(self._schedule)
+                        watched = self._devices.get(name)
+                        # Removed devices, or still polling (rescheduled later)
+                        if watched is not None and not watched.polling:
+                            watched.polling = True
+                            due.append(watched)
+                    wait = self._schedule[0][0] - now if self._schedule else None
+                for watched in due:
+                    executor.submit(self._poll_and_reschedule, watched)
+                if end is not None:
+                    wait = end - now if wait is None else min(wait, end - now)
+                # Sleep until the next poll, or a change of the schedule
+                self.clock.wait(self._wakeup, None if wait is None else max(0.0, wait))
+                self._wakeup.clear()
+
+    def stop(self):
+        """Stop the run loop (the polls already started are completed)."""
+        self._stop.set()
+        self._wakeup.set()
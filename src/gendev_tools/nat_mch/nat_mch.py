@@ -14,11 +14,24 @@ is achieving a reliable solution with the best performance.
 """
 
 import logging
+from concurrent.futures import TimeoutError as FutureTimeout
 from ..gendev_interface import GenDevInterface, ConnType
-from ..gendev_err import ConnNotImplemented, FeatureNotSupported
-
-# from .nat_mch_web import NATMCHWeb
-from .nat_mch_telnet import NATMCHTelnet
+from ..gendev_err import (
+    ConnNotImplemented,
+    ConnTimeout,
+    DeviceUnavailable,
+    FeatureNotSupported,
+)
+from ..gendev_health import BreakerState, HealthRegistry, default_registry
+from ..gendev_deadline import Deadline, LatencyRegistry
+from ..gendev_clock import default_clock
+from ..gendev_governor import Governor, default_governor
+from ..gendev_selector import TRANSPORT_ERRORS, TransportSelector, default_selector
+from .nat_mch_web import NATMCHWeb
+from .nat_mch_telnet import NATMCHTelnet, FW_SERVER
+from .nat_mch_moxa import NATMCHMoxa
+from .nat_mch_ssh import NATMCHSSH
+from .nat_mch_transaction import ConfigTransaction
 
 __author__ = "Felipe Torres González"
 __copyright__ = "Copyright 2021, ESS MCH Tools"
@@ -29,6 +42,24 @@ __maintainer__ = "Felipe Torres González"
 __email__ = "felipe.torresgonzalez@ess.eu"
 __status__ = "Development"
 
+# Operations supported by each communication interface, in order of preference
+# of the interfaces (when there are no measurements yet).
+SUPPORTED_OPS = {
+    ConnType.ETHER: ("device_info", "get_configuration", "set_configuration"),
+    ConnType.SSH: ("device_info", "update_fw", "reboot", "run_commands"),
+    ConnType.TELNET: ("device_info", "update_fw", "reboot", "run_commands"),
+    ConnType.MOXA: ("device_info", "update_fw", "reboot", "run_commands"),
+}
+
+# Operations that an interface multiplexes over its connection (i.e. each one
+# in its own SSH channel), so they can run concurrently on the same device.
+MULTIPLEXED_OPS = {
+    ConnType.SSH: ("device_info",),
+}
+
+# Maximum length of the error published in the shared state of the devices
+ERROR_LENGTH = 256
+
 
 class NATMCH(GenDevInterface):
     """NAT MCH device.
@@ -51,6 +82,14 @@ class NATMCH(GenDevInterface):
     most reliable method), but ETHER doesn't support the execution of all the
     methods offered by the API, check the documentation of each method to
     check what type of connection is required.
+
+    Each operation is run using the fastest healthy interface that supports
+    it (see gendev_selector), failing over to the next one when an interface
+    breaks. The connections are opened the first time they are used.
+    Before running, every operation waits until the governor allows it (see
+    gendev_governor), considering the device, its crate and the firmware
+    server as shared resources. The device is not held by the operations
+    that the chosen interface multiplexes (see MULTIPLEXED_OPS).
     """
 
     def __init__(
@@ -64,6 +103,19 @@ class NATMCH(GenDevInterface):
         vlan: str = None,
         mac_address: str = None,
         logger: logging.Logger = None,
+        health: HealthRegistry = None,
+        latency: LatencyRegistry = None,
+        moxa_address: str = None,
+        moxa_port: int = None,
+        ssh_options: dict = None,
+        selector: TransportSelector = None,
+        governor: Governor = None,
+        crate: str = None,
+        clock=None,
+        http=None,
+        caps=None,
+        state_cache=None,
+        muxes=None,
     ):
         """Class constructor.
 
@@ -81,11 +133,48 @@ class NATMCH(GenDevInterface):
             vlan: the registered VLAN in CSEntry for the MCH.
             mac_address: the MAC address of the network interface.
             logger: reference to a Logger instance.
+            health: registry keeping track of the devices that are down. The
+                    default registry of the library is used when not given.
+            latency: registry with the RTT measurements of the devices, used
+                     to compute the timeouts. The default registry of the
+                     library is used when not given.
+            moxa_address: the IP address of the MOXA hub connected to the
+                          serial console of the MCH (only for MOXA).
+            moxa_port: TCP port of the hub mapped to the serial port where
+                       the MCH is connected (only for MOXA).
+            ssh_options: arguments for the SSH interface: *port* and the
+                         credentials (*username*, *password* and/or
+                         *key_filename*).
+            selector: keeps the latency and error rate of the interfaces of
+                      the devices. The default selector of the library is
+                      used when not given.
+            governor: limits of the shared resources. The default governor
+                      of the library is used when not given.
+            crate: identifier of the crate where the MCH is installed, used
+                   to limit the operations running in the same crate.
+            clock: clock for the waits of the operations (see gendev_clock),
+                   given to every interface. The default clock of the
+                   library is used when not given.
+            http: HTTP client for the web interface (i.e. a requests.Session
+                  shared by the devices of a crate). Defaults to requests.
+            caps: table of the capabilities of the firmware versions, shared
+                  by the MCHs (see nat_mch_caps.CapabilityCache).
+            state_cache: state of the devices shared by several processes
+                         (see gendev_cache.DeviceStateCache). The device
+                         information found by another process is used, and
+                         the health of the MCH is published. An MCH found
+                         down by another process fails fast until the
+                         backoff of its circuit breaker expires.
+            muxes: registry of session multiplexers (see nat_mch_mux). When
+                   given, the Telnet session is shared with every NATMCH of
+                   the same device using the registry, so they don't open a
+                   CLI session each.
 
         Raises:
             gendev_err.ConnNotImplemented if a communication interface that
             is not supported by the implementation was included in the
             *allowed_con* argument.
+            ValueError if MOXA is allowed, but the hub is not given.
         """
         self.ip_address = ip_address
         self.device_model = device_model
@@ -96,28 +185,63 @@ class NATMCH(GenDevInterface):
         self.vlan = vlan
         self.mac_address = mac_address
         self.logger = logger
-        self._eth_conn = None
-        self._tel_conn = None
-        self._ser_conn = None
-        self._mox_conn = None
-        self._ssh_conn = None
-
-        # Open the valid connections
-        # if ConnType.ETHER in self.allowed_conn:
-        #     self._eth_conn = NATMCHWeb(self.ip_address)
+        self.health = health
+        self.latency = latency
+        self.selector = selector if selector is not None else default_selector
+        self.governor = governor if governor is not None else default_governor
+        self.crate = crate
+        self.clock = clock if clock is not None else default_clock
+        self.state_cache = state_cache
+        self.muxes = muxes
+        self._conns = dict()
+        self._conn_factories = dict()
+
+        # The connections are opened on demand
+        if ConnType.ETHER in self.allowed_conn:
+            self._conn_factories[ConnType.ETHER] = lambda deadline: NATMCHWeb(
+                self.ip_address,
+                health=self.health,
+                latency=self.latency,
+                deadline=deadline,
+                clock=self.clock,
+                http=http,
+                caps=caps,
+                state_cache=state_cache,
+            )
         if ConnType.TELNET in self.allowed_conn:
-            self._tel_conn = NATMCHTelnet(self.ip_address)
+            self._conn_factories[ConnType.TELNET] = lambda deadline: NATMCHTelnet(
+                self.ip_address,
+                health=self.health,
+                latency=self.latency,
+                deadline=deadline,
+                clock=self.clock,
+            )
         if ConnType.SERIAL in self.allowed_conn:
             raise ConnNotImplemented(
                 "The serial interface is not implemented" " for NAT MCHs."
             )
         if ConnType.MOXA in self.allowed_conn:
-            raise ConnNotImplemented(
-                "The MOXA interface is not implemented" " for NAT MCHs."
+            if moxa_address is None or moxa_port is None:
+                raise ValueError(
+                    "The address and port of the MOXA hub are needed"
+                    " for the MOXA interface."
+                )
+            self._conn_factories[ConnType.MOXA] = lambda deadline: NATMCHMoxa(
+                moxa_address,
+                moxa_port,
+                health=self.health,
+                latency=self.latency,
+                deadline=deadline,
+                clock=self.clock,
             )
         if ConnType.SSH in self.allowed_conn:
-            raise ConnNotImplemented(
-                "The SSH interface is not implemented" " for NAT MCHs."
+            self._conn_factories[ConnType.SSH] = lambda deadline: NATMCHSSH(
+                self.ip_address,
+                health=self.health,
+                latency=self.latency,
+                deadline=deadline,
+                clock=self.clock,
+                **(ssh_options or dict()),
             )
 
         # TBD: support logging
@@ -127,7 +251,158 @@ class NATMCH(GenDevInterface):
         #         '\tDevice model: {}'.format(self.device_model)
         #         )
 
-    def device_info(self) -> dict:
+    def _connection(self, conn_type: ConnType, deadline: Deadline = None):
+        """Internal method to get the connection of an interface.
+
+        The connection is opened the first time it is requested.
+        """
+        conn = self._conns.get(conn_type)
+        if conn is None:
+            conn = self._conns[conn_type] = self._conn_factories[conn_type](deadline)
+        return conn
+
+    def _mux(self):
+        """Internal method to get the multiplexer of the Telnet session."""
+        factory = self._conn_factories[ConnType.TELNET]
+        return self.muxes.get(self.ip_address, lambda: factory(None))
+
+    def _run(
+        self,
+        operation: str,
+        method: str,
+        *args,
+        failover: bool = True,
+        deadline: Deadline = None,
+        **kwargs
+    ):
+        """Internal method to run an operation using the best interface.
+
+        Args:
+            operation: name of the operation in SUPPORTED_OPS.
+            method: method of the connection objects running the operation.
+            args: arguments for the method.
+            failover: try the next interface when the chosen one fails.
+            deadline: limit for the whole operation.
+            kwargs: keyword arguments for the method.
+
+        Raises:
+            gendev_err.FeatureNotSupported if the given allowed communication
+            interfaces don't allow running the operation.
+        """
+
+        # The device is acquired by each interface tried, after the rest of
+        # resources (see gendev_governor)
+        resources = self._resources(operation)
+        device = {"device": resources.pop("device")}
+
+        def runner(conn_type):
+            def call():
+                if conn_type == ConnType.TELNET and self.muxes is not None:
+                    # The multiplexer opens a new session after an error
+                    future = self._mux().call(
+                        method, *args, deadline=deadline, **kwargs
+                    )
+                    step = "the multiplexed {}".format(method)
+                    try:
+                        return future.result(
+                            None if deadline is None else deadline.bound(None, step)
+                        )
+                    except FutureTimeout:
+                        # Still queued behind the calls of other threads
+                        future.cancel()
+                        raise ConnTimeout("Deadline exceeded during {}".format(step))
+                try:
+                    conn = self._connection(conn_type, deadline)
+                    return getattr(conn, method)(*args, deadline=deadline, **kwargs)
+                except TRANSPORT_ERRORS:
+                    # The connection might be broken, open a new one next time
+                    self._conns.pop(conn_type, None)
+                    raise
+
+            def run():
+                if operation in MULTIPLEXED_OPS.get(conn_type, ()):
+                    return call()
+                with self.governor.limit(device, deadline):
+                    return call()
+
+            return run
+
+        candidates = {
+            conn_type: runner(conn_type)
+            for conn_type, operations in SUPPORTED_OPS.items()
+            if conn_type in self._conn_factories and operation in operations
+        }
+        if not candidates:
+            raise FeatureNotSupported(
+                "Impossible to run {} with the given allowed"
+                " communication interfaces to the MCH.".format(operation)
+            )
+
+        # The interfaces keep a circuit breaker each, the one of the MCH
+        # (keyed by its address) only follows the state shared by the
+        # processes
+        state = self._shared_state()
+        down = state.get("health") == "down"
+        health = self.health if self.health is not None else default_registry
+        if down and health.state(self.ip_address) == BreakerState.CLOSED:
+            # Another process found the MCH down: fail fast until the backoff
+            # of the circuit breaker expires
+            health.record_failure(self.ip_address)
+        health.check(self.ip_address)
+
+        with self.governor.limit(resources, deadline):
+            try:
+                result = self.selector.call(
+                    self.ip_address, operation, candidates, failover, deadline
+                )
+            except TRANSPORT_ERRORS as e:
+                # A fast failure doesn't tell anything new about the MCH
+                if not isinstance(e, DeviceUnavailable):
+                    self._publish(health="down", error=str(e)[:ERROR_LENGTH])
+                if down:
+                    health.record_failure(self.ip_address)
+                raise
+            except Exception:
+                # The MCH answered
+                if down:
+                    health.record_success(self.ip_address)
+                raise
+        if down:
+            health.record_success(self.ip_address)
+            self._publish(health="up")
+        return result
+
+    def _shared_state(self) -> dict:
+        """Internal method to get the state of the MCH shared by the processes."""
+        if self.state_cache is None:
+            return dict()
+        return self.state_cache.get(self.ip_address) or dict()
+
+    def _publish(self, **fields):
+        """Internal method to update the state of the MCH shared by the
+        processes."""
+        if self.state_cache is None:
+            return
+        try:
+            self.state_cache.update(self.ip_address, **fields)
+        except ValueError:
+            # The state doesn't fit in its slot, it's just not shared
+            pass
+
+    def _resources(self, operation: str) -> dict:
+        """Internal method to get the shared resources used by an operation.
+
+        Returns:
+            A dictionary scope -> key, as expected by gendev_governor.
+        """
+        resources = {"device": self.ip_address}
+        if self.crate is not None:
+            resources["crate"] = self.crate
+        if operation == "update_fw":
+            resources["server"] = FW_SERVER
+        return resources
+
+    def device_info(self, deadline: Deadline = None) -> dict:
         """Retrieve the main information about the device.
 
         The information is returned in a dictionary with 2 categories:
@@ -135,6 +410,9 @@ class NATMCH(GenDevInterface):
         This feature is supported by all the implemented communication
         interfaces, so the best is chosen when multiple are allowed.
 
+        Args:
+            deadline: limit for the whole operation.
+
         Returns:
             If success, a dictionary with the device information.
             If failure, an empty dictionary on failure.
@@ -143,19 +421,14 @@ class NATMCH(GenDevInterface):
             gendev_err.FeatureNotSupported if the given allowed communication
             interfaces don't allow running this method.
         """
-        # if ConnType.ETHER in self.allowed_conn:
-        #     response = self._eth_conn.device_info()
-        # elif ConnType.TELNET in self.allowed_conn:
-        if ConnType.TELNET in self.allowed_conn:
-            response = self._tel_conn.device_info()
-        else:
-            raise FeatureNotSupported(
-                "Impossible to retrieve the device"
-                "information with the given allowed"
-                "communication interfaces to the MCH."
-            )
+        state = self._shared_state()
+        if state.get("device_info"):
+            return state["device_info"]
 
-        return response
+        info = self._run("device_info", "device_info", deadline=deadline)
+        if info:
+            self._publish(device_info=info, health="up")
+        return info
 
     def set_dhcp_mode(self):
         """Enables DHCP mode in the network configuration of the device.
@@ -167,10 +440,12 @@ class NATMCH(GenDevInterface):
         """
         raise NotImplementedError("This feature is not implemented yet")
 
-    def update_fw(self, fw_version: str, part: str):
+    def update_fw(self, fw_version: str, part: str = "MCH", deadline: Deadline = None):
         """Update the firmware of the device.
 
-        This feature is only supported by the Telnet communication interface.
+        This feature is only supported by the command line interface of the
+        MCH (Telnet, SSH or MOXA communication interfaces). An update can't
+        be repeated safely, so there's no failover to another interface.
 
         This method expects the firmware binary pointed by the value of the
         argument *fw_version* to be available in the TFTP server.
@@ -181,6 +456,7 @@ class NATMCH(GenDevInterface):
             fw_version: version release number for the new fw.
             part: modifier allowing the update of different parts within
                   the same device.
+            deadline: limit for the whole update, including the reboot.
 
         Returns:
             If failure, it returns a tuple containing False, and a message
@@ -189,18 +465,19 @@ class NATMCH(GenDevInterface):
 
         Raises:
             ConnectionError: If the device is not accessible.
+            gendev_err.ConnTimeout if the deadline is exceeded.
         """
-        if ConnType.TELNET in self.allowed_conn:
-            response = self._tel_conn.update_fw(fw_version)
-        else:
-            raise FeatureNotSupported(
-                "Impossible to update the fw of the"
-                " device with the given allowed"
-                "communication interfaces to the MCH."
+        try:
+            return self._run(
+                "update_fw", "update_fw", fw_version, failover=False, deadline=deadline
             )
-        return response
+        finally:
+            # The versions (and the identity) of the device are not known
+            # anymore
+            if self.state_cache is not None:
+                self.state_cache.discard(self.ip_address, "device_info", "is_mch")
 
-    def set_configuration(self, category, data, verify=True):
+    def set_configuration(self, category, data, verify=True, deadline: Deadline = None):
         """Change the configuration of the device.
 
         This method focuses on the configuration parameters that are not
@@ -208,11 +485,15 @@ class NATMCH(GenDevInterface):
         parameters is not mandatory, and also, a particular category of
         settings can be modified without affecting the rest.
 
+        This is a transaction with a single category, see the method
+        transaction for changing several categories with a single reboot.
+
         Args:
             category(str): settings category to be affected.
             data(dict): dictionary containing the values to be modified
             verify(bool): when True, the method performs a checking after
                           setting the new parameters.
+            deadline: limit for the whole operation, including the reboot.
 
         Returns:
             - 0 when successful or verify=False
@@ -223,9 +504,33 @@ class NATMCH(GenDevInterface):
         Raises:
             ConnectionError: If the device is not accessible.
         """
-        raise NotImplementedError
+        with self.transaction(verify=verify, deadline=deadline) as tx:
+            tx.stage(category, data)
+        return tx.result if tx.result == 0 else tx.result[category]
+
+    def transaction(
+        self,
+        verify: bool = True,
+        reboot: bool = True,
+        deadline: Deadline = None,
+    ) -> ConfigTransaction:
+        """Start a configuration transaction.
+
+        The changes staged in the transaction are applied together, with a
+        single reboot of the MCH and a single read-back verification.
+
+        Args:
+            verify: read back the configuration after applying it.
+            reboot: reboot the MCH after applying the changes.
+            deadline: limit for the whole commit.
+
+        Returns:
+            A ConfigTransaction, to be used as context manager (the changes
+            are committed when exiting the context without errors).
+        """
+        return ConfigTransaction(self, verify=verify, reboot=reboot, deadline=deadline)
 
-    def get_configuration(self, category: str = None):
+    def get_configuration(self, category: str = None, deadline: Deadline = None):
         """Get the configuration of the device.
 
         This method returns a dictionary containing the configuration
@@ -235,32 +540,70 @@ class NATMCH(GenDevInterface):
         This method can be used for checking the good configuration of a
         device.
 
+        This feature is only supported by the ETHER communication interface.
+
         Args:
             category: points to a subset of the configuration parameters of
                       the device.
+            deadline: limit for the whole operation.
 
         Returns:
             A dictionary containing the configuration of the device.
 
         Raises:
-            ConnectionError: If the device is not accessible.
+            gendev_err.FeatureNotSupported if ETHER is not allowed.
+            gendev_err.NoRouteToDevice if the device is not accessible.
         """
-        raise NotImplementedError
+        return self._run(
+            "get_configuration", "get_configuration", category, deadline=deadline
+        )
+
+    def run_commands(
+        self, commands: list, failover: bool = False, deadline: Deadline = None
+    ) -> list:
+        """Run several commands of the CLI, pipelined in a single write.
+
+        This feature is only supported by the command line interface of the
+        MCH (Telnet, SSH or MOXA communication interfaces).
+
+        Args:
+            commands: commands of the CLI.
+            failover: try the next interface when the chosen one fails. Only
+                      use it for commands that can be repeated safely.
+            deadline: limit for the whole batch.
 
-    def _reboot(self, sleep: int = 50):
+        Returns:
+            The output of each command (bytes). See
+            :py:meth:`NATMCHTelnet.run_commands`.
+        """
+        return self._run(
+            "run_commands",
+            "run_commands",
+            commands,
+            failover=failover,
+            deadline=deadline,
+        )
+
+    def close(self):
+        """Close the connections opened with the MCH.
+
+        The Telnet session shared through a multiplexer is kept open for the
+        rest of its users (see MuxRegistry.close).
+        """
+        while self._conns:
+            _, conn = self._conns.popitem()
+            session = getattr(conn, "_session", None)
+            if session is not None:
+                session.close()
+
+    def _reboot(self, sleep: int = 50, deadline: Deadline = None):
         """Internal method to reboot the MCH after a timeout.
 
         Args:
             sleep: Number of seconds to wait after rebooting the device.
+            deadline: limit for the reboot.
         """
-        if ConnType.TELNET in self.allowed_conn:
-            self._tel_conn._reboot(sleep)
-        else:
-            raise FeatureNotSupported(
-                "Impossible to reboot the device"
-                "with the given allowed"
-                "communication interfaces to the MCH."
-            )
+        self._run("reboot", "_reboot", sleep, failover=False, deadline=deadline)
 
     def _parse_config(self):
         """Internal method to parse the configuration of the MCH.
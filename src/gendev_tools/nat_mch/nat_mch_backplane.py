@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+nat_mch_backplane.py
+~~~~~~~~~~~~~~~~~~~~
+
+Structured model of the backplane startup script of the NAT MCH.
+
+The backplane category of *get_configuration* returns the whole script
+(*nat_mch_startup_cfg.txt*) as a single string. The script is parsed here into
+sections of entries, so it can be queried by section and key, and two scripts
+can be compared without a text diff of the whole file.
+
+The format of the script is not documented, so the parser is tolerant:
+
+- Blank lines and comments (starting with ``#``, ``;``, ``!`` or ``//``) are
+  skipped.
+- A line like ``[name]`` starts a new section. The entries found before the
+  first section belong to the section ``""``.
+- A line like ``key = value`` is an assignment.
+- Any other line is a command. The key is the command with all its arguments
+  but the last one, and the value is the last argument (i.e. ``set_param 1 2``
+  is the key ``set_param 1`` with the value ``2``). A command without
+  arguments has an empty value.
+
+When a key appears several times within a section, the last value is the
+effective one, as it happens when the script is run.
+
+Each section keeps a digest of its entries, so two scripts are compared
+section by section, and only the sections with a different digest are
+compared entry by entry.
+
+Example:
+    >>> script = BackplaneScript.from_config(mch.get_configuration("backplane"))
+    >>> script.get("Slot 1", "enable")
+    >>> diff = script.diff(golden)
+"""
+
+import re
+import functools
+from collections import OrderedDict
+from ..gendev_digest import config_digest
+from ..gendev_drift import PATH_SEP
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MTCA Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+# Key of the script within the output of get_configuration("backplane")
+CONFIG_KEY = "Backplane Configuration"
+
+_COMMENTS = ("#", ";", "!", "//")
+_match_section = re.compile(r"^\[\s*(.*?)\s*\]$")
+_match_assignment = re.compile(r"^([^=\s][^=]*?)\s*=\s*(.*)$")
+
+
+def parse_line(line: str):
+    """Parse a line of the script.
+
+    Returns:
+        - None for blank lines and comments.
+        - A tuple ("section", name) for section headers.
+        - A tuple ("entry", key, value) for the rest of lines.
+    """
+    line = line.strip()
+    if not line or line.startswith(_COMMENTS):
+        return None
+
+    match = _match_section.match(line)
+    if match:
+        return ("section", match.group(1))
+
+    match = _match_assignment.match(line)
+    if match:
+        return ("entry", match.group(1), match.group(2))
+
+    tokens = line.split()
+    if len(tokens) == 1:
+        return ("entry", tokens[0], "")
+    return ("entry", " ".join(tokens[:-1]), tokens[-1])
+
+
+class BackplaneSection:
+    """Entries of a section of the script."""
+
+    def __init__(self, name: str):
+        self.name = name
+        # Entries in the order of the script: (line number, key, value)
+        self.entries = list()
+        # Effective value of each key
+        self.values = OrderedDict()
+        self._digest = None
+
+    def add(self, line_number: int, key: str, value: str):
+        self.entries.append((line_number, key, value))
+        # A repeated key moves to the position of its last assignment
+        self.values.pop(key, None)
+        self.values[key] = value
+        self._digest = None
+
+    @property
+    def digest(self) -> str:
+        """Digest of the effective values of the section."""
+        if self._digest is None:
+            self._digest = config_digest(list(self.values.items()), ordered=True)
+        return self._digest
+
+    def __len__(self):
+        return len(self.values)
+
+
+class BackplaneScript:
+    """Parsed backplane startup script."""
+
+    def __init__(self, text: str):
+        """Class constructor.
+
+        Args:
+            text: content of the startup script.
+        """
+        self.text = text
+        self.sections = OrderedDict()
+        section = self._section("")
+        for line_number, line in enumerate(text.splitlines(), 1):
+            parsed = parse_line(line)
+            if parsed is None:
+                continue
+            if parsed[0] == "section":
+                section = self._section(parsed[1])
+            else:
+                section.add(line_number, parsed[1], parsed[2])
+        # The section for the entries without section is only kept if used
+        if not self.sections[""].entries:
+            del self.sections[""]
+        self.digest = config_digest(
+            [(name, s.digest) for name, s in self.sections.items()], ordered=True
+        )
+
+    def _section(self, name: str) -> BackplaneSection:
+        # A section found twice continues the first one
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = BackplaneSection(name)
+        return section
+
+    @classmethod
+    def from_config(cls, config: dict) -> "BackplaneScript":
+        """Parse the output of *get_configuration("backplane")*."""
+        return parse_script(config.get(CONFIG_KEY, ""))
+
+    def get(self, section: str, key: str, default=None):
+        """Effective value of a key of a section."""
+        entries = self.sections.get(section)
+        if entries is None:
+            return default
+        return entries.values.get(key, default)
+
+    def __getitem__(self, section: str) -> OrderedDict:
+        return self.sections[section].values
+
+    def __contains__(self, section: str):
+        return section in self.sections
+
+    def section_digests(self) -> OrderedDict:
+        """Digest of each section."""
+        return OrderedDict((name, s.digest) for name, s in self.sections.items())
+
+    def to_dict(self) -> OrderedDict:
+        """Nested dictionary section -> key -> value.
+
+        The dictionary can be used with the tools of gendev_drift and
+        gendev_snapshot.
+        """
+        return OrderedDict(
+            (name, OrderedDict(s.values)) for name, s in self.sections.items()
+        )
+
+    def changed_sections(self, other: "BackplaneScript") -> list:
+        """Sections with a different content in *other* (or missing in any)."""
+        names = list(self.sections) + [
+            name for name in other.sections if name not in self.sections
+        ]
+        return [
+            name
+            for name in names
+            if name not in self.sections
+            or name not in other.sections
+            or self.sections[name].digest != other.sections[name].digest
+        ]
+
+    def diff(self, other: "BackplaneScript") -> OrderedDict:
+        """Compare with another script, taking this one as the reference.
+
+        Only the sections whose digest differs are compared entry by entry.
+
+        Returns:
+            An OrderedDict indexed by the path of the entries that don't match
+            (section and key joined using gendev_drift.PATH_SEP), in the same
+            format as gendev_drift.diff_config: for each key, the expected
+            (this script) and the given (*other*) values are provided. An
+            entry missing on one side is reported as None.
+        """
+        diff = OrderedDict()
+        if self.digest == other.digest:
+            return diff
+
+        empty = OrderedDict()
+        for name in self.changed_sections(other):
+            expected = self[name] if name in self else empty
+            given = other[name] if name in other else empty
+            for key, value in expected.items():
+                if given.get(key) != value:
+                    diff[name + PATH_SEP + key] = {
+                        "expected": value,
+                        "given": given.get(key),
+                    }
+            for key, value in given.items():
+                if key not in expected:
+                    diff[name + PATH_SEP + key] = {"expected": None, "given": value}
+        return diff
+
+
+@functools.lru_cache(maxsize=256)
+def parse_script(text: str) -> BackplaneScript:
+    """Parse a startup script.
+
+    The scripts of a fleet are usually the same, so the parsed scripts are
+    cached by their content: the same script is only parsed once.
+
+    The returned object is shared, it must not be modified.
+    """
+    return BackplaneScript(text)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+nat_mch_caps.py
+~~~~~~~~~~~~~~~
+
+Capabilities of the NAT MCH firmware versions.
+
+Not every firmware version of the MCH offers the same configuration pages,
+and the layout of some of them changes among versions. Without knowing it,
+every request to a page the firmware doesn't offer is sent and fails, and
+the parsers are tried in turn on pages they don't understand.
+
+The capabilities are learnt while using the devices: the first time a
+category is requested to an MCH running some firmware version, the outcome
+is stored in a table indexed by the firmware version (the *fw_ver* of
+device_info): whether the category is supported, and which variant of the
+parser understood the page. The following devices running the same firmware
+version skip the unsupported categories and use the right parser straight
+away.
+
+A single failure doesn't make a category unsupported: a page can fail to
+load, or to parse, for reasons unrelated to the firmware. The category is
+considered unsupported after several failures in a row, and only for a while:
+once that expires, the category is requested again.
+
+The table is kept in a JSON file, so it is shared by the following runs of
+the tools::
+
+    {"V2.21.8": {"category": {"pcie": {"supported": true,
+                                       "variant": "relaxed"}}}}
+
+Example:
+    >>> caps = CapabilityCache("~/.gendev_caps.json")
+    >>> mch = NATMCH("172.30.5.238", [ConnType.ETHER], caps=caps)
+    >>> mch.get_configuration("pcie")
+    >>> caps.variant("V2.21.8", "pcie")
+    'relaxed'
+"""
+
+import os
+import json
+import threading
+from ..gendev_clock import default_clock
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MTCA Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class CapabilityCache:
+    """Table of the capabilities of the firmware versions of the MCH.
+
+    The capabilities are grouped by kind (i.e. *category* for the
+    configuration categories of the web interface). The table is thread
+    safe, and it is saved each time a new capability is learnt.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        threshold: int = 3,
+        ttl: float = 86400.0,
+        clock=None,
+    ):
+        """Class constructor.
+
+        Args:
+            path: JSON file keeping the table. It is loaded when it exists,
+                  and created when the first capability is learnt. The table
+                  is kept only in memory when not given.
+            threshold: failures in a row making a capability unsupported.
+            ttl: seconds a capability is considered unsupported. Then, it is
+                 unknown again, so it's checked with the device.
+            clock: clock for the expiration (its wall clock, comparable among
+                   runs). The default clock of the library is used when not
+                   given.
+        """
+        self.path = os.path.expanduser(path) if path is not None else None
+        self.threshold = threshold
+        self.ttl = ttl
+        self.clock = clock if clock is not None else default_clock
+        self._table = dict()
+        self._lock = threading.Lock()
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path) as f:
+                self._table = json.load(f)
+
+    def _entry(self, fw_ver: str, kind: str, name: str):
+        return self._table.get(fw_ver, {}).get(kind, {}).get(name)
+
+    def supported(self, fw_ver: str, kind: str, name: str):
+        """Whether a firmware version supports a capability.
+
+        Returns:
+            True or False when it is known, None otherwise.
+        """
+        with self._lock:
+            entry = self._entry(fw_ver, kind, name)
+        if entry is None:
+            return None
+        # The files written before the failures expired have no failed_at,
+        # their failures are expired
+        if entry["supported"] is False and (
+            self.clock.time() - entry.get("failed_at", 0) >= self.ttl
+        ):
+            return None
+        return entry["supported"]
+
+    def variant(self, fw_ver: str, category: str):
+        """Parser variant of a configuration category for a firmware version.
+
+        Returns:
+            The name of the variant (see nat_mch_web.page_variants), or None
+            when it is not known.
+        """
+        with self._lock:
+            entry = self._entry(fw_ver, "category", category)
+        return None if entry is None else entry.get("variant")
+
+    def learn(
+        self,
+        fw_ver: str,
+        kind: str,
+        name: str,
+        supported: bool,
+        variant: str = None,
+    ):
+        """Store an observation of a capability of a firmware version.
+
+        A success is stored straight away, but a failure only makes the
+        capability unsupported after *threshold* failures in a row.
+
+        Args:
+            fw_ver: firmware version of the MCH.
+            kind: kind of capability (i.e. category).
+            name: name of the capability (i.e. pcie).
+            supported: whether the capability worked with the device.
+            variant: parser variant understanding the page of the category.
+        """
+        with self._lock:
+            capabilities = self._table.setdefault(fw_ver, {}).setdefault(kind, {})
+            previous = capabilities.get(name) or dict()
+            if supported:
+                entry = {"supported": True, "variant": variant}
+            else:
+                failures = previous.get("failures", 0) + 1
+                entry = {
+                    "supported": (
+                        False
+                        if failures >= self.threshold
+                        else previous.get("supported")
+                    ),
+                    "variant": previous.get("variant"),
+                    "failures": failures,
+                    "failed_at": self.clock.time(),
+                }
+            if previous == entry:
+                return
+            capabilities[name] = entry
+            self._save()
+
+    def forget(self, fw_ver: str = None):
+        """Drop the capabilities of a firmware version, or the whole table."""
+        with self._lock:
+            if fw_ver is None:
+                self._table.clear()
+            else:
+                self._table.pop(fw_ver, None)
+            self._save()
+
+    def to_dict(self) -> dict:
+        """Copy of the table."""
+        with self._lock:
+            return json.loads(json.dumps(self._table))
+
+    def _save(self):
+        if self.path is None:
+            return
+        # The file is replaced at once, so a reader never finds it half written
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(self._table, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""
+nat_mch_crate.py
+~~~~~~~~~~~~~~~~
+
+Crate level access: the MCH of a µTCA crate and the modules (FRUs) it manages.
+
+The checks of a crate (is the MCH alive, which AMCs are there, are they
+active) need several queries to the MCH. Running each one through NATMCH
+costs a fixed wait per CLI command, and the requests to the web interface
+open a new HTTP connection each time.
+
+A Crate keeps a single management connection per interface with its MCH: one
+CLI session, where the commands are pipelined (see
+NATMCHTelnet.run_commands), and one HTTP session (requests.Session, keeping
+the connection alive). All the queries are combined in a snapshot of the
+crate, which is cached for some seconds, so the health and the inventory of
+the crate are served from the same snapshot.
+
+The list of FRUs is parsed from the output of the command *show_fru*. The
+format of the output is inferred, so the parser is tolerant: every line like
+``<id> <device> <state> <name>`` (i.e. ``5  AMC1  M4  DAMC-FMC25``) is a FRU,
+and the rest of lines are ignored.
+
+Example:
+    >>> crate = Crate("crate-01", "172.30.5.238")
+    >>> crate.health()
+    {'reachable': True, 'degraded': ['AMC2']}
+    >>> crate.inventory()["AMC2"]
+    {'fru_id': 6, 'state': 'M1', 'name': 'DAMC-FMC2ZUP'}
+"""
+
+import re
+import threading
+import requests as rq
+from collections import OrderedDict
+from ..gendev_interface import ConnType
+from ..gendev_deadline import Deadline
+from ..gendev_selector import TRANSPORT_ERRORS
+from .nat_mch import NATMCH
+from .nat_mch_telnet import parse_device_info
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MTCA Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+# Commands of the CLI run for each snapshot. The first two are needed for the
+# information of the MCH, and the third one for the inventory.
+SNAPSHOT_COMMANDS = ("version", "ni", "show_fru")
+
+# Hot swap state of an active FRU
+FRU_ACTIVE = "M4"
+
+_match_fru = re.compile(
+    rb"^[ \t]*(\d+)[ \t]+(\S+)[ \t]+(M\d)[ \t]+(.*?)[ \t]*\r?$", re.MULTILINE
+)
+
+
+def parse_fru_list(raw) -> OrderedDict:
+    """Extract the FRUs of the crate from the output of the command show_fru.
+
+    Args:
+        raw: output of the command (a bytes-like object).
+
+    Returns:
+        An OrderedDict indexed by the device name of each FRU (i.e. AMC1),
+        with its FRU id, hot swap state and name.
+    """
+    frus = OrderedDict()
+    for match in _match_fru.finditer(bytes(raw)):
+        fru_id, device, state, name = (
+            group.decode("ascii", errors="replace") for group in match.groups()
+        )
+        frus[device] = {"fru_id": int(fru_id), "state": state, "name": name}
+    return frus
+
+
+class Crate:
+    """µTCA crate managed by an NAT MCH."""
+
+    def __init__(
+        self,
+        name: str,
+        mch_address: str,
+        allowed_conn: list = None,
+        categories: list = (),
+        ttl: float = 60.0,
+        **mch_options
+    ):
+        """Class constructor.
+
+        Args:
+            name: identifier of the crate. It is also used as the crate
+                  resource in the governor.
+            mch_address: IP address of the MCH.
+            allowed_conn: communication interfaces of the MCH. A CLI
+                          interface is needed for the snapshots. By default,
+                          ETHER and TELNET.
+            categories: configuration categories of the MCH included in the
+                        snapshot (they are retrieved from the web interface).
+            ttl: seconds a snapshot is served from the cache.
+            mch_options: other arguments for NATMCH (i.e. health, selector,
+                         governor, clock or ssh_options).
+        """
+        self.name = name
+        self.categories = list(categories)
+        self.ttl = ttl
+        self.http = rq.Session()
+        if allowed_conn is None:
+            allowed_conn = [ConnType.ETHER, ConnType.TELNET]
+        self.mch = NATMCH(
+            mch_address, allowed_conn, crate=name, http=self.http, **mch_options
+        )
+        self._snapshot = None
+        self._taken_at = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _take_snapshot(self, deadline: Deadline) -> OrderedDict:
+        snapshot = OrderedDict()
+        snapshot["Crate"] = self.name
+        # The device is held for the whole snapshot
+        with self.mch.governor.limit(self.mch._resources("snapshot"), deadline):
+            version, ni, fru = self.mch.run_commands(
+                SNAPSHOT_COMMANDS, failover=True, deadline=deadline
+            )
+            snapshot["MCH"] = parse_device_info(version, ni)
+            snapshot["FRU"] = parse_fru_list(fru)
+            if self.categories:
+                snapshot["Configuration"] = OrderedDict(
+                    (category, self.mch.get_configuration(category, deadline))
+                    for category in self.categories
+                )
+        return snapshot
+
+    def snapshot(self, refresh: bool = False, deadline: Deadline = None) -> dict:
+        """Combined state of the crate.
+
+        Args:
+            refresh: ignore the cached snapshot.
+            deadline: limit for taking the snapshot.
+
+        Returns:
+            An OrderedDict with the name of the crate (*Crate*), the
+            information of the MCH (*MCH*, see device_info), the FRUs of the
+            crate (*FRU*, see :py:func:`parse_fru_list`) and, if categories
+            were given, the configuration of the MCH (*Configuration*).
+
+        Raises:
+            Any error of the MCH. Failed snapshots are not cached.
+        """
+        # Concurrent callers wait for the same snapshot
+        with self._lock:
+            now = self.mch.clock.monotonic()
+            if refresh or self._snapshot is None or now - self._taken_at >= self.ttl:
+                deadline = (
+                    Deadline(clock=self.mch.clock) if deadline is None else deadline
+                )
+                self._snapshot = self._take_snapshot(deadline)
+                self._taken_at = self.mch.clock.monotonic()
+            return self._snapshot
+
+    def inventory(self, refresh: bool = False, deadline: Deadline = None) -> dict:
+        """FRUs of the crate (see :py:func:`parse_fru_list`)."""
+        return self.snapshot(refresh, deadline)["FRU"]
+
+    def health(self, refresh: bool = False, deadline: Deadline = None) -> dict:
+        """Health of the crate.
+
+        Returns:
+            A dictionary with:
+
+            - *reachable*: whether the MCH answered.
+            - *degraded*: device names of the FRUs that are not active.
+            - *error*: the failure, when the MCH is not reachable.
+        """
+        try:
+            snapshot = self.snapshot(refresh, deadline)
+        except TRANSPORT_ERRORS as e:
+            return {"reachable": False, "degraded": [], "error": str(e)}
+        return {
+            "reachable": True,
+            "degraded": [
+                device
+                for device, fru in snapshot["FRU"].items()
+                if fru["state"] != FRU_ACTIVE
+            ],
+        }
+
+    def close(self):
+        """Close the connections with the MCH."""
+        self.mch.close()
+        self.http.close()
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+nat_mch_moxa.py
+~~~~~~~~~~~~~~~
+
+Access to the command line interface of NAT MCHs through the serial console,
+exposed over TCP by a MOXA hub.
+
+A MOXA hub in TCP server mode forwards each of its serial ports to a TCP port.
+The bytes are forwarded as they are, without any protocol on top (unlike
+Telnet), but the MCH on the other side offers the same command line interface.
+So that, the handling of the CLI is shared with the module nat_mch_telnet.
+
+This module offers two ways of accessing the MCHs:
+
+- NATMCHMoxa: the same API as NATMCHTelnet, for a single MCH.
+- MoxaHub: runs commands in many ports of a hub concurrently, using a single
+  asyncio event loop (one thread) for all of them.
+"""
+
+import asyncio
+from ..gendev_transport import TCPSession
+from ..gendev_err import ConnTimeout, NoRouteToDevice
+from ..gendev_health import HealthRegistry, default_registry
+from ..gendev_deadline import Deadline, LatencyRegistry
+from .nat_mch_telnet import NATMCHTelnet, PROMPT, parse_device_info
+from logging import Logger
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MTCA Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class NATMCHMoxa(NATMCHTelnet):
+    """NATMCHMoxa access an NAT MCH via the serial console, using a MOXA hub.
+
+    Supported operations: the same as NATMCHTelnet.
+    """
+
+    _conn_name = "moxa"
+
+    def __init__(
+        self,
+        hub_address: str,
+        port: int,
+        logger: Logger = None,
+        health: HealthRegistry = None,
+        latency: LatencyRegistry = None,
+        deadline: Deadline = None,
+        session=None,
+        clock=None,
+    ):
+        """Class constructor.
+
+        Args:
+            hub_address: the IP address of the MOXA hub.
+            port: TCP port of the hub connected to the serial port of the MCH.
+            logger: reference to a logger that is being used
+            health: registry keeping track of the devices that are down.
+            latency: registry with the RTT measurements of the devices.
+            deadline: limit for opening the connection.
+            session: an already open session with the API of
+                     telnetlib.Telnet. When given, no connection is opened.
+            clock: clock for the waits (see NATMCHTelnet).
+
+        Raises:
+            gendev_err.ConnTimeout if the hub is not reachable.
+            gendev_err.NoRouteToDevice if the connection is rejected.
+            gendev_err.DeviceUnavailable if the port failed recently.
+        """
+        super().__init__(
+            hub_address,
+            port,
+            logger=logger,
+            health=health,
+            latency=latency,
+            deadline=deadline,
+            session=session,
+            clock=clock,
+        )
+
+    @staticmethod
+    def _make_device_id(ip_address: str, port: int) -> str:
+        # Many MCHs share the address of the hub
+        return "{}:{}".format(ip_address, port)
+
+    def _connect(self, port: int, timeout: float):
+        """Internal method to establish the connection with the hub.
+
+        Returns:
+            A gendev_transport.TCPSession connected to the port of the hub.
+        """
+        return TCPSession(self.ip_address, port, timeout=timeout)
+
+
+class MoxaHub:
+    """Concurrent access to the MCHs connected to a MOXA hub.
+
+    All the ports are served from a single asyncio event loop: a slow (or
+    dead) MCH doesn't delay the others, and no thread per port is needed.
+
+    Example:
+        >>> hub = MoxaHub("172.30.5.10", timeout=10)
+        >>> hub.device_info([4001, 4002, 4003])
+        {4001: {'Board': {...}, 'Network': {...}}, 4002: ..., 4003: ...}
+    """
+
+    def __init__(
+        self, address: str, timeout: float = 10.0, health: HealthRegistry = None
+    ):
+        """Class constructor.
+
+        Args:
+            address: the IP address of the MOXA hub.
+            timeout: seconds to wait for the answer to each command.
+            health: registry keeping track of the ports that are down.
+        """
+        self.address = address
+        self.timeout = timeout
+        self._health = health if health is not None else default_registry
+
+    def _device_id(self, port: int) -> str:
+        return "{}:{}".format(self.address, port)
+
+    async def _command(self, reader, writer, command: bytes) -> str:
+        """Send a command and read its output, up to the prompt."""
+        writer.write(command + b"\r")
+        try:
+            await writer.drain()
+        except OSError as e:
+            raise NoRouteToDevice(
+                "Connection with {} lost ({})".format(self.address, e)
+            )
+        try:
+            response = await asyncio.wait_for(
+                reader.readuntil(PROMPT), timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            raise ConnTimeout(
+                "Timeout waiting for the command {} in {}".format(
+                    command.decode("ascii"), self.address
+                )
+            )
+        except asyncio.IncompleteReadError:
+            raise NoRouteToDevice("Connection closed by {}".format(self.address))
+        return response.decode("ascii", errors="replace")
+
+    async def run_port(self, port: int, commands: list) -> list:
+        """Run a sequence of commands in the MCH connected to a port.
+
+        Args:
+            port: TCP port of the hub.
+            commands: list of commands of the CLI of the MCH.
+
+        Returns:
+            A list with the output of each command.
+
+        Raises:
+            gendev_err.ConnTimeout if the MCH doesn't answer.
+            gendev_err.NoRouteToDevice if the connection is rejected.
+            gendev_err.DeviceUnavailable if the port failed recently.
+        """
+        device_id = self._device_id(port)
+        self._health.check(device_id)
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.address, port, limit=2**20),
+                timeout=self.timeout,
+            )
+        except asyncio.TimeoutError:
+            self._health.record_failure(device_id)
+            raise ConnTimeout("Timeout while opening the link to {}".format(device_id))
+        except OSError as e:
+            self._health.record_failure(device_id)
+            raise NoRouteToDevice(
+                "Check the connectivity to the hub {} ({})".format(device_id, e)
+            )
+
+        try:
+            # A carriage return gets the prompt, and clears previous garbage
+            await self._command(reader, writer, b"")
+            outputs = [
+                await self._command(reader, writer, command.encode("ascii"))
+                for command in commands
+            ]
+        except (ConnTimeout, NoRouteToDevice):
+            self._health.record_failure(device_id)
+            raise
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                # The connection was already broken
+                pass
+        self._health.record_success(device_id)
+
+        return outputs
+
+    async def run_async(self, commands: dict) -> dict:
+        """Run commands in several ports concurrently.
+
+        Args:
+            commands: dictionary port -> list of commands.
+
+        Returns:
+            A dictionary port -> list of outputs. When a port fails, the
+            exception is returned instead of the list.
+        """
+        ports = list(commands)
+        results = await asyncio.gather(
+            *(self.run_port(port, commands[port]) for port in ports),
+            return_exceptions=True,
+        )
+        return dict(zip(ports, results))
+
+    def run(self, commands: dict) -> dict:
+        """Blocking version of run_async.
+
+        It can't be called from a running event loop, use run_async instead.
+        """
+        return asyncio.run(self.run_async(commands))
+
+    def device_info(self, ports: list) -> dict:
+        """Retrieve the main information of the MCHs connected to the hub.
+
+        Args:
+            ports: TCP ports of the hub.
+
+        Returns:
+            A dictionary port -> device information (as returned by
+            NATMCHTelnet.device_info), or the exception raised by the port.
+        """
+        results = self.run({port: ["version", "ni"] for port in ports})
+        for port, outputs in results.items():
+            if not isinstance(outputs, Exception):
+                results[port] = parse_device_info(*outputs)
+        return results
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+nat_mch_mux.py
+~~~~~~~~~~~~~~
+
+Thread-safe sharing of a CLI session with an NAT MCH.
+
+A session of the command line interface (NATMCHTelnet, or any of its
+subclasses) can't be used from several threads: the commands would interleave
+on the wire, and the output of a command could be read by another caller.
+Opening a session per caller is not an option either, as the MCH only allows
+a few CLI sessions at the same time.
+
+The multiplexer owns the session of a device, and serializes the requests of
+all the callers through a queue, served by a single worker thread. Each caller
+gets a future with the response to its own request. The futures can also be
+awaited from asyncio tasks. NATMCH runs its Telnet operations through the
+multiplexer of the device when it's given a registry (argument *muxes*).
+
+Example:
+    >>> mux = muxes.get("172.30.5.238", lambda: NATMCHTelnet("172.30.5.238"))
+    >>> future = mux.submit_command("version")
+    >>> print(future.result())
+    >>> info = await mux.async_call("device_info")
+"""
+
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from ..gendev_deadline import Deadline
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MTCA Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+# Request that stops the worker
+_STOP = object()
+
+
+class SessionMux:
+    """Serializes the requests of many callers on a single CLI session."""
+
+    def __init__(self, factory):
+        """Class constructor.
+
+        Args:
+            factory: callable returning the connection to the MCH (i.e. a
+                     NATMCHTelnet instance). It is called by the worker, the
+                     first time a request is served, and again after a
+                     connection error.
+        """
+        self._factory = factory
+        self._conn = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._closed = False
+
+    def _serve(self):
+        while True:
+            request = self._queue.get()
+            if request is _STOP:
+                break
+            future, function, args, kwargs = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if self._conn is None:
+                    self._conn = self._factory()
+                future.set_result(function(self._conn, *args, **kwargs))
+            except (EOFError, OSError) as e:
+                # The session is broken, the next request opens a new one
+                self._conn = None
+                future.set_exception(e)
+            except Exception as e:
+                future.set_exception(e)
+        if self._conn is not None and hasattr(self._conn, "_session"):
+            self._conn._session.close()
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        """Queue a request.
+
+        Args:
+            function: callable receiving the connection as first argument,
+                      followed by *args* and *kwargs*. It runs in the worker,
+                      with exclusive access to the session.
+
+        Returns:
+            A concurrent.futures.Future with the value returned by the
+            function.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The session multiplexer is closed")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._serve, daemon=True)
+                self._worker.start()
+            self._queue.put((future, function, args, kwargs))
+        return future
+
+    def call(self, method: str, *args, **kwargs) -> Future:
+        """Queue a call to a method of the connection (i.e. device_info)."""
+        return self.submit(
+            lambda conn, *a, **kw: getattr(conn, method)(*a, **kw), *args, **kwargs
+        )
+
+    def submit_command(
+        self, command: str, sleep: int = 1, deadline: Deadline = None
+    ) -> Future:
+        """Queue a command of the CLI.
+
+        Returns:
+            A future with the output of the command (a string).
+        """
+
+        def run(conn):
+            conn._send_command(command, sleep=sleep, deadline=deadline)
+            return conn._read_command()
+
+        return self.submit(run)
+
+    async def async_call(self, method: str, *args, **kwargs):
+        """Awaitable version of call."""
+        return await asyncio.wrap_future(self.call(method, *args, **kwargs))
+
+    async def async_command(
+        self, command: str, sleep: int = 1, deadline: Deadline = None
+    ) -> str:
+        """Awaitable version of submit_command."""
+        return await asyncio.wrap_future(
+            self.submit_command(command, sleep=sleep, deadline=deadline)
+        )
+
+    def close(self):
+        """Close the session once the queued requests are served."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+            worker = self._worker
+        if worker is not None:
+            worker.join()
+
+
+class MuxRegistry:
+    """Registry of the session multiplexers, one per device."""
+
+    def __init__(self):
+        self._muxes = dict()
+        self._lock = threading.Lock()
+
+    def get(self, device, factory) -> SessionMux:
+        """Get the multiplexer of a device, creating it if needed.
+
+        Args:
+            device: identifier of the device (i.e. the IP address).
+            factory: callable returning the connection to the device, used
+                     when there's no multiplexer for it yet.
+        """
+        with self._lock:
+            mux = self._muxes.get(device)
+            if mux is None or mux._closed:
+                mux = self._muxes[device] = SessionMux(factory)
+            return mux
+
+    def close(self, device=None):
+        """Close the multiplexer of a device, or all of them."""
+        with self._lock:
+            devices = list(self._muxes) if device is None else [device]
+            closing = [self._muxes.pop(d) for d in devices if d in self._muxes]
+        for mux in closing:
+            mux.close()
+
+
+# Registry shared by the whole library
+muxes = MuxRegistry()
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+"""
+nat_mch_ssh.py
+~~~~~~~~~~~~~~
+
+Access to the command line interface of NAT MCHs via SSH.
+
+A single authenticated SSH connection is opened per MCH, and it is kept open
+for the lifetime of the object. The key exchange and the authentication are
+only done once: every command runs on its own channel of that connection.
+There are two kinds of channels:
+
+- Exec channels: run a single command and return its output. Several of them
+  can be open at the same time, so independent commands run concurrently.
+- An interactive shell channel, with the same API as telnetlib.Telnet, for the
+  operations that need a dialog with the CLI (i.e. the firmware update). It
+  allows sharing the CLI handling with the module nat_mch_telnet.
+
+This module depends on paramiko, an optional dependency of the library
+(``pip install gendev_tools[ssh]``).
+"""
+
+import socket
+from ..gendev_transport import StreamSession
+from ..gendev_err import ConnNotImplemented, ConnTimeout, NoRouteToDevice
+from ..gendev_health import HealthRegistry
+from ..gendev_deadline import Deadline, LatencyRegistry
+from .nat_mch_telnet import NATMCHTelnet, parse_device_info
+from logging import Logger
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MTCA Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class SSHConnection:
+    """Authenticated SSH connection, running each command on a new channel."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 22,
+        username: str = "root",
+        password: str = None,
+        key_filename: str = None,
+        timeout: float = None,
+    ):
+        """Class constructor.
+
+        Args:
+            host: address of the SSH server.
+            port: port of the SSH server.
+            username: user for the authentication.
+            password: password for the authentication. When it is not given,
+                      the keys (key_filename, or the SSH agent) are used.
+            key_filename: private key for the authentication.
+            timeout: timeout for establishing the connection.
+
+        Raises:
+            gendev_err.ConnNotImplemented if paramiko is not installed.
+            gendev_err.ConnTimeout if the server doesn't answer in time.
+            gendev_err.NoRouteToDevice if the connection or the
+            authentication fails.
+        """
+        if paramiko is None:
+            raise ConnNotImplemented(
+                "The SSH interface needs paramiko: pip install gendev_tools[ssh]"
+            )
+        self.host = host
+        self.port = port
+        self._client = paramiko.SSHClient()
+        # The MCHs regenerate their host keys when they are reflashed
+        self._client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            self._client.connect(
+                host,
+                port,
+                username=username,
+                password=password,
+                key_filename=key_filename,
+                timeout=timeout,
+                banner_timeout=timeout,
+                auth_timeout=timeout,
+                look_for_keys=password is None,
+                allow_agent=password is None,
+            )
+        except socket.timeout:
+            self._client.close()
+            raise ConnTimeout(
+                "Timeout while opening the SSH connection to {}".format(host)
+            )
+        except (paramiko.SSHException, OSError) as e:
+            self._client.close()
+            raise NoRouteToDevice("SSH error with {} ({})".format(host, e))
+
+    def _open_channel(self, timeout: float = None):
+        try:
+            return self._client.get_transport().open_session(timeout=timeout)
+        except (paramiko.SSHException, AttributeError) as e:
+            raise NoRouteToDevice(
+                "The SSH connection to {} was lost ({})".format(self.host, e)
+            )
+
+    def exec_many(self, commands: list, timeout: float = None) -> list:
+        """Run several commands concurrently, each one in its own channel.
+
+        Args:
+            commands: list of commands.
+            timeout: seconds to wait for the output of each command.
+
+        Returns:
+            A list with the output of each command (bytes).
+
+        Raises:
+            gendev_err.ConnTimeout if a command doesn't finish in time.
+            gendev_err.NoRouteToDevice if the connection was lost.
+        """
+        channels = list()
+        try:
+            # All the commands are started before reading any output
+            for command in commands:
+                channel = self._open_channel(timeout)
+                channels.append(channel)
+                channel.settimeout(timeout)
+                try:
+                    channel.exec_command(command)
+                except paramiko.SSHException as e:
+                    raise NoRouteToDevice(
+                        "Failed running {} in {} ({})".format(command, self.host, e)
+                    )
+
+            outputs = list()
+            for command, channel in zip(commands, channels):
+                output = bytearray()
+                try:
+                    data = channel.recv(4096)
+                    while data:
+                        output += data
+                        data = channel.recv(4096)
+                except socket.timeout:
+                    raise ConnTimeout(
+                        "Timeout waiting for the command {} in {}".format(
+                            command, self.host
+                        )
+                    )
+                outputs.append(bytes(output))
+        finally:
+            for channel in channels:
+                channel.close()
+
+        return outputs
+
+    def exec(self, command: str, timeout: float = None) -> bytes:
+        """Run a command in a new channel and return its output."""
+        return self.exec_many([command], timeout)[0]
+
+    def shell(self, timeout: float = None) -> StreamSession:
+        """Open an interactive shell in a new channel.
+
+        Returns:
+            A session with the API of telnetlib.Telnet.
+        """
+        channel = self._open_channel(timeout)
+        try:
+            channel.get_pty()
+            channel.invoke_shell()
+        except paramiko.SSHException as e:
+            channel.close()
+            raise NoRouteToDevice(
+                "Failed opening a shell in {} ({})".format(self.host, e)
+            )
+        return SSHShellSession(channel, self)
+
+    def close(self):
+        self._client.close()
+
+
+class SSHShellSession(StreamSession):
+    """Interactive shell channel with the API of telnetlib.Telnet."""
+
+    def __init__(self, channel, connection: SSHConnection):
+        super().__init__(channel, "ssh://{}".format(connection.host))
+        self.connection = connection
+
+    def close(self):
+        # Closing the shell closes the whole connection
+        super().close()
+        self.connection.close()
+
+
+class NATMCHSSH(NATMCHTelnet):
+    """NATMCHSSH access an NAT MCH via SSH.
+
+    Supported operations: the same as NATMCHTelnet. The device information is
+    retrieved running the commands concurrently, in separate channels.
+    """
+
+    _conn_name = "ssh"
+
+    def __init__(
+        self,
+        ip_address: str,
+        port: int = 22,
+        logger: Logger = None,
+        health: HealthRegistry = None,
+        latency: LatencyRegistry = None,
+        deadline: Deadline = None,
+        session=None,
+        username: str = "root",
+        password: str = None,
+        key_filename: str = None,
+        clock=None,
+    ):
+        """Class constructor.
+
+        Args:
+            ip_address: the IP address of the MCH.
+            port: port of the SSH service (usually, 22)
+            logger: reference to a logger that is being used
+            health: registry keeping track of the devices that are down.
+            latency: registry with the RTT measurements of the devices.
+            deadline: limit for opening the connection.
+            session: an already open SSHShellSession. When given, no
+                     connection is opened.
+            username: user for the authentication.
+            password: password for the authentication.
+            key_filename: private key for the authentication.
+            clock: clock for the waits (see NATMCHTelnet).
+
+        Raises:
+            gendev_err.ConnNotImplemented if paramiko is not installed.
+            gendev_err.ConnTimeout if the device is not reachable.
+            gendev_err.NoRouteToDevice if the connection is rejected.
+            gendev_err.DeviceUnavailable if the device failed recently.
+        """
+        self._credentials = dict(
+            username=username, password=password, key_filename=key_filename
+        )
+        super().__init__(
+            ip_address,
+            port,
+            logger=logger,
+            health=health,
+            latency=latency,
+            deadline=deadline,
+            session=session,
+            clock=clock,
+        )
+
+    def _connect(self, port: int, timeout: float):
+        """Internal method to establish the SSH connection with the MCH.
+
+        Returns:
+            The interactive shell of the connection (SSHShellSession).
+        """
+        connection = SSHConnection(
+            self.ip_address, port, timeout=timeout, **self._credentials
+        )
+        try:
+            return connection.shell(timeout)
+        except Exception:
+            connection.close()
+            raise
+
+    def device_info(self, deadline: Deadline = None) -> dict:
+        """Retrieve the main information about the device.
+
+        The information is returned in a dictionary with 2 categories:
+        *board* and *network*.
+
+        Args:
+            deadline: limit for the whole operation.
+
+        Returns:
+            If success, a dictionary with the device information.
+            If failure, an empty dictionary on failure.
+
+        Raises:
+            gendev_err.ConnTimeout if the deadline is exceeded.
+        """
+        deadline = Deadline(clock=self._clock) if deadline is None else deadline
+        timeout = deadline.bound(self._latency.timeout(self._rtt_key), "device_info")
+        raw_info_version, raw_info_network = self._session.connection.exec_many(
+            ["version", "ni"], timeout
+        )
+
+        return parse_device_info(raw_info_version, raw_info_network)
@@ -17,9 +17,11 @@ the communication via the MHC web interface.
 """
 
 import re
-import time
 import socket
 from ..gendev_err import ConnTimeout, NoRouteToDevice
+from ..gendev_health import HealthRegistry, default_registry
+from ..gendev_deadline import Deadline, LatencyRegistry, default_latency
+from ..gendev_clock import default_clock
 from telnetlib import Telnet
 from logging import Logger
 
@@ -33,6 +35,105 @@ __email__ = "felipe.torresgonzalez@ess.eu"
 __status__ = "Development"
 
 
+# Prompt of the command line interface of the MCH
+PROMPT = b"nat> "
+
+# Server (mchconfig-server) providing the firmware images using TFTP
+FW_SERVER = "172.30.4.69"
+
+# Regular expresions for extracting the infomration relative to the
+# MCH from the version and ni commands. They run on the raw bytes received
+# from the MCH, only the extracted values are decoded.
+_match_fw_ver = re.compile(rb"Firmware (V\d{1,2}\.\d{1,2}\.\d{1,2})")
+# Search for the first occurrence of the token FPGA
+_match_fpga_ver = re.compile(rb"FPGA (V\d{1,2}\.\d{1,2})")
+_match_mcu_ver = re.compile(rb"AVR (\d{1,2}\.\d{1,2})")
+_match_board_sn = re.compile(rb"sn: (\d{6}-\d{4})")
+_match_ip_addr = re.compile(rb"ip address +: +((\d{1,3}\.?){4})")
+_match_mac_addr = re.compile(rb"ieee address +: +(([\d\D]{2}:?){6})")
+_match_subnet_mask = re.compile(rb"network mask +: +((\d{1,3}\.?){4})")
+_match_gateway_addr = re.compile(rb"default gateway +: +((\d{1,3}\.?){4})")
+
+
+def _as_bytes(raw):
+    """Accept the output of the CLI as a string too (i.e. already decoded)."""
+    if isinstance(raw, str):
+        return raw.encode("latin-1", errors="replace")
+    return raw
+
+
+def _extract(regex, raw) -> str:
+    """Decode the first group matched by the regex in the raw output.
+
+    The console might send noise (non ASCII bytes), so the decoding never
+    fails. None is returned when the value is not found.
+    """
+    match = regex.search(raw)
+    if match is None:
+        return None
+    return match.group(1).decode("ascii", errors="replace")
+
+
+def parse_board_info(raw_info_version) -> dict:
+    """Extract the board information from the output of the command version.
+
+    Args:
+        raw_info_version: output of the command (a bytes-like object).
+
+    Returns:
+        A dictionary with the board information.
+    """
+    raw_info_version = _as_bytes(raw_info_version)
+    return {
+        "fw_ver": _extract(_match_fw_ver, raw_info_version),
+        "fpga_ver": _extract(_match_fpga_ver, raw_info_version),
+        "mcu_ver": _extract(_match_mcu_ver, raw_info_version),
+        "serial_num": _extract(_match_board_sn, raw_info_version),
+    }
+
+
+def parse_network_info(raw_info_network) -> dict:
+    """Extract the network information from the output of the command ni.
+
+    Args:
+        raw_info_network: output of the command (a bytes-like object).
+
+    Returns:
+        A dictionary with the network information.
+    """
+    raw_info_network = _as_bytes(raw_info_network)
+    return {
+        "ip_address": _extract(_match_ip_addr, raw_info_network),
+        "mac_address": _extract(_match_mac_addr, raw_info_network),
+        "subnet_address": _extract(_match_subnet_mask, raw_info_network),
+        "gateway_address": _extract(_match_gateway_addr, raw_info_network),
+    }
+
+
+def parse_device_info(raw_info_version, raw_info_network) -> dict:
+    """Build the device information from the output of the CLI of the MCH.
+
+    This is shared by all the modules accessing the command line interface of
+    the MCH, no matter the transport (Telnet, MOXA, ...).
+
+    Args:
+        raw_info_version: output of the command *version*.
+        raw_info_network: output of the command *ni*.
+
+    Returns:
+        If success, a dictionary with the device information.
+        If failure, an empty dictionary on failure.
+    """
+    if len(raw_info_version) == 0 or len(raw_info_network) == 0:
+        return dict()
+
+    resp_dict = dict()
+    resp_dict["Board"] = parse_board_info(raw_info_version)
+    resp_dict["Network"] = parse_network_info(raw_info_network)
+
+    return resp_dict
+
+
 class NATMCHTelnet:
     """NATMCTelnet access an NAT MCH via Telnet.
 
@@ -46,48 +147,130 @@ class NATMCHTelnet:
     - Firmware update of the MCH.
     """
 
-    def __init__(self, ip_address: str, port: int = 23, logger: Logger = None):
+    # Name of the communication interface, used to index the RTT measurements
+    _conn_name = "telnet"
+
+    def __init__(
+        self,
+        ip_address: str,
+        port: int = 23,
+        logger: Logger = None,
+        health: HealthRegistry = None,
+        latency: LatencyRegistry = None,
+        deadline: Deadline = None,
+        session=None,
+        clock=None,
+    ):
         """Class constructor.
 
         Args:
             ip_address: the IP address of the MCH.
             port: port of the Telnet service (usually, 23)
             logger: reference to a logger that is being used
+            health: registry keeping track of the devices that are down. The
+                    default registry of the library is used when not given.
+            latency: registry with the RTT measurements of the devices, used
+                     to compute the timeouts. The default registry of the
+                     library is used when not given.
+            deadline: limit for opening the connection.
+            session: an already open session with the API of
+                     telnetlib.Telnet (i.e. a transport from the module
+                     gendev_transport). When given, no connection is opened.
+            clock: clock for the waits of the commands, the flashing and the
+                   reboot (see gendev_clock). The default clock of the
+                   library is used when not given.
 
         Raises:
             gendev_err.ConnTimeout if the device is not reachable.
+            gendev_err.NoRouteToDevice if the connection is rejected.
+            gendev_err.DeviceUnavailable if the device failed recently.
         """
         self.ip_address = ip_address
-        self._server_ip = "172.30.4.69"
+        self._server_ip = FW_SERVER
         self._fw_path = "fw/"
+        self._health = health if health is not None else default_registry
+        self._latency = latency if latency is not None else default_latency
+        self._clock = clock if clock is not None else default_clock
+        self._device_id = self._make_device_id(ip_address, port)
+        self._rtt_key = (self._device_id, self._conn_name)
+        # Each interface has its own breaker, so the rest are tried while
+        # it's open
+        self._health_key = self._rtt_key
+        # Reused for the output of every command
+        self._rx_buffer = bytearray()
+
+        if session is not None:
+            self._session = session
+        else:
+            self._session = self._open_session(port, deadline)
+
+    @staticmethod
+    def _make_device_id(ip_address: str, port: int) -> str:
+        """Identifier of the device for the health and latency registries."""
+        return ip_address
+
+    def _connect(self, port: int, timeout: float):
+        """Internal method to establish the connection with the MCH.
+
+        Args:
+            port: port of the Telnet service.
+            timeout: timeout for establishing the connection.
+
+        Returns:
+            A telnetlib.Telnet instance connected to the MCH.
+        """
+        return Telnet(self.ip_address, port, timeout=timeout)
 
+    def _open_session(self, port: int, deadline: Deadline = None):
+        """Internal method to open the session with the MCH.
+
+        The health of the device is checked before connecting, and updated
+        depending on the outcome.
+
+        Args:
+            port: port of the Telnet service.
+            deadline: limit for opening the connection.
+
+        Returns:
+            The session returned by _connect.
+        """
+        deadline = Deadline(clock=self._clock) if deadline is None else deadline
+
+        # Fail fast when the MCH is known to be down
+        self._health.check(self._health_key)
+        timeout = deadline.bound(self._latency.timeout(self._rtt_key), "Telnet login")
         try:
-            self._session = Telnet(ip_address, port, timeout=10)
-        except Exception as e:
-            if isinstance(e, socket.timeout):
-                raise ConnTimeout(
-                    "Timeout while opening the link to the MCH using Telnet"
+            start = self._clock.monotonic()
+            session = self._connect(port, timeout)
+        except (ConnTimeout, NoRouteToDevice):
+            # Already mapped by _connect (i.e. SSH)
+            self._health.record_failure(self._health_key)
+            raise
+        except socket.timeout:
+            self._health.record_failure(self._health_key)
+            raise ConnTimeout(
+                "Timeout while opening the link to the MCH using {}".format(
+                    self._conn_name
                 )
-            elif isinstance(e, OSError):
-                if e.errno == 113:
-                    raise NoRouteToDevice(
-                        "Check the connectivity to the MCH"
-                        " using the IP: {}".format(self.ip_address)
-                    )
-
-        # Regular expresions for extracting the infomration relative to the
-        # MCH from the version command.
-        self._match_fw_ver = re.compile(r"Firmware (V\d{1,2}\.\d{1,2}\.\d{1,2})")
-        # Search for the first occurrence of the token FPGA
-        self._match_fpga_ver = re.compile(r"FPGA (V\d{1,2}\.\d{1,2})")
-        self._match_mcu_ver = re.compile(r"AVR (\d{1,2}\.\d{1,2})")
-        self._match_board_sn = re.compile(r"sn: (\d{6}-\d{4})")
-        self._match_ip_addr = re.compile(r"ip address +: +((\d{1,3}\.?){4})")
-        self._match_mac_addr = re.compile(r"ieee address +: +(([\d\D]{2}:?){6})")
-        self._match_subnet_mask = re.compile(r"network mask +: +((\d{1,3}\.?){4})")
-        self._match_gateway_addr = re.compile(r"default gateway +: +((\d{1,3}\.?){4})")
-
-    def _send_command(self, command: str, sleep: int = 1, clear_buffer: bool = True):
+            )
+        except OSError as e:
+            self._health.record_failure(self._health_key)
+            raise NoRouteToDevice(
+                "Check the connectivity to the MCH"
+                " using the IP: {} ({})".format(self.ip_address, e)
+            )
+        self._health.record_success(self._health_key)
+        self._latency.record(self._rtt_key, self._clock.monotonic() - start)
+
+        return session
+
+    def _send_command(
+        self,
+        command: str,
+        sleep: int = 1,
+        clear_buffer: bool = True,
+        deadline: Deadline = None,
+    ):
         """Internal method for sending a low level command to the MCH.
 
         This command allows forgetting about the particular details of using
@@ -102,23 +285,49 @@ class NATMCHTelnet:
             helps clearing previous garbage from the buffer, but
             it should be used with caution because there are
             commands that doesn't expect a carriage return after.
+            deadline: limit for the whole operation the command belongs to.
+
+        Raises:
+            gendev_err.ConnTimeout if the deadline is exceeded.
         """
+        deadline = Deadline(clock=self._clock) if deadline is None else deadline
+        step = "the command {}".format(command)
         # clean up
         if clear_buffer:
             self._session.write(b"\r")
-            self._session.read_until(b"nat> ")
-            time.sleep(sleep)
+            # The time to get the prompt back is a good measurement of the RTT
+            timeout = deadline.bound(self._latency.timeout(self._rtt_key), step)
+            start = self._clock.monotonic()
+            response = self._session.read_until(PROMPT, timeout)
+            if response.endswith(PROMPT):
+                self._latency.record(self._rtt_key, self._clock.monotonic() - start)
+            self._clock.sleep(deadline.bound(sleep, step))
         self._session.write(command.encode("ascii") + b"\r")
-        time.sleep(sleep)
+        self._clock.sleep(deadline.bound(sleep, step))
 
-    def _reboot(self, sleep: int = 50):
+    def _reboot(self, sleep: int = 50, deadline: Deadline = None):
         """Internal command to send a reboot to the MCH.
 
         Args:
             sleep: indicates how many seconds to wait after returning from the
             method. Write a 0 to avoid it.
+            deadline: limit for the reboot.
         """
-        self._send_command("reboot")
+        self._send_command("reboot", deadline=deadline)
+
+    def _read_raw(self) -> memoryview:
+        """Internal command to read the Telnet Rx buffer, without decoding it.
+
+        This method attempts to read the content from the buffer without I/O
+        blocking. The content is kept in a buffer that is reused by the next
+        read, so the returned view has to be released before reading again.
+
+        Returns:
+            A memoryview of the content of the Rx buffer.
+        """
+        self._rx_buffer.clear()
+        self._rx_buffer += self._session.read_very_eager()
+        return memoryview(self._rx_buffer)
 
     def _read_command(self) -> str:
         """Internal command to read the Telnet Rx buffer.
@@ -127,63 +336,92 @@ class NATMCHTelnet:
         blocking.
 
         Returns:
-            A string containing the content of the Rx buffer.
+            A string containing the content of the Rx buffer. The bytes that
+            are not ASCII are replaced.
         """
-        response = self._session.read_very_eager()
-        return response.decode("ascii")
+        with self._read_raw() as raw:
+            return str(raw, "ascii", errors="replace")
+
+    def run_commands(
+        self, commands: list, timeout: float = None, deadline: Deadline = None
+    ) -> list:
+        """Run several commands, pipelined in a single write.
 
-    def device_info(self) -> dict:
+        Unlike _send_command, there's no fixed wait after each command: all
+        the commands are sent at once, and the output of each one is read up
+        to its prompt. This takes about a round trip instead of some seconds
+        per command.
+
+        Args:
+            commands: commands of the CLI.
+            timeout: limit for the output of each command. The timeout
+                     derived from the RTT of the device when not given.
+            deadline: limit for the whole batch.
+
+        Returns:
+            The output of each command (bytes, with the echo of the command).
+
+        Raises:
+            gendev_err.ConnTimeout if an output doesn't end with the prompt.
+        """
+        deadline = Deadline(clock=self._clock) if deadline is None else deadline
+        step = "the commands {}".format(", ".join(commands))
+        # Discard the garbage of previous commands
+        self._session.read_very_eager()
+        # The leading carriage return gets a prompt first, as _send_command
+        self._session.write(
+            b"\r" + b"".join(command.encode("ascii") + b"\r" for command in commands)
+        )
+
+        outputs = list()
+        start = self._clock.monotonic()
+        while len(outputs) <= len(commands):
+            limit = (
+                timeout if timeout is not None else self._latency.timeout(self._rtt_key)
+            )
+            response = self._session.read_until(PROMPT, deadline.bound(limit, step))
+            if not response.endswith(PROMPT):
+                raise ConnTimeout("Timeout while waiting for {}".format(step))
+            if not outputs:
+                self._latency.record(self._rtt_key, self._clock.monotonic() - start)
+            outputs.append(bytes(response[: -len(PROMPT)]))
+
+        return outputs[1:]
+
+    def device_info(self, deadline: Deadline = None) -> dict:
         """Retrieve the main information about the device.
 
         The information is returned in a dictionary with 2 categories:
         *board* and *network*.
 
+        Args:
+            deadline: limit for the whole operation.
+
         Returns:
             If success, a dictionary with the device information.
             If failure, an empty dictionary on failure.
-        """
-        self._send_command("version")
-        raw_info_version = self._read_command()
-        self._send_command("ni")
-        raw_info_network = self._read_command()
-
-        if raw_info_version != "" and raw_info_network != "":
-            resp_dict = dict()
-            resp_dict["Board"] = dict()
-
-            resp_dict["Board"]["fw_ver"] = self._match_fw_ver.search(
-                raw_info_version
-            ).group(1)
-            resp_dict["Board"]["fpga_ver"] = self._match_fpga_ver.search(
-                raw_info_version
-            ).group(1)
-            resp_dict["Board"]["mcu_ver"] = self._match_mcu_ver.search(
-                raw_info_version
-            ).group(1)
-            resp_dict["Board"]["serial_num"] = self._match_board_sn.search(
-                raw_info_version
-            ).group(1)
-
-            resp_dict["Network"] = dict()
-            resp_dict["Network"]["ip_address"] = self._match_ip_addr.search(
-                raw_info_network
-            ).group(1)
-            resp_dict["Network"]["mac_address"] = self._match_mac_addr.search(
-                raw_info_network
-            ).group(1)
-            resp_dict["Network"]["subnet_address"] = self._match_subnet_mask.search(
-                raw_info_network
-            ).group(1)
-            resp_dict["Network"]["gateway_address"] = self._match_gateway_addr.search(
-                raw_info_network
-            ).group(1)
-
-        else:
-            resp_dict = dict()
-
-        return resp_dict
 
-    def update_fw(self, fw_version: str, part: str = "MCH") -> tuple:
+        Raises:
+            gendev_err.ConnTimeout if the deadline is exceeded.
+        """
+        # The values are extracted from each output before reading the next
+        # one, as they share the buffer.
+        self._send_command("version", deadline=deadline)
+        with self._read_raw() as raw:
+            if len(raw) == 0:
+                return dict()
+            board = parse_board_info(raw)
+        self._send_command("ni", deadline=deadline)
+        with self._read_raw() as raw:
+            if len(raw) == 0:
+                return dict()
+            network = parse_network_info(raw)
+
+        return {"Board": board, "Network": network}
+
+    def update_fw(
+        self, fw_version: str, part: str = "MCH", deadline: Deadline = None
+    ) -> tuple:
         """Update the firmware of the device.
 
         This method expects the firmware binary pointed by the value of the
@@ -194,13 +432,19 @@ class NATMCHTelnet:
         Args:
             fw_version: version release number for the new fw.
             part: not used
+            deadline: limit for the whole update, including the flashing of
+                      the new firmware and the reboot of the MCH.
 
         Returns:
             If failure, it returns a tuple containing False, and a message
             about the failure.
             If success, it returns True,
+
+        Raises:
+            gendev_err.ConnTimeout if the deadline is exceeded.
         """
-        self._send_command("update_firmware")
+        deadline = Deadline(clock=self._clock) if deadline is None else deadline
+        self._send_command("update_firmware", deadline=deadline)
         # Avoid clearing the buffer bewteen these commands because it would
         # skip the update mode in the MCH.
         self._send_command(
@@ -208,29 +452,34 @@ class NATMCHTelnet:
                 self._server_ip, self._fw_path, fw_version, fw_version
             ),
             clear_buffer=False,
+            deadline=deadline,
         )
         # Erasing the internal memory. If it is attempted to read now from the
         # buffer, it will get the promt.
-        time.sleep(30)
+        self._clock.sleep(deadline.bound(30, "the flash erase"))
         # There's a useless promt which is received first, get rid of it, and
         # wait for the good one that should come when the flashing is finished.
-        response = self._session.read_until(b"nat> ")
+        response = self._session.read_until(PROMPT, deadline.bound(step="the flashing"))
         # Sometimes, at this point, the buffer has content, sometimes not.
         # It seems reasonable using a length 100 to detect this situation.
         if len(response) < 100:
-            response = self._session.read_until(b"nat> ")
-        response = response.decode("ascii")
+            response = self._session.read_until(
+                PROMPT, deadline.bound(step="the flashing")
+            )
+        if not response.endswith(PROMPT):
+            deadline.check("the flashing")
 
         # Let's see if the update was successful. The MCH prints the word
         # "successful" at the end of the process, just before the prompt.
-        if "successful" in response:
+        # The flash log is checked as it was received, without decoding it.
+        if b"successful" in response:
             success = (True,)
-            self._reboot()
+            self._reboot(deadline=deadline)
             # Finally, wait for the MCH to complete the reboot process
-            time.sleep(50)
+            self._clock.sleep(deadline.bound(50, "the reboot"))
         else:
             # Something went wrong, let's check it!
-            if "TFTP: could not get file" in response:
+            if b"TFTP: could not get file" in response:
                 # This error is mainly caused when the target fw_version
                 # is not available in the TFTP server.
                 success = (
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+nat_mch_transaction.py
+~~~~~~~~~~~~~~~~~~~~~~
+
+Transactional changes of the configuration of an NAT MCH.
+
+Most of the configuration changes of an MCH (basecfg, pcie, backplane script)
+only take effect after a reboot, and each reboot takes about 50 seconds.
+Applying the categories one by one, each one with its reboot and its
+verification, wastes minutes per device.
+
+A transaction stages the changes of several categories, and applies them in
+one go, while holding the device in the governor:
+
+1. The current configuration of the staged categories is read, and only the
+   categories that differ from the staged values are applied.
+2. If something was applied, the MCH is rebooted once.
+3. All the staged values are verified with a single read-back.
+
+The MCH can't undo changes, so a transaction failing in the middle is not
+rolled back: the categories already applied are listed in *applied*. To
+avoid half-applied transactions, nothing is applied when a category that
+differs can't be changed (i.e. the backplane script, which can only be
+staged to verify it).
+
+Example:
+    >>> with mch.transaction() as tx:
+    ...     tx.stage("basecfg", {"Backplane": {"Slot 1": "enabled"}})
+    ...     tx.stage("pcie", {"Virtual Switch 1": {"upstream": "AMC1"}})
+    >>> tx.result
+    0
+"""
+
+from collections import OrderedDict
+from ..gendev_err import FeatureNotSupported
+from ..gendev_deadline import Deadline
+from ..gendev_drift import flatten_config
+from .nat_mch_web import PAGE_PARSERS
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS MTCA Tools"
+__credits__ = ["Felipe Torres González", "Ross Elliot", "Jeong Han Lee"]
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+# Order in which the categories are applied
+APPLY_ORDER = ("basecfg", "pcie", "backplane")
+
+
+def _merge(target: dict, changes: dict):
+    """Recursive update of a nested dictionary."""
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def _diff_staged(staged: dict, given: dict) -> OrderedDict:
+    """Parameters of *staged* with a different value in *given*.
+
+    Unlike gendev_drift.diff_config, the parameters of *given* that were not
+    staged are ignored.
+    """
+    flat_given = flatten_config(given)
+    diff = OrderedDict()
+    for path, value in flatten_config(staged).items():
+        if flat_given.get(path) != value:
+            diff[path] = {"expected": value, "given": flat_given.get(path)}
+    return diff
+
+
+class ConfigTransaction:
+    """Staged configuration changes of an MCH, applied with a single reboot."""
+
+    def __init__(
+        self,
+        mch,
+        verify: bool = True,
+        reboot: bool = True,
+        reboot_wait: float = 50,
+        deadline: Deadline = None,
+    ):
+        """Class constructor.
+
+        Args:
+            mch: the NATMCH instance.
+            verify: read back the configuration after applying it.
+            reboot: reboot the MCH after applying the changes (only if
+                    something was applied).
+            reboot_wait: seconds to wait for the MCH after the reboot.
+            deadline: limit for the whole commit.
+        """
+        self._mch = mch
+        self.verify = verify
+        self.reboot = reboot
+        self.reboot_wait = reboot_wait
+        self.deadline = deadline
+        self.staged = OrderedDict()
+        self.applied = list()
+        self.rebooted = False
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def stage(self, category: str, data: dict):
+        """Stage changes of a configuration category.
+
+        Staging the same category several times merges the changes.
+
+        Args:
+            category: configuration category (see APPLY_ORDER).
+            data: dictionary with the values to be modified, in the format
+                  returned by get_configuration.
+        """
+        if category not in APPLY_ORDER:
+            raise ValueError("Unknown configuration category {}".format(category))
+        _merge(self.staged.setdefault(category, dict()), data)
+
+    def _read(self, category: str, deadline: Deadline) -> dict:
+        return self._mch.get_configuration(category, deadline=deadline)
+
+    def commit(self):
+        """Apply the staged changes.
+
+        Returns:
+            - 0 when successful or verify=False
+            - A dictionary indexed by category, containing the values that
+              are not matching the expectation. For each key, the expected
+              and the given values are provided.
+
+        Raises:
+            gendev_err.FeatureNotSupported if a category that differs from
+            the staged values can't be changed. Nothing is applied then.
+            Any error raised by the MCH. The categories already applied are
+            kept in *applied*.
+        """
+        deadline = (
+            Deadline(clock=self._mch.clock) if self.deadline is None else self.deadline
+        )
+        categories = [c for c in APPLY_ORDER if c in self.staged]
+
+        # Nothing else runs on the device until the transaction is finished
+        with self._mch.governor.limit(self._mch._resources("transaction"), deadline):
+            pending = [
+                category
+                for category in categories
+                if _diff_staged(self.staged[category], self._read(category, deadline))
+            ]
+            unsupported = [c for c in pending if c not in PAGE_PARSERS]
+            if unsupported:
+                raise FeatureNotSupported(
+                    "The categories {} can't be changed, nothing was applied".format(
+                        ", ".join(unsupported)
+                    )
+                )
+
+            for category in pending:
+                self._mch._run(
+                    "set_configuration",
+                    "set_configuration",
+                    category,
+                    self.staged[category],
+                    verify=False,
+                    failover=False,
+                    deadline=deadline,
+                )
+                self.applied.append(category)
+
+            if self.applied and self.reboot:
+                self._mch._reboot(deadline=deadline)
+                self._mch.clock.sleep(deadline.bound(self.reboot_wait, "the reboot"))
+                self.rebooted = True
+
+            self.result = 0
+            if self.verify and self.applied:
+                mismatches = OrderedDict()
+                for category in categories:
+                    diff = _diff_staged(
+                        self.staged[category], self._read(category, deadline)
+                    )
+                    if diff:
+                        mismatches[category] = diff
+                if mismatches:
+                    self.result = mismatches
+
+        return self.result
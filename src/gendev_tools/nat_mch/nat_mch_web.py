@@ -15,11 +15,18 @@ possible for interfacing an NAT MCH.
 """
 
 import re
+import copy
+import hashlib
 import requests as rq
 from logging import Logger
 from collections import OrderedDict
+from concurrent.futures import Executor
 from bs4 import BeautifulSoup
-from ..gendev_err import FeatureNotSupported, NoRouteToDevice, WebChanged
+from lxml import etree, html
+from ..gendev_err import ConnTimeout, FeatureNotSupported, NoRouteToDevice, WebChanged
+from ..gendev_health import HealthRegistry, default_registry
+from ..gendev_deadline import Deadline, LatencyRegistry, default_latency
+from ..gendev_clock import default_clock
 
 __author__ = ["Felipe Torres González", "Ross Elliot"]
 __copyright__ = "Copyright 2021, ESS MCH Tools"
@@ -30,6 +37,499 @@ __email__ = "felipe.torresgonzalez@ess.eu"
 __status__ = "Development"
 
 
+def parse_basecfg_page(content: bytes) -> OrderedDict:
+    """Parse the base configuration page of the MCH.
+
+    Args:
+        content: raw content of the page /goform/change_mch_cfg.
+
+    Returns:
+        A OrderedDict containing the settings for the base configuration
+        page in the MCH webpage.
+    """
+    mch_config = OrderedDict()
+    html_content = BeautifulSoup(content, "html.parser")
+    tables = html_content.body.find_all("table")
+
+    # Each subsection of the MCH Configuration is a different HTML
+    # table. Each table will add a child dictionary to the main one,
+    # indexed by the tr tag label from the HTML code.
+    for table in tables:
+        # Each section has a th tag. Then a set of parameters are included
+        # within the section.
+        table_title = table.th.text.strip()
+        # Set the table heather as the dict key
+        mch_config[table_title] = OrderedDict()
+
+        for row in table.find_all("tr"):
+            # Now, we're inside a section. Two kinds of parameters:
+            # - parameters with a numeric value
+            # - parameters with a select
+
+            select_params = row.find("select")
+            if select_params:
+                # Form with select values
+                # 1. First get the name attribute (should use find_all?)
+                name = select_params["name"].strip()
+                # 2. Look for the selected value for the given parameter
+                subrows = row.find_all("option")
+                value = [r["value"] for r in subrows if "selected" in str(r)][0]
+
+                # Rough check, but better than nothing
+                if name is None or value is None:
+                    continue
+
+                mch_config[table_title][name] = value
+                # No more stuff to parse for this row
+                continue
+
+            # Form with input values
+            input_params = row.find_all("input")
+
+            if not input_params:
+                continue
+
+            # How many fields does this setting have?
+            if len(input_params) > 1:
+                name = input_params[0]["name"]
+                value = [v["value"] for v in input_params]
+            else:
+                name = input_params[0]["name"]
+                value = input_params[0]["value"]
+
+            if name is None or value is None:
+                continue
+            mch_config[table_title][name] = value
+            # No more stuff to parse for this row
+            continue
+
+    # The previous set of parameters will be encapsulated so
+    # a global dictionary can contain other set of parameters
+    globalcfg = OrderedDict()
+    globalcfg["Base MCH parameter"] = mch_config
+
+    return globalcfg
+
+
+# Precompiled XPath expressions for the PCIe configuration page. The page
+# contains two forms: the first one configures the link width of each pair of
+# AMC slots (Station_N radio buttons), and the second one the virtual switches
+# (a select for the upstream port of each switch and radio buttons for the
+# rest of the settings). Only the rows of the virtual switches table titled
+# as in _PCIE_VS_ROWS have settings.
+_PCIE_FORM_ACTIONS = ("/goform/pcie_width_link_ctrl", "/goform/pcie_vs_cfg_refresh")
+_PCIE_VS_ROWS = ("none",) + tuple(str(i) for i in range(6)) + ("Max. Link Speed",)
+_xpath_forms = etree.XPath("//form")
+_xpath_link_width = etree.XPath(".//input[starts-with(@name, 'Station_') and @checked]")
+_xpath_rows = etree.XPath(".//tr")
+_xpath_row_title = etree.XPath("string((.//b)[1])")
+_xpath_row_selects = etree.XPath(".//select[@name]")
+_xpath_row_checked = etree.XPath(".//input[@name and @checked and not(@disabled)]")
+_xpath_selected = etree.XPath(".//option[@selected]/@value")
+
+
+def _find_form(forms: list, action: str):
+    """First form whose action contains the given text."""
+    for form in forms:
+        if action in (form.get("action") or ""):
+            return form
+    return None
+
+
+def parse_pcie_page(content: bytes, strict: bool = True) -> OrderedDict:
+    """Parse the PCIe configuration page of the MCH.
+
+    The page is parsed with lxml and the values are extracted using
+    precompiled XPath expressions: the checked radio buttons of the link
+    width form, and the selected options and checked radio buttons of the
+    rows of the virtual switches (see _PCIE_VS_ROWS).
+
+    Args:
+        content: raw content of the page /goform/pcie_width_link_ctrl.
+        strict: when True, the page must start with the two forms, with the
+                exact actions of the known firmware versions. Otherwise, the
+                forms are looked up by their action anywhere in the page
+                (some firmware versions add forms, or change the actions).
+
+    Returns:
+        A OrderedDict containing the settings for the PCIe configuration
+        page in the MCH webpage.
+
+    Raises:
+        gendev_err.WebChanged if the page doesn't have the expected forms.
+    """
+    try:
+        forms = _xpath_forms(html.fromstring(content))
+    except etree.ParserError:
+        forms = []
+
+    if strict:
+        actions = tuple(form.get("action") for form in forms[:2])
+        if actions != _PCIE_FORM_ACTIONS:
+            raise WebChanged("The PCIe configuration page has changed its format")
+        link_form, vs_form = forms[:2]
+    else:
+        link_form = _find_form(forms, "pcie_width_link")
+        vs_form = _find_form(forms, "pcie_vs")
+        if link_form is None or vs_form is None:
+            raise WebChanged("The PCIe configuration page has changed its format")
+
+    mch_config = OrderedDict()
+
+    # There're 3 tables, each one configures a pair of adjacent AMC slots.
+    # From each table, get the value selecting a link with for each pair
+    # of AMC slots, in order.
+    cfgtitle = "Link Width Configuration"
+    mch_config[cfgtitle] = OrderedDict()
+    for field in _xpath_link_width(link_form):
+        station = "Station_{}".format(len(mch_config[cfgtitle]))
+        if field.get("name") == station:
+            mch_config[cfgtitle][station] = field.get("value")
+
+    # Now, extract the information from the table with the Virtual Switch
+    # Configuration: the upstream port of each switch (select) and the
+    # checked radio buttons (assignment of each AMC port and link speed).
+    cfgtitle = "PCIe Virtual Switch configurationt"
+    mch_config[cfgtitle] = OrderedDict()
+    for row in _xpath_rows(vs_form):
+        if _xpath_row_title(row) not in _PCIE_VS_ROWS:
+            continue
+        for field in _xpath_row_selects(row):
+            selected = _xpath_selected(field)
+            if selected:
+                mch_config[cfgtitle][field.get("name")] = selected[-1]
+        for field in _xpath_row_checked(row):
+            mch_config[cfgtitle][field.get("name")] = field.get("value")
+
+    # The previous set of parameters will be encapsulated so
+    # a global dictionary can contain other set of parameters
+    pciecfg = OrderedDict()
+    pciecfg["PCIe parameter"] = mch_config
+
+    return pciecfg
+
+
+def parse_pcie_page_relaxed(content: bytes) -> OrderedDict:
+    """Parse the PCIe configuration page, looking up the forms by action.
+
+    See :py:func:`parse_pcie_page`.
+    """
+    return parse_pcie_page(content, strict=False)
+
+
+# Named fields of a form, and the types of input that aren't submitted
+_xpath_form_fields = etree.XPath(".//input[@name] | .//select[@name]")
+_xpath_options = etree.XPath(".//option/@value")
+_NOT_SUBMITTED = ("submit", "button", "reset", "image", "file")
+
+
+def form_fields(form) -> list:
+    """Fields submitted by a form of a configuration page.
+
+    The fields are the same a browser would submit: the inputs that are not
+    disabled (only the checked ones for radio buttons and checkboxes), and
+    the selected option of each select.
+
+    Args:
+        form: the form element (lxml).
+
+    Returns:
+        A list of pairs (name, value), in document order.
+    """
+    fields = list()
+    for field in _xpath_form_fields(form):
+        if field.get("disabled") is not None:
+            continue
+        if field.tag == "select":
+            options = _xpath_selected(field) or _xpath_options(field)[:1]
+            if options:
+                fields.append((field.get("name"), options[-1]))
+            continue
+        kind = (field.get("type") or "text").lower()
+        if kind in _NOT_SUBMITTED:
+            continue
+        if kind in ("radio", "checkbox") and field.get("checked") is None:
+            continue
+        fields.append((field.get("name"), field.get("value") or ""))
+    return fields
+
+
+def _parameters(data: dict, parameters: OrderedDict = None) -> OrderedDict:
+    """Parameters of a configuration dictionary, indexed by the name of the
+    field of the form (the keys of the innermost dictionaries)."""
+    parameters = OrderedDict() if parameters is None else parameters
+    for key, value in data.items():
+        if isinstance(value, dict):
+            _parameters(value, parameters)
+        else:
+            parameters[key] = value
+    return parameters
+
+
+def _form_value(value):
+    """Value of a parameter as it is submitted (and parsed back)."""
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return str(value)
+
+
+def fill_forms(content: bytes, data: dict) -> list:
+    """Fill the forms of a configuration page with new values.
+
+    Args:
+        content: raw content of the configuration page.
+        data: dictionary with the values to be modified, in the same format
+              as the output of the parser of the page. Only the parameters
+              given are changed, the rest keep the value of the page.
+              A list sets the value of several consecutive fields (i.e. the
+              bytes of an IP address in the base configuration).
+
+    Returns:
+        A list of pairs (action, fields) with the forms that need to be
+        submitted, in document order. *fields* is a list of pairs (name,
+        value).
+
+    Raises:
+        ValueError if a parameter is not a field of any form of the page.
+    """
+    try:
+        forms = _xpath_forms(html.fromstring(content))
+    except etree.ParserError:
+        forms = []
+
+    pending = _parameters(data)
+    submits = list()
+    for form in forms:
+        fields = form_fields(form)
+        declared = {field.get("name") for field in _xpath_form_fields(form)}
+        changed = False
+        for name in [name for name in pending if name in declared]:
+            values = _form_value(pending.pop(name))
+            values = values if isinstance(values, list) else [values]
+            names = [field_name for field_name, _ in fields]
+            if name not in names:
+                # An unchecked radio button or checkbox
+                fields.append((name, None))
+                names.append(name)
+            start = names.index(name)
+            if start + len(values) > len(fields):
+                raise ValueError("Too many values for the parameter {}".format(name))
+            for index, value in enumerate(values, start):
+                if fields[index][1] != value:
+                    fields[index] = (fields[index][0], value)
+                    changed = True
+        if changed:
+            submits.append((form.get("action"), fields))
+
+    if pending:
+        raise ValueError(
+            "Unknown configuration parameters: {}".format(", ".join(pending))
+        )
+    return submits
+
+
+# Pages of the configuration categories (under goform). The backplane page
+# requests the generation of the script file.
+CONFIG_PAGES = {
+    "basecfg": "change_mch_cfg",
+    "pcie": "pcie_width_link_ctrl",
+    "backplane": "web_cfg_backup_show_menu",
+}
+
+# Parsers of the configuration pages, indexed by the configuration category
+PAGE_PARSERS = {"basecfg": parse_basecfg_page, "pcie": parse_pcie_page}
+
+# Name of the parser variant of PAGE_PARSERS
+DEFAULT_VARIANT = "default"
+
+# Alternative parsers for the pages that change among firmware versions,
+# indexed by the category and the name of the variant
+PAGE_VARIANTS = {("pcie", "relaxed"): parse_pcie_page_relaxed}
+
+
+def page_variants(category: str) -> list:
+    """Names of the parser variants of a category, the default one first."""
+    return [DEFAULT_VARIANT] + [v for c, v in PAGE_VARIANTS if c == category]
+
+
+def _page_parser(category: str, variant: str = None):
+    if variant is None or variant == DEFAULT_VARIANT:
+        return PAGE_PARSERS[category]
+    return PAGE_VARIANTS[(category, variant)]
+
+
+def _compact(value):
+    """Turn the dictionaries into tuples of pairs, which are cheaper to pickle
+    than OrderedDicts."""
+    if isinstance(value, dict):
+        return tuple((key, _compact(child)) for key, child in value.items())
+    return value
+
+
+def _expand(value):
+    """Inverse of _compact."""
+    if isinstance(value, tuple):
+        return OrderedDict((key, _expand(child)) for key, child in value)
+    return value
+
+
+def _parse_page_compact(category: str, content: bytes, variant: str = None) -> tuple:
+    """Entry point for the worker processes parsing pages."""
+    return _compact(_page_parser(category, variant)(content))
+
+
+def parse_page(
+    category: str, content: bytes, pool: Executor = None, variant: str = None
+) -> OrderedDict:
+    """Parse a configuration page of the MCH.
+
+    Parsing the pages is CPU bound, so when pages from many MCHs are fetched
+    concurrently using threads, the parsing can be offloaded to a pool of
+    processes. Only the raw content of the page is sent to the worker, and
+    the result is sent back in a compact form.
+
+    Args:
+        category: configuration category of the page (see PAGE_PARSERS).
+        content: raw content of the page.
+        pool: a concurrent.futures.ProcessPoolExecutor (or any Executor) used
+              to parse the page. When None, the page is parsed in the calling
+              thread.
+        variant: parser variant (see page_variants). The default parser of
+                 the category is used when not given.
+
+    Returns:
+        The same OrderedDict returned by the parser of the category.
+    """
+    if pool is None:
+        return _page_parser(category, variant)(content)
+    return _expand(
+        pool.submit(_parse_page_compact, category, content, variant).result()
+    )
+
+
+# Size of the chunks of the pages read by the incremental parser (bytes)
+STREAM_CHUNK_SIZE = 1024
+
+
+def _pull_events(response, events: tuple, chunk_size: int):
+    """Events of an incremental parse of a page, as it is downloaded.
+
+    (None, None) is generated at the end of each chunk.
+    """
+    parser = etree.HTMLPullParser(events=events)
+    for chunk in response.iter_content(chunk_size):
+        parser.feed(chunk)
+        yield from parser.read_events()
+        yield None, None
+    try:
+        parser.close()
+    except etree.XMLSyntaxError:
+        # Empty page
+        return
+    yield from parser.read_events()
+
+
+def _following_text(event: str, element) -> str:
+    """Text of the page after an event of the pull parser, up to the next
+    one (comments are not part of the text)."""
+    if event == "start":
+        return element.text or ""
+    return element.tail or ""
+
+
+def _search(text: str, patterns: dict, matches: dict, final: bool) -> bool:
+    for name, pattern in patterns.items():
+        if matches[name] is None:
+            match = pattern.search(text)
+            # The text might continue after a match that ends with it
+            if match is not None and (final or match.end() < len(text)):
+                matches[name] = match
+    return all(match is not None for match in matches.values())
+
+
+def read_title(response, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Read the title of a page, stopping the download once it's found.
+
+    Args:
+        response: response of a request sent with stream=True. It is closed
+                  before returning.
+        chunk_size: bytes fed to the parser at a time.
+
+    Returns:
+        The title of the page, None if it has no title.
+    """
+    try:
+        for event, element in _pull_events(response, ("end",), chunk_size):
+            if element is not None and element.tag == "title":
+                return element.text or ""
+        return None
+    finally:
+        response.close()
+
+
+def search_page_text(
+    response, patterns: dict, chunk_size: int = STREAM_CHUNK_SIZE
+) -> dict:
+    """Search the text of a page, stopping the download once everything was
+    found.
+
+    The page is parsed incrementally (lxml's HTMLPullParser) as the chunks
+    arrive. The text is the same as the one given by BeautifulSoup's
+    get_text: the strings of the page, in document order, without the
+    comments.
+
+    Args:
+        response: response of a request sent with stream=True. It is closed
+                  before returning.
+        patterns: compiled regular expressions, indexed by name.
+        chunk_size: bytes fed to the parser at a time.
+
+    Returns:
+        A dictionary with the match of each pattern (None for the patterns
+        that were not found).
+    """
+    matches = dict.fromkeys(patterns)
+    text = ""
+    previous = None
+    events = ("start", "end", "comment")
+    try:
+        for event, element in _pull_events(response, events, chunk_size):
+            if element is None:
+                if _search(text, patterns, matches, final=False):
+                    return matches
+                continue
+            # The text after an event is complete when the next one arrives
+            if previous is not None:
+                text += _following_text(*previous)
+            previous = (event, element)
+
+        if previous is not None:
+            text += _following_text(*previous)
+        _search(text, patterns, matches, final=True)
+        return matches
+    finally:
+        response.close()
+
+
+class _CachedPage:
+    """Last version of a page: its validators, digest and parsed content."""
+
+    def __init__(self, etag: str, last_modified: str, digest: str, value):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.value = value
+
+    def conditions(self) -> dict:
+        """Headers of a conditional request for the page."""
+        headers = dict()
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
 class NATMCHWeb:
     """NATMCHWeb access an NAT MCH via the web interface.
 
@@ -45,16 +545,75 @@ class NATMCHWeb:
     Supported operations:
     - Retrieve the general information of the MCH.
     - Change/Access the general configuration of the MCH.
-    - Change/Access the backplane configuration of the MCH.
+    - Access the backplane configuration of the MCH.
+
+    The configuration pages are requested conditionally (If-None-Match and
+    If-Modified-Since) when the MCH gave validators for them. When the page
+    didn't change (a 304 answer, or the same content as the last time), the
+    configuration parsed the last time is returned, without parsing the page
+    again.
     """
 
-    def __init__(self, ip_address: str, logger: Logger = None):
+    def __init__(
+        self,
+        ip_address: str,
+        logger: Logger = None,
+        health: HealthRegistry = None,
+        latency: LatencyRegistry = None,
+        deadline: Deadline = None,
+        http=None,
+        parse_pool: Executor = None,
+        clock=None,
+        caps=None,
+        state_cache=None,
+    ):
         """Class constructor.
 
         Args:
             ip_address: the IP address of the MCH.
+            health: registry keeping track of the devices that are down. The
+                    default registry of the library is used when not given.
+            latency: registry with the RTT measurements of the devices, used
+                     to compute the timeouts. The default registry of the
+                     library is used when not given.
+            deadline: limit for checking the device is an MCH.
+            http: HTTP client used for the requests, with the API of the
+                  requests module (i.e. a requests.Session or a transport from
+                  the module gendev_transport). Defaults to requests.
+            parse_pool: pool of processes used to parse the configuration
+                        pages. A single pool should be shared by all the
+                        MCHs. See :py:func:`parse_page`.
+            clock: clock measuring the round trip times (see gendev_clock).
+            caps: table of the capabilities of the firmware versions (see
+                  nat_mch_caps.CapabilityCache). When given, the categories
+                  the firmware of the MCH doesn't support are not requested,
+                  and the parser variant of each page is learnt.
+            state_cache: state of the devices shared by several processes
+                         (see gendev_cache.DeviceStateCache). When given, the
+                         identity and the information of the MCH found by
+                         another process are used instead of requesting
+                         them again.
+
+        Raises:
+            gendev_err.NoRouteToDevice if the device is not an MCH or it is
+            not reachable.
+            gendev_err.DeviceUnavailable if the device failed recently.
         """
         self.ip_address = ip_address
+        self._health = health if health is not None else default_registry
+        self._latency = latency if latency is not None else default_latency
+        self._rtt_key = (self.ip_address, "http")
+        # The breaker of the web interface, the rest of interfaces are tried
+        # while it's open
+        self._health_key = self._rtt_key
+        self._http = http if http is not None else rq
+        self._parse_pool = parse_pool
+        self._clock = clock if clock is not None else default_clock
+        self._caps = caps
+        self._fw_ver = None
+        self._state = state_cache
+        # Last version of each configuration page, indexed by its path
+        self._pages = dict()
 
         # Header for the HTML methods, the most important variable is the
         # Authorization because NAT MCHs need to login using Root:NAT.
@@ -64,7 +623,7 @@ class NATMCHWeb:
             "Connection": "keep-alive",
         }
 
-        is_mch = self._check_is_mch()
+        is_mch = self._check_is_mch(deadline)
         if not is_mch[0]:
             raise NoRouteToDevice(is_mch[1])
 
@@ -81,11 +640,163 @@ class NATMCHWeb:
         self._match_mac_addr = re.compile(r"IEEE Address\n(([\d\D]{2}:?){6})")
         self._match_subnet_mask = re.compile(r"Subnet Mask\n((\d{1,3}\.?){4})")
         self._match_gateway_addr = re.compile(r"Gateway Address\n((\d{1,3}\.?){4})")
+        # Patterns searched in the information page, in the order of the page
+        self._info_patterns = OrderedDict(
+            [
+                ("fw_ver", self._match_fw_ver),
+                ("fpga_ver", self._match_fpga_ver),
+                ("mcu_ver", self._match_mcu_ver),
+                ("serial_num", self._match_board_sn),
+                ("ip_address", self._match_ip_addr),
+                ("mac_address", self._match_mac_addr),
+                ("subnet_address", self._match_subnet_mask),
+                ("gateway_address", self._match_gateway_addr),
+            ]
+        )
+
+    def _get(
+        self,
+        path: str,
+        deadline: Deadline = None,
+        headers: dict = None,
+        stream: bool = False,
+    ):
+        """Internal method to send a GET request to the web server of the MCH.
+
+        See :py:meth:`_request`.
+        """
+        return self._request("get", path, deadline, headers, stream=stream)
+
+    def _post(self, path: str, data, deadline: Deadline = None):
+        """Internal method to submit a form to the web server of the MCH.
+
+        Args:
+            path: action of the form.
+            data: fields of the form, as a list of pairs (name, value).
+            deadline: limit for the operation the request belongs to.
+
+        See :py:meth:`_request`.
+        """
+        return self._request("post", path, deadline, data=data)
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        deadline: Deadline = None,
+        headers: dict = None,
+        **kwargs
+    ):
+        """Internal method to send a request to the web server of the MCH.
+
+        The health of the device is checked before sending the request, and
+        updated depending on the outcome of it. The timeout of the request is
+        derived from the response times of the device, and limited by the
+        deadline of the operation.
+
+        Args:
+            method: HTTP method (*get* or *post*).
+            path: path of the resource within the web server.
+            deadline: limit for the operation the request belongs to.
+            headers: headers sent besides the default ones.
+            kwargs: other arguments of the request (i.e. *stream*, to not
+                    download the body before returning, see
+                    :py:func:`search_page_text`).
+
+        Returns:
+            The response object from requests.
 
-    def _check_is_mch(self):
+        Raises:
+            gendev_err.DeviceUnavailable if the device failed recently.
+            gendev_err.ConnTimeout if the device didn't answer in time.
+            gendev_err.NoRouteToDevice if the device is not reachable.
+        """
+        deadline = Deadline(clock=self._clock) if deadline is None else deadline
+        timeout = deadline.bound(
+            self._latency.timeout(self._rtt_key), "the request of {}".format(path)
+        )
+        self._health.check(self._health_key)
+        try:
+            start = self._clock.monotonic()
+            response = getattr(self._http, method)(
+                "http://{}/{}".format(self.ip_address, path),
+                headers=(
+                    self._http_headers
+                    if headers is None
+                    else dict(self._http_headers, **headers)
+                ),
+                timeout=timeout,
+                **kwargs
+            )
+        except rq.exceptions.Timeout:
+            self._health.record_failure(self._health_key)
+            raise ConnTimeout(
+                "Timeout while accessing the MCH web interface at {0}".format(
+                    self.ip_address
+                )
+            )
+        except rq.exceptions.RequestException:
+            self._health.record_failure(self._health_key)
+            raise NoRouteToDevice(
+                "Error connecting to MCH web interface at {0}:".format(self.ip_address)
+            )
+        self._health.record_success(self._health_key)
+        self._latency.record(self._rtt_key, self._clock.monotonic() - start)
+
+        return response
+
+    def _get_page(self, path: str, parse, deadline: Deadline = None):
+        """Internal method to get a page, parsing it only when it changed.
+
+        Args:
+            path: path of the page within the web server.
+            parse: callable parsing the response with the page.
+            deadline: limit for the request.
+
+        Returns:
+            The response, and the parsed content of the page (None when the
+            request failed). The parsed content is a copy, so it can be
+            modified by the caller.
+        """
+        cached = self._pages.get(path)
+        response = self._get(
+            path, deadline, cached.conditions() if cached is not None else None
+        )
+        if response.status_code == 304 and cached is not None:
+            return response, copy.deepcopy(cached.value)
+        if not response.ok:
+            return response, None
+
+        # Not every page has validators: the content is compared as well
+        digest = hashlib.sha1(response.content).hexdigest()
+        if cached is not None and cached.digest == digest:
+            value = cached.value
+        else:
+            value = parse(response)
+        self._pages[path] = _CachedPage(
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            digest,
+            value,
+        )
+        return response, copy.deepcopy(value)
+
+    def _cached(self, field: str):
+        """Internal method to get a field of the shared state of the MCH."""
+        if self._state is None:
+            return None
+        return (self._state.get(self.ip_address) or dict()).get(field)
+
+    def _check_is_mch(self, deadline: Deadline = None):
         """Method to check that the device associated with the IP address
         is an MCH.
 
+        Only the page is read until its title, the rest of the page is not
+        downloaded.
+
+        Args:
+            deadline: limit for the check.
+
         Returns:
             False, if not an MCH.
             True, if is an MCH.
@@ -93,28 +804,22 @@ class NATMCHWeb:
         is_mch = True
         message = None
 
+        if self._cached("is_mch"):
+            return is_mch, message
+
         try:
-            response = rq.get(
-                "http://{}/index.asp".format(self.ip_address),
-                headers=self._http_headers,
-                timeout=2,
-            )
-        except Exception as e:
-            if isinstance(e, rq.exceptions.ConnectionError):
-                raise NoRouteToDevice(
-                    "Error connecting to MCH web interface at {0}:".format(
-                        self.ip_address
-                    )
-                )
+            response = self._get("index.asp", deadline, stream=True)
+        except ConnTimeout as e:
+            raise NoRouteToDevice(e.message)
 
         if not response.ok:
+            response.close()
             is_mch = False
             message = "Unable to reach device at {0}, status code {1}:".format(
                 self.ip_address, response.status_code
             )
         else:
-            html_content = BeautifulSoup(response.text, "html.parser")
-            title = html_content.head.title.text
+            title = read_title(response)
 
             if not title == "MCH Configuration":
                 is_mch = False
@@ -123,11 +828,16 @@ class NATMCHWeb:
                     " of device: ''{1}''".format(self.ip_address, title)
                 )
 
+        if is_mch and self._state is not None:
+            self._state.update(self.ip_address, is_mch=True)
+
         return is_mch, message
 
     def _parse_basecfg(self, response):
         """Internal method to parse the HTML content for the base configuration.
 
+        See :py:func:`parse_basecfg_page`.
+
         Args:
             response: The output from the requests.get call.
 
@@ -135,74 +845,14 @@ class NATMCHWeb:
             A OrderedDict containing the settings for the base configuration
             page in the MCH webpage.
         """
-        mch_config = OrderedDict()
-        html_content = BeautifulSoup(response.text, "html.parser")
-        tables = html_content.body.find_all("table")
-
-        # Each subsection of the MCH Configuration is a different HTML
-        # table. Each table will add a child dictionary to the main one,
-        # indexed by the tr tag label from the HTML code.
-        for table in tables:
-            # Each section has a th tag. Then a set of parameters are included
-            # within the section.
-            table_title = table.th.text.strip()
-            # Set the table heather as the dict key
-            mch_config[table_title] = OrderedDict()
-
-            for row in table.find_all("tr"):
-                # Now, we're inside a section. Two kinds of parameters:
-                # - parameters with a numeric value
-                # - parameters with a select
-
-                select_params = row.find("select")
-                if select_params:
-                    # Form with select values
-                    # 1. First get the name attribute (should use find_all?)
-                    name = select_params["name"].strip()
-                    # 2. Look for the selected value for the given parameter
-                    subrows = row.find_all("option")
-                    value = [r["value"] for r in subrows if "selected" in str(r)][0]
-
-                    # Rough check, but better than nothing
-                    if name is None or value is None:
-                        continue
-
-                    mch_config[table_title][name] = value
-                    # No more stuff to parse for this row
-                    continue
-
-                # Form with input values
-                input_params = row.find_all("input")
-
-                if not input_params:
-                    continue
-
-                # How many fields does this setting have?
-                if len(input_params) > 1:
-                    name = input_params[0]["name"]
-                    value = [v["value"] for v in input_params]
-                else:
-                    name = input_params[0]["name"]
-                    value = input_params[0]["value"]
-
-                if name is None or value is None:
-                    continue
-                mch_config[table_title][name] = value
-                # No more stuff to parse for this row
-                continue
-
-        # The previous set of parameters will be encapsulated so
-        # a global dictionary can contain other set of parameters
-        globalcfg = OrderedDict()
-        globalcfg["Base MCH parameter"] = mch_config
-
-        return globalcfg
+        return parse_basecfg_page(response.content)
 
     def _parse_pcie(self, response):
         """Internal method to parse the HTML content for the PCIe configuration.
 
         This method receives the content of the page /goform/pcie_vs_config* and
         extracts the information from the Link width and Virtual swith tables.
+        See :py:func:`parse_pcie_page`.
 
         Args:
             response: The output from the requests.get call.
@@ -211,123 +861,99 @@ class NATMCHWeb:
             A OrderedDict containing the settings for the PCIe configuration
             page in the MCH webpage.
         """
-        mch_config = OrderedDict()
-        # Use lxml as parser, html.parser doesn't parse this web properly!
-        html_content = BeautifulSoup(response.text, "lxml")
-        # Divide the content by forms
-        forms = html_content.body.find_all("form")
-
-        # The first form contains the Link with configuration
-        cfgtitle = "Link Width Configuration"
-        if (
-            forms[0].attrs["action"] != "/goform/pcie_width_link_ctrl"
-            or forms[1].attrs["action"] != "/goform/pcie_vs_cfg_refresh"
-        ):
-            raise WebChanged("The PCIe configuration page has changed its format")
+        return parse_pcie_page(response.content)
+
+    def _firmware(self, deadline: Deadline = None):
+        """Firmware version of the MCH, retrieved once per object.
 
-        # There're 3 tables, each one configures a pair of adjacent AMC slots.
-        # From each table, get the value selecting a link with for each pair
-        # of AMC slots.
-        link_inputs = forms[0].find_all("input")
-        mch_config[cfgtitle] = OrderedDict()
-        curr_station = "Station_0"
-
-        for input in link_inputs:
-            if input["name"] == curr_station:
-                if "checked" in input.attrs:
-                    mch_config[cfgtitle][curr_station] = input["value"]
-                    next_station = int(curr_station[-1]) + 1
-                    curr_station = "Station_{}".format(next_station)
-
-        # Now, extract the information from the table with the Virtual Switch
-        # Configuration.
-        cfgtitle = "PCIe Virtual Switch configurationt"
-        mch_config[cfgtitle] = OrderedDict()
-
-        # The first kind of rows are indexed by the index.
-        indexes = [str(i) for i in range(6)]
-        indexes = ["none"] + indexes
-        indexes.append("Max. Link Speed")
-
-        # Now, iterate over the rows of the table
-        rows = forms[1].find_all("tr")
-
-        for row in rows:
-            # Let's skip all the initial rows with no data to be collected
-            # Only the first th field is properly parsed, so this dirty trick
-            # came up to cope with the issue:
-            title = row.find("b")
-            if title is None or (title is not None and title.text not in indexes):
+        Returns:
+            The version, or None when the capabilities are not tracked or the
+            version is not available.
+        """
+        if self._caps is not None and self._fw_ver is None:
+            try:
+                self.device_info(deadline)
+            except (AttributeError, KeyError):
+                # The information page has an unknown format
+                return None
+        return self._fw_ver
+
+    def _parse_category(self, category: str, content: bytes, fw_ver: str = None):
+        """Internal method to parse a configuration page.
+
+        The parser variants of the category are tried in turn, starting with
+        the one known for the firmware version. The variant that understands
+        the page is learnt for the firmware version.
+
+        Raises:
+            gendev_err.WebChanged if no variant understands the page.
+        """
+        variants = page_variants(category)
+        known = self._caps.variant(fw_ver, category) if fw_ver else None
+        if known in variants:
+            variants.remove(known)
+            variants.insert(0, known)
+        for variant in variants:
+            try:
+                mch_config = parse_page(category, content, self._parse_pool, variant)
+            except WebChanged:
                 continue
+            if fw_ver and variant != known:
+                self._caps.learn(fw_ver, "category", category, True, variant)
+            return mch_config
 
-            # Check whether the first select field is enabled in the row
-            selects = row.find_all("select")
-
-            # The row tagged with "none" has not select input fields
-            if selects != []:
-                # First, parse the Upstream option
-                for s in selects:
-                    for option in s.find_all("option"):
-                        if "selected" in option.attrs:
-                            mch_config[cfgtitle][s["name"]] = option["value"]
-
-            # Now, iterate over the columns and check what radio buttons
-            # are checked.
-
-            for input in row.find_all("input"):
-                if "checked" in input.attrs and "disabled" not in input.attrs:
-                    name = input["name"]
-                    mch_config[cfgtitle][name] = input["value"]
-
-        # The previous set of parameters will be encapsulated so
-        # a global dictionary can contain other set of parameters
-        pciecfg = OrderedDict()
-        pciecfg["PCIe parameter"] = mch_config
-
-        return pciecfg
-
-    def device_info(self) -> dict:
-        """Device info method."""
-        response = rq.get(
-            "http://{}/goform/GetInfo".format(self.ip_address),
-            headers=self._http_headers,
+        if fw_ver:
+            self._caps.learn(fw_ver, "category", category, False)
+        raise WebChanged(
+            "The {} page of the MCH at {} has an unknown format".format(
+                category, self.ip_address
+            )
         )
 
+    def device_info(self, deadline: Deadline = None) -> dict:
+        """Device info method.
+
+        The information page is parsed while it is downloaded, and the
+        download stops once every field was found.
+
+        Args:
+            deadline: limit for the whole operation.
+        """
+        cached = self._cached("device_info")
+        if cached:
+            self._fw_ver = cached["Board"]["fw_ver"]
+            return cached
+
+        response = self._get("goform/GetInfo", deadline, stream=True)
+
         if response.ok:
-            html_content = BeautifulSoup(response.text, "html.parser")
-            raw_info = html_content.get_text()
+            info = search_page_text(response, self._info_patterns)
             resp_dict = dict()
             resp_dict["Board"] = dict()
 
-            resp_dict["Board"]["fw_ver"] = self._match_fw_ver.search(raw_info).group(1)
-            resp_dict["Board"]["fpga_ver"] = self._match_fpga_ver.search(
-                raw_info
-            ).group(1)
+            resp_dict["Board"]["fw_ver"] = info["fw_ver"].group(1)
+            self._fw_ver = resp_dict["Board"]["fw_ver"]
+            resp_dict["Board"]["fpga_ver"] = info["fpga_ver"].group(1)
             # The web interface returns the version number with the prefix 'V',
             # while the other interfaces have no prefix.
             # Remove the prefix for consistency
-            resp_dict["Board"]["mcu_ver"] = (
-                self._match_mcu_ver.search(raw_info).group(1).strip("V")
-            )
-            resp_dict["Board"]["serial_num"] = self._match_board_sn.search(
-                raw_info
-            ).group(1)
+            resp_dict["Board"]["mcu_ver"] = info["mcu_ver"].group(1).strip("V")
+            resp_dict["Board"]["serial_num"] = info["serial_num"].group(1)
 
             resp_dict["Network"] = dict()
-            resp_dict["Network"]["ip_address"] = self._match_ip_addr.search(
-                raw_info
-            ).group(1)
-            resp_dict["Network"]["mac_address"] = self._match_mac_addr.search(
-                raw_info
-            ).group(1)
-            resp_dict["Network"]["subnet_address"] = self._match_subnet_mask.search(
-                raw_info
-            ).group(1)
-            resp_dict["Network"]["gateway_address"] = self._match_gateway_addr.search(
-                raw_info
-            ).group(1)
+            for field in (
+                "ip_address",
+                "mac_address",
+                "subnet_address",
+                "gateway_address",
+            ):
+                resp_dict["Network"][field] = info[field].group(1)
+
+            if self._state is not None:
+                self._state.update(self.ip_address, device_info=resp_dict)
 
         else:
+            response.close()
             resp_dict = dict()
 
         return resp_dict
@@ -348,7 +974,9 @@ class NATMCHWeb:
             "The firmware update is not supported by this module."
         )
 
-    def set_configuration(self, category: str, data, verify=True):
+    def set_configuration(
+        self, category: str, data, verify=True, deadline: Deadline = None
+    ):
         """Change the configuration of the device.
 
         This method focuses on the configuration parameters that are not
@@ -360,22 +988,81 @@ class NATMCHWeb:
         from the webpage names):
 
         - Base Configuration [basecfg]
+        - PCIe Configuration [pcie]
+
+        The page of the category is read, its forms are filled with the new
+        values (the rest of the fields keep the values of the page), and the
+        forms that changed are submitted. Most of the changes only take
+        effect after a reboot of the MCH.
 
         Args:
             category(str): settings category to be affected.
-            data(dict): dictionary containing the values to be modified
+            data(dict): dictionary containing the values to be modified, in
+                        the format of the output of get_configuration.
             verify(bool): when True, the method performs a checking after
                           setting the new parameters.
+            deadline: limit for the whole operation.
 
         Returns:
             - 0 when successful or verify=False
             - A dictionary containing the values that are not matching the
               expectation. For each key, the expected and the given values are
               provided.
+
+        Raises:
+            gendev_err.FeatureNotSupported if the category can't be changed
+            via the web interface.
+            gendev_err.NoRouteToDevice if the MCH rejects a request.
+            ValueError if a parameter is not a field of the page.
         """
-        raise FeatureNotSupported("Method not implemented yet.")
+        if category not in PAGE_PARSERS:
+            raise FeatureNotSupported(
+                "The category {} can't be changed via the web interface".format(
+                    category
+                )
+            )
+        deadline = Deadline(clock=self._clock) if deadline is None else deadline
+        path = "goform/{}".format(CONFIG_PAGES[category])
+
+        response = self._get(path, deadline)
+        if response.status_code == 404:
+            raise FeatureNotSupported(
+                "The MCH at {} doesn't offer the category {}".format(
+                    self.ip_address, category
+                )
+            )
+        if not response.ok:
+            raise NoRouteToDevice(
+                "Unable to read the {} page of {}, status code {}".format(
+                    category, self.ip_address, response.status_code
+                )
+            )
 
-    def get_configuration(self, category: str = None) -> OrderedDict:
+        for action, fields in fill_forms(response.content, data):
+            action = (action or path).lstrip("/")
+            response = self._post(action, fields, deadline)
+            if not response.ok:
+                raise NoRouteToDevice(
+                    "The MCH at {} rejected the form {}, status code {}".format(
+                        self.ip_address, action, response.status_code
+                    )
+                )
+        # The page has to be parsed again
+        self._pages.pop(path, None)
+
+        if not verify:
+            return 0
+        given = _parameters(self.get_configuration(category, deadline))
+        mismatches = OrderedDict(
+            (name, {"expected": value, "given": given.get(name)})
+            for name, value in _parameters(data).items()
+            if given.get(name) != _form_value(value)
+        )
+        return mismatches if mismatches else 0
+
+    def get_configuration(
+        self, category: str = None, deadline: Deadline = None
+    ) -> OrderedDict:
         """Get the configuration of the device.
 
         This method returns a dictionary containing the configuration
@@ -390,10 +1077,15 @@ class NATMCHWeb:
 
         - Base Configuration [basecfg]
 
+        When a table of capabilities was given, the categories that the
+        firmware of the MCH doesn't support are rejected without a request.
+
         Args:
             category: points to a subset of the configuration parameters of
                       the device. Use the values given between brackets from
                       the previous item list.
+            deadline: limit for the whole operation. The backplane category
+                      needs two requests, both are bounded by the deadline.
 
         Returns:
             OrderedDict: An ordered dict containing the settings in the same
@@ -401,41 +1093,57 @@ class NATMCHWeb:
             **backplane**, the dictionary conatins only one key (*Backplane
             Configuration*) and the whole configuration file as value for that
             key.
+
+        Raises:
+            gendev_err.FeatureNotSupported if the firmware of the MCH is
+            known not to support the category.
+            gendev_err.WebChanged if the page has an unknown format.
         """
         # Check the input parameter
-        if category == "basecfg":
-            cfgword = "change_mch_cfg"
-        elif category == "pcie":
-            cfgword = "pcie_width_link_ctrl"
-        elif category == "backplane":
-            # Request the generation of the script file to the MCH
-            cfgword = "web_cfg_backup_show_menu"
-        else:
-            cfgword = ""
+        cfgword = CONFIG_PAGES.get(category, "")
 
         mch_config: OrderedDict = OrderedDict()
 
         if cfgword == "":
             return mch_config
 
-        response = rq.get(
-            "http://{}/goform/{}".format(self.ip_address, cfgword),
-            headers=self._http_headers,
-        )
+        fw_ver = self._firmware(deadline)
+        if fw_ver and self._caps.supported(fw_ver, "category", category) is False:
+            raise FeatureNotSupported(
+                "The firmware {} of the MCH doesn't support the category {}".format(
+                    fw_ver, category
+                )
+            )
 
-        if response.ok:
+        if category == "backplane":
+            response = self._get("goform/{}".format(cfgword), deadline)
+        else:
+            # Let's parse the content, unless it didn't change
+            response, parsed = self._get_page(
+                "goform/{}".format(cfgword),
+                lambda page: self._parse_category(category, page.content, fw_ver),
+                deadline,
+            )
+
+        if response.status_code == 404 and fw_ver:
+            self._caps.learn(fw_ver, "category", category, False)
+        elif response.ok:
+            if fw_ver:
+                # The failures of the category don't count anymore
+                self._caps.learn(
+                    fw_ver,
+                    "category",
+                    category,
+                    True,
+                    self._caps.variant(fw_ver, category),
+                )
             if category != "backplane":
-                # Let's parse the content
-                parse_method = getattr(self, "_parse_{}".format(category))
-                mch_config = parse_method(response)
+                mch_config = parsed
             else:
                 cfgword = "nat_mch_startup_cfg.txt"
-                response = rq.get(
-                    "http://{}/{}".format(self.ip_address, cfgword),
-                    headers=self._http_headers,
-                )
-                mch_config["Backplane Configuration"] = (
-                    response.text if response.ok else ""
+                response, script = self._get_page(
+                    cfgword, lambda page: page.text, deadline
                 )
+                mch_config["Backplane Configuration"] = script if response.ok else ""
 
         return mch_config
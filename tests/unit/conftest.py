@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+conftest
+~~~~~~~~
+
+Fixtures shared by the unit tests.
+"""
+import pytest
+
+from gendev_tools.gendev_clock import VirtualClock
+from gendev_tools.gendev_deadline import LatencyRegistry
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.nat_mch.nat_mch_telnet import NATMCHTelnet
+from .fake_mch import FakeMCHSession
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+@pytest.fixture
+def virtual_clock():
+    """Clock where the waits of the library take no real time."""
+    return VirtualClock()
+
+
+@pytest.fixture
+def scripted_mch(virtual_clock):
+    """Factory of NATMCHTelnet instances talking to a scripted CLI.
+
+    The instances use the virtual clock, and their own health and latency
+    registries. The session of an instance is available as *_session*.
+
+    Example:
+        >>> mch = scripted_mch({b"reboot": b"Rebooting..."})
+    """
+
+    def factory(outputs=None, ip_address="172.30.5.238"):
+        return NATMCHTelnet(
+            ip_address,
+            session=FakeMCHSession(outputs),
+            health=HealthRegistry(clock=virtual_clock),
+            latency=LatencyRegistry(),
+            clock=virtual_clock,
+        )
+
+    return factory
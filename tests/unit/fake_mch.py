@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+fake_mch
+~~~~~~~~
+
+Stand-ins of the command line and web interfaces of an NAT MCH, shared by
+the unit tests.
+"""
+import re
+import time
+import hashlib
+import threading
+import socketserver
+
+from gendev_tools.gendev_transport import ReplayResponse
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+CLI_OUTPUT = {
+    b"version": b"Firmware V2.21.8 (r12345)\r\nFPGA V1.14\r\nAVR 1.2\r\n"
+    b"Board sn: 113522-1426\r\n",
+    b"ni": b"ip address      : 172.30.5.238\r\nieee address    : 00:40:42:22:05:92\r\n"
+    b"network mask    : 255.255.252.0\r\ndefault gateway : 172.30.7.254\r\n",
+}
+
+DEVICE_INFO = {
+    "Board": {
+        "fw_ver": "V2.21.8",
+        "fpga_ver": "V1.14",
+        "mcu_ver": "1.2",
+        "serial_num": "113522-1426",
+    },
+    "Network": {
+        "ip_address": "172.30.5.238",
+        "mac_address": "00:40:42:22:05:92",
+        "subnet_address": "255.255.252.0",
+        "gateway_address": "172.30.7.254",
+    },
+}
+
+WEB_PAGES = {
+    "index.asp": b"<html><head><title>MCH Configuration</title></head>"
+    b"<body></body></html>",
+    "goform/GetInfo": b"<html><body><pre>Firmware Version\nV2.21.8\n"
+    b"FPGA Version\nV1.14\nMicrocontroller Version\nV1.2\n"
+    b"Board Serial Number\n113522-1426\nIP Address\n172.30.5.238\n"
+    b"IEEE Address\n00:40:42:22:05:92\nSubnet Mask\n255.255.252.0\n"
+    b"Gateway Address\n172.30.7.254\n</pre></body></html>",
+}
+
+
+def cli_answer(data, outputs=CLI_OUTPUT):
+    """Output of the CLI of the MCH for the given input (echo included)."""
+    return data + outputs.get(data.strip(), b"") + b"\r\nnat> "
+
+
+class FakeMCHSession:
+    """Telnet-like session answering as the CLI of an MCH.
+
+    Args:
+        outputs: output of other commands, or different outputs for the
+                 commands of CLI_OUTPUT.
+    """
+
+    def __init__(self, outputs=None):
+        self.buffer = b""
+        self.outputs = dict(CLI_OUTPUT)
+        self.outputs.update(outputs or dict())
+        self.commands = []
+
+    def write(self, data):
+        # Several commands can be written at once (pipelined)
+        for command in re.findall(rb"[^\r]*\r|[^\r]+$", data):
+            self.commands.append(command.strip())
+            self.buffer += cli_answer(command, self.outputs)
+
+    def read_until(self, match, timeout=None):
+        index = self.buffer.find(match)
+        end = len(self.buffer) if index < 0 else index + len(match)
+        data, self.buffer = self.buffer[:end], self.buffer[end:]
+        return data
+
+    def read_very_eager(self):
+        data, self.buffer = self.buffer, b""
+        return data
+
+    def close(self):
+        pass
+
+
+class FakeResponse(ReplayResponse):
+    """Response keeping track of the bytes of the body read as a stream."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        for chunk in super().iter_content(chunk_size):
+            self.read += len(chunk)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeMCHWeb:
+    """HTTP client answering as the web server of an MCH.
+
+    Args:
+        pages: content of other pages, indexed by their path. A page can be
+               given as (status code, content). The missing pages answer
+               with a 404.
+        etags: give an ETag with every page, and answer the conditional
+               requests (If-None-Match) with a 304.
+
+    The submitted forms are kept in *posts*, and answered with a 200 unless
+    their action is one of the pages.
+    """
+
+    def __init__(self, pages=None, etags=False):
+        self.pages = dict(WEB_PAGES)
+        self.pages.update(pages or dict())
+        self.etags = etags
+        self.requests = []
+        self.headers = []
+        self.responses = []
+        self.posts = []
+
+    def get(self, url, headers=None, **kwargs):
+        path = url.split("/", 3)[3]
+        self.requests.append(path)
+        self.headers.append(headers or dict())
+        page = self.pages.get(path, (404, b"Not Found"))
+        status, content = page if isinstance(page, tuple) else (200, page)
+        response_headers = {"Content-Type": "text/html"}
+        if self.etags and status == 200:
+            etag = '"{}"'.format(hashlib.sha1(content).hexdigest()[:16])
+            response_headers["ETag"] = etag
+            if (headers or dict()).get("If-None-Match") == etag:
+                status, content = 304, b""
+        response = FakeResponse(url, status, response_headers, content)
+        self.responses.append(response)
+        return response
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        path = url.split("/", 3)[3]
+        self.posts.append((path, list(data)))
+        page = self.pages.get(path, b"OK")
+        status, content = page if isinstance(page, tuple) else (200, page)
+        return FakeResponse(url, status, {"Content-Type": "text/html"}, content)
+
+
+class FakeSerialServer(socketserver.ThreadingTCPServer):
+    """TCP server answering as the serial console of an MCH (like a port of a
+    MOXA hub).
+
+    Args:
+        delay: seconds that the MCH takes to answer each command.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay=0.0):
+        super().__init__(("127.0.0.1", 0), _SerialHandler)
+        self.delay = delay
+        self.port = self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class _SerialHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        pending = b""
+        while True:
+            data = self.request.recv(1024)
+            if not data:
+                return
+            pending += data
+            while b"\r" in pending:
+                command, pending = pending.split(b"\r", 1)
+                time.sleep(self.server.delay)
+                self.request.sendall(cli_answer(command + b"\r"))
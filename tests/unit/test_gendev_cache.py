@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_cache
+~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_cache module.
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from gendev_tools.gendev_cache import DeviceStateCache
+from gendev_tools.gendev_err import DeviceUnavailable, NoRouteToDevice
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.gendev_interface import ConnType
+from gendev_tools.gendev_selector import TransportSelector
+from gendev_tools.nat_mch.nat_mch import NATMCH
+from gendev_tools.nat_mch.nat_mch_web import NATMCHWeb
+from .fake_mch import DEVICE_INFO, FakeMCHWeb
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+MCH = "172.30.5.238"
+
+
+def publish(path):
+    """Worker process publishing the state of an MCH."""
+    with DeviceStateCache(path) as cache:
+        cache.update(MCH, device_info=DEVICE_INFO, health="up")
+
+
+class TestDeviceStateCache:
+    @pytest.fixture
+    def cache(self, tmp_path, virtual_clock):
+        with DeviceStateCache(
+            str(tmp_path / "state"), slots=16, ttl=60, clock=virtual_clock
+        ) as cache:
+            yield cache
+
+    def test_update(self, cache, virtual_clock):
+        """Test the fields of the state, and their expiration"""
+        assert cache.get(MCH) is None
+        cache.update(MCH, is_mch=True)
+        virtual_clock.advance(30)
+        cache.update(MCH, health="up")
+        state = cache.get(MCH)
+        assert state == {
+            "is_mch": True,
+            "health": "up",
+            "last_seen": virtual_clock.time(),
+        }
+
+        virtual_clock.advance(40)
+        assert cache.get(MCH) == {"health": "up", "last_seen": state["last_seen"]}
+        cache.discard(MCH, "health")
+        assert cache.get(MCH) is None
+
+    def test_processes(self, cache):
+        """Test that the state written by a process is read by the others"""
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            pool.submit(publish, cache.path).result()
+        assert cache.get(MCH)["device_info"] == DEVICE_INFO
+
+    def test_eviction(self, cache, virtual_clock):
+        """Test that the least recently updated devices are evicted"""
+        for i in range(32):
+            virtual_clock.advance(1)
+            cache.update("mch-{}".format(i), health="up")
+        assert cache.get("mch-31") is not None
+        assert sum(cache.get("mch-{}".format(i)) is not None for i in range(32)) == 16
+        with pytest.raises(ValueError):
+            cache.update(MCH, script="x" * 2048)
+
+    def test_concurrent_reads(self, cache):
+        """Test that the readers never get a half written state"""
+        stop = threading.Event()
+
+        def write():
+            for i in range(2000):
+                cache.update(MCH, a=i, b=i, pad="x" * (i % 500))
+            stop.set()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        reads = 0
+        while not stop.is_set():
+            state = cache.get(MCH)
+            if state is not None:
+                assert state["a"] == state["b"]
+                reads += 1
+        writer.join()
+        assert reads > 0
+
+    def test_shared_mch(self, cache):
+        """Test that an MCH found by a worker isn't requested by the others"""
+        http = FakeMCHWeb()
+        web = NATMCHWeb(MCH, http=http, health=HealthRegistry(), state_cache=cache)
+        assert web.device_info() == DEVICE_INFO
+        assert http.requests == ["index.asp", "goform/GetInfo"]
+
+        # Another worker: neither the identity nor the information is requested
+        http = FakeMCHWeb()
+        mch = NATMCH(
+            MCH,
+            [ConnType.ETHER],
+            health=HealthRegistry(),
+            selector=TransportSelector(),
+            http=http,
+            state_cache=cache,
+        )
+        assert mch.device_info() == DEVICE_INFO
+        web = NATMCHWeb(MCH, http=http, health=HealthRegistry(), state_cache=cache)
+        assert web.device_info() == DEVICE_INFO
+        assert http.requests == []
+
+    def test_shared_health(self, cache, virtual_clock):
+        """Test that an MCH found down by a worker fails fast for the others"""
+        cache.update(MCH, health="down", error="Connection refused")
+        http = FakeMCHWeb()
+        mch = NATMCH(
+            MCH,
+            [ConnType.ETHER],
+            health=HealthRegistry(clock=virtual_clock),
+            selector=TransportSelector(),
+            http=http,
+            state_cache=cache,
+        )
+        with pytest.raises(DeviceUnavailable):
+            mch.device_info()
+        assert http.requests == []
+        assert cache.get(MCH)["error"] == "Connection refused"
+
+        # Once the backoff expires, the MCH is checked again
+        virtual_clock.advance(5)
+        assert mch.device_info() == DEVICE_INFO
+        assert cache.get(MCH)["health"] == "up"
+
+    def test_published_error(self, cache):
+        """Test that a long error doesn't hide the error of the operation"""
+
+        class FakeConn:
+            def device_info(self, deadline=None):
+                raise NoRouteToDevice("x" * 4096)
+
+            def update_fw(self, fw_version, deadline=None):
+                return (True,)
+
+        # Without backoff, so the MCH found down is retried right away
+        mch = NATMCH(
+            MCH,
+            [ConnType.TELNET],
+            health=HealthRegistry(backoff=0),
+            selector=TransportSelector(),
+            state_cache=cache,
+        )
+        mch._conn_factories[ConnType.TELNET] = lambda deadline: FakeConn()
+        with pytest.raises(NoRouteToDevice):
+            mch.device_info()
+        assert cache.get(MCH)["health"] == "down"
+
+        # The update makes the information of the MCH stale
+        cache.update(MCH, device_info=DEVICE_INFO, is_mch=True)
+        assert mch.update_fw("V2.21.8") == (True,)
+        assert set(cache.get(MCH)) == {"health", "error", "last_seen"}
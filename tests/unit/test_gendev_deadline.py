@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_deadline
+~~~~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_deadline module.
+"""
+import math
+import time
+import socket
+import pytest
+
+from gendev_tools.gendev_deadline import Deadline, LatencyRegistry, RTTEstimator
+from gendev_tools.gendev_err import ConnTimeout
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.nat_mch.nat_mch_telnet import NATMCHTelnet
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class TestDeadline:
+    def test_unbounded(self):
+        """Test a deadline without limit"""
+        deadline = Deadline()
+        assert deadline.remaining() == math.inf
+        assert deadline.bound() is None
+        assert deadline.bound(10) == 10
+
+    def test_bound(self):
+        """Test that the steps are limited by the deadline"""
+        deadline = Deadline(5)
+        assert deadline.bound(1) == 1
+        assert 4 < deadline.bound(30) <= 5
+        expired = Deadline(0)
+        assert expired.expired()
+        with pytest.raises(ConnTimeout):
+            expired.bound(1, "the flashing")
+
+    def test_rtt_estimator(self):
+        """Test the timeout derived from the RTT measurements"""
+        estimator = RTTEstimator(initial=5, min_timeout=0.5, max_timeout=30)
+        assert estimator.timeout() == 5
+        for _ in range(50):
+            estimator.update(0.1)
+        assert estimator.timeout() == 0.5
+        estimator.update(100)
+        assert estimator.timeout() == 30
+
+    def test_registry_keys(self):
+        """Test that each key has its own estimator"""
+        registry = LatencyRegistry(initial=3)
+        registry.record(("mch", "http"), 0.8)
+        assert registry.timeout(("mch", "http")) == pytest.approx(2.4)
+        assert registry.timeout(("mch", "telnet")) == 3
+
+
+class TestTelnetDeadline:
+    def test_hung_device(self):
+        """Test that a device that never answers doesn't block the caller"""
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+        try:
+            mch = NATMCHTelnet("127.0.0.1", port, health=HealthRegistry())
+            start = time.monotonic()
+            with pytest.raises(ConnTimeout):
+                mch.device_info(deadline=Deadline(0.3))
+            assert time.monotonic() - start < 2
+        finally:
+            server.close()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_drift
+~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_drift module.
+"""
+import time
+from collections import OrderedDict
+
+from gendev_tools.gendev_drift import (
+    DriftEngine,
+    DriftStatus,
+    GoldenProfile,
+    diff_config,
+)
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+GOLDEN_BASECFG = OrderedDict(
+    [
+        (
+            "Base MCH parameter",
+            OrderedDict(
+                [
+                    ("MCH global parameter", {"telnet_enable": "8", "ssh_enable": "0"}),
+                    ("Time Protocol / SNTP parameter", {"ntp_enable": "1"}),
+                ]
+            ),
+        )
+    ]
+)
+
+
+class FakeDevice:
+    def __init__(self, config=None, delay=0, fail=False):
+        self.config = config
+        self.delay = delay
+        self.fail = fail
+
+    def get_configuration(self, category=None):
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("MCH not reachable")
+        return self.config
+
+
+class TestGenDevDrift:
+    def setup_method(self):
+        self.engine = DriftEngine(GoldenProfile({"basecfg": GOLDEN_BASECFG}))
+
+    def test_diff_config(self):
+        """Test the diff reports changed, missing and extra parameters"""
+        given = {
+            "Base MCH parameter": {
+                "MCH global parameter": {"telnet_enable": "0", "rmcp_enable": "4"},
+                "Time Protocol / SNTP parameter": {"ntp_enable": "1"},
+            }
+        }
+        diff = diff_config(GOLDEN_BASECFG, given)
+        prefix = "Base MCH parameter::MCH global parameter::"
+        assert diff == {
+            prefix + "telnet_enable": {"expected": "8", "given": "0"},
+            prefix + "ssh_enable": {"expected": "0", "given": None},
+            prefix + "rmcp_enable": {"expected": None, "given": "4"},
+        }
+
+    def test_run(self):
+        """Test a run with matching, drifted and failing devices"""
+        drifted = {
+            "Base MCH parameter": {
+                "MCH global parameter": {"telnet_enable": "8", "ssh_enable": "1"},
+                "Time Protocol / SNTP parameter": {"ntp_enable": "1"},
+            }
+        }
+        report = self.engine.run(
+            {
+                "mch-ok": FakeDevice(GOLDEN_BASECFG),
+                "mch-drift": FakeDevice(drifted),
+                "mch-down": FakeDevice(fail=True),
+            }
+        )
+        assert report.by_status(DriftStatus.MATCH) == ["mch-ok"]
+        assert report.by_status(DriftStatus.DRIFT) == ["mch-drift"]
+        assert report.by_status(DriftStatus.ERROR) == ["mch-down"]
+
+        compact = report.to_dict()
+        assert compact["match"] == ["mch-ok"]
+        assert "mch-ok" not in compact["devices"]
+        assert list(compact["devices"]["mch-drift"]["categories"]["basecfg"]) == [
+            "Base MCH parameter::MCH global parameter::ssh_enable"
+        ]
+
+    def test_timeout(self):
+        """Test that slow devices are reported when the run times out"""
+        report = self.engine.run(
+            {"mch-ok": FakeDevice(GOLDEN_BASECFG), "mch-slow": FakeDevice(delay=1)},
+            timeout=0.2,
+        )
+        assert report.results["mch-ok"].status == DriftStatus.MATCH
+        assert report.results["mch-slow"].status == DriftStatus.TIMEOUT
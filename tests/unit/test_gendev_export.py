@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_export
+~~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_export module.
+"""
+import gzip
+import io
+import threading
+import zlib
+
+from gendev_tools.gendev_err import ConnTimeout
+from gendev_tools.gendev_export import (
+    JSONLinesWriter,
+    close_gzip,
+    StreamingExporter,
+    export_fleet,
+    read_records,
+)
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class FakeDevice:
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+
+    def device_info(self):
+        return {"Board": {"fw_ver": "V2.21.8", "name": self.name}}
+
+    def get_configuration(self, category):
+        if self.fail:
+            raise ConnTimeout("No answer")
+        return {"Backplane": {"Slot 1": "enabled"}}
+
+
+class BlockingWriter:
+    def __init__(self):
+        self.release = threading.Event()
+        self.records = list()
+
+    def write(self, record):
+        self.release.wait()
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+class TestGendevExport:
+    """Test the streaming export of fleet results."""
+
+    def test_roundtrip(self, tmp_path):
+        """Test writing and reading plain and compressed files."""
+        for name in ("out.jsonl", "out.jsonl.gz"):
+            path = str(tmp_path / name)
+            with JSONLinesWriter(path) as writer:
+                writer.write({"device": "mch-01"})
+                writer.write({"device": "mch-02"})
+            assert [r["device"] for r in read_records(path)] == ["mch-01", "mch-02"]
+
+        with open(str(tmp_path / "out.jsonl.gz"), "rb") as f:
+            assert f.read(2) == b"\x1f\x8b"
+
+    def test_partial_files(self, tmp_path):
+        """Test reading the files of an interrupted export."""
+        path = str(tmp_path / "out.jsonl.gz")
+        writer = JSONLinesWriter(path)
+        writer.write({"device": "mch-01"})
+        # Not closed: the records written are readable anyway
+        assert list(read_records(path)) == [{"device": "mch-01"}]
+        writer.close()
+
+        path = str(tmp_path / "out.jsonl")
+        with JSONLinesWriter(path) as writer:
+            writer.write({"device": "mch-01"})
+        with open(path, "a") as f:
+            f.write('{"device": "mc')
+        assert list(read_records(path)) == [{"device": "mch-01"}]
+
+    def test_append_after_crash(self, tmp_path):
+        """Test appending to a compressed file left unfinished by a crash."""
+        path = str(tmp_path / "out.jsonl.gz")
+        with JSONLinesWriter(path) as writer:
+            writer.write({"device": "mch-01"})
+        # A member without the trailer, with a truncated last record
+        buffer = io.BytesIO()
+        member = gzip.GzipFile(fileobj=buffer, mode="wb")
+        member.write(b'{"device":"mch-02"}\n{"device":"mc')
+        member.flush(zlib.Z_SYNC_FLUSH)
+        with open(path, "ab") as f:
+            f.write(buffer.getvalue())
+        assert [r["device"] for r in read_records(path)] == ["mch-01", "mch-02"]
+
+        with JSONLinesWriter(path, append=True) as writer:
+            writer.write({"device": "mch-03"})
+        assert [r["device"] for r in read_records(path)] == [
+            "mch-01",
+            "mch-02",
+            "mch-03",
+        ]
+        assert close_gzip(path) is False
+
+    def test_backpressure(self):
+        """Test that the producers wait while the queue is full."""
+        writer = BlockingWriter()
+        exporter = StreamingExporter(writer, max_pending=1)
+        producer = threading.Thread(
+            target=lambda: [exporter.put({"n": n}) for n in range(3)]
+        )
+        producer.start()
+        producer.join(0.3)
+        assert producer.is_alive()
+        writer.release.set()
+        producer.join()
+        exporter.close()
+        assert writer.records == [{"n": 0}, {"n": 1}, {"n": 2}]
+
+    def test_export_fleet(self, tmp_path):
+        """Test the export of a fleet given as a generator."""
+        path = str(tmp_path / "fleet.jsonl.gz")
+        devices = (
+            ("mch-{:02}".format(n), FakeDevice("mch-{:02}".format(n), fail=n == 3))
+            for n in range(10)
+        )
+        summary = export_fleet(
+            devices, path, targets=["device_info", "basecfg"], max_workers=4
+        )
+        assert summary == {"ok": 9, "error": 1}
+
+        records = {r["device"]: r for r in read_records(path)}
+        assert len(records) == 10
+        assert records["mch-01"]["data"]["device_info"]["Board"]["name"] == "mch-01"
+        assert "errors" not in records["mch-01"]
+        assert list(records["mch-03"]["data"]) == ["device_info"]
+        assert "No answer" in records["mch-03"]["errors"]["basecfg"]
+
+        # Appending to the previous results
+        export_fleet({"mch-10": FakeDevice("mch-10")}, path, append=True)
+        assert len(list(read_records(path))) == 11
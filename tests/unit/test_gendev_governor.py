@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_governor
+~~~~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_governor module.
+"""
+import time
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+from gendev_tools.gendev_clock import VirtualClock
+from gendev_tools.gendev_governor import Governor, TokenBucket
+from gendev_tools.gendev_deadline import Deadline
+from gendev_tools.gendev_err import ConnTimeout
+from gendev_tools.gendev_interface import ConnType
+from gendev_tools.gendev_selector import TransportSelector
+from gendev_tools.nat_mch.nat_mch import NATMCH
+from gendev_tools.nat_mch.nat_mch_telnet import FW_SERVER
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class ConcurrencyProbe:
+    """Keeps the maximum number of operations running at the same time."""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, seconds=0.05):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(seconds)
+        with self._lock:
+            self.running -= 1
+
+
+class TestTokenBucket:
+    def test_rate(self):
+        """Test that the bucket allows the burst, and then the rate"""
+        clock = VirtualClock(100.0)
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+        assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+        assert bucket.try_acquire() == pytest.approx(0.5)
+        clock.advance(0.5)
+        assert bucket.try_acquire() == 0
+        clock.advance(100)
+        assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+        assert bucket.try_acquire() > 0
+        # Waiting for a token sleeps on the clock
+        bucket.acquire()
+        assert clock.sleeps == [pytest.approx(0.5)]
+
+    def test_deadline(self):
+        """Test that waiting for a token is bounded by the deadline"""
+        bucket = TokenBucket(rate=0.1, burst=1)
+        bucket.acquire()
+        with pytest.raises(ConnTimeout):
+            bucket.acquire(deadline=Deadline(1))
+
+
+class TestGovernor:
+    def test_concurrency(self):
+        """Test the per-device and global concurrency limits"""
+        governor = Governor()
+        governor.set_limit("device", concurrency=1)
+        governor.set_limit("global", concurrency=3)
+        probes = {device: ConcurrencyProbe() for device in ("a", "b")}
+        fleet = ConcurrencyProbe()
+
+        def operation(device):
+            with governor.limit({"device": device}):
+                fleet(0)
+                probes[device]()
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(operation, ["a", "b"] * 4))
+        assert probes["a"].max_running == 1
+        assert probes["b"].max_running == 1
+        assert fleet.max_running <= 2
+
+    def test_specific_limit(self):
+        """Test that a specific resource can have its own limits"""
+        governor = Governor()
+        governor.set_limit("server", concurrency=1)
+        governor.set_limit("server", "tftp", concurrency=2)
+        probe = ConcurrencyProbe()
+
+        def operation(_):
+            with governor.limit({"server": "tftp"}):
+                probe(0.1)
+
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(operation, range(4)))
+        assert probe.max_running == 2
+
+    def test_wait_deadline(self):
+        """Test that the wait for a busy resource is bounded by the deadline"""
+        governor = Governor()
+        governor.set_limit("crate", concurrency=1)
+        busy = threading.Event()
+        done = threading.Event()
+
+        def hold():
+            with governor.limit({"crate": "crate-1"}):
+                busy.set()
+                done.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        busy.wait(5)
+        try:
+            with pytest.raises(ConnTimeout):
+                with governor.limit({"crate": "crate-1"}, Deadline(0.1)):
+                    pass
+            with governor.limit({"crate": "crate-2"}, Deadline(0.1)):
+                pass
+        finally:
+            done.set()
+            thread.join()
+
+    def test_nested(self):
+        """Test that nested operations on the same resource don't block"""
+        governor = Governor()
+        governor.set_limit("device", concurrency=1)
+        with governor.limit({"device": "a"}):
+            with governor.limit({"device": "a"}, Deadline(0.1)):
+                pass
+
+
+class TestNATMCHGovernor:
+    def test_resources(self):
+        """Test that the NAT MCH operations consult the governor"""
+        probe = ConcurrencyProbe()
+        governor = Governor()
+        governor.set_limit("device", concurrency=1)
+        requested = []
+        limit = governor.limit
+        governor.limit = lambda resources, deadline=None: (
+            requested.append(resources) or limit(resources, deadline)
+        )
+
+        class FakeConn:
+            def device_info(self, deadline=None):
+                probe()
+                return {}
+
+            def update_fw(self, fw_version, deadline=None):
+                return (True,)
+
+        mch = NATMCH(
+            "172.30.5.238",
+            allowed_conn=[ConnType.TELNET],
+            selector=TransportSelector(),
+            governor=governor,
+            crate="crate-1",
+        )
+        mch._conn_factories[ConnType.TELNET] = lambda deadline: FakeConn()
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda _: mch.device_info(), range(4)))
+        assert probe.max_running == 1
+        assert mch.update_fw("V2.21.8") == (True,)
+        assert requested[-2:] == [
+            {"crate": "crate-1", "server": FW_SERVER},
+            {"device": "172.30.5.238"},
+        ]
+
+    def test_multiplexed(self):
+        """Test that the SSH commands don't hold the device"""
+        probe = ConcurrencyProbe()
+        governor = Governor()
+        governor.set_limit("device", concurrency=1)
+
+        class FakeConn:
+            def device_info(self, deadline=None):
+                probe()
+                return {}
+
+        mch = NATMCH(
+            "172.30.5.238",
+            allowed_conn=[ConnType.SSH],
+            selector=TransportSelector(),
+            governor=governor,
+        )
+        mch._conn_factories[ConnType.SSH] = lambda deadline: FakeConn()
+        mch._connection(ConnType.SSH)
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda _: mch.device_info(), range(4)))
+        assert probe.max_running > 1
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_health
+~~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_health module.
+"""
+import socket
+import pytest
+
+from gendev_tools.gendev_clock import VirtualClock
+from gendev_tools.gendev_health import BreakerState, HealthRegistry, tcp_probe
+from gendev_tools.gendev_err import DeviceUnavailable, NoRouteToDevice
+from gendev_tools.nat_mch.nat_mch_telnet import NATMCHTelnet
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+def closed_port():
+    """Get a local TCP port with nothing listening on it."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestHealthRegistry:
+    def setup_method(self):
+        self.clock = VirtualClock(1000.0)
+        self.registry = HealthRegistry(backoff=10, max_backoff=25, clock=self.clock)
+
+    def test_breaker_cycle(self):
+        """Test the transitions of the circuit breaker of a device"""
+        self.registry.check("mch")
+        self.registry.record_failure("mch")
+        assert self.registry.state("mch") == BreakerState.OPEN
+        with pytest.raises(DeviceUnavailable):
+            self.registry.check("mch")
+
+        # After the backoff, a single probe is allowed
+        self.clock.advance(10)
+        self.registry.check("mch")
+        assert self.registry.state("mch") == BreakerState.HALF_OPEN
+        with pytest.raises(NoRouteToDevice):
+            self.registry.check("mch")
+
+        # A failed probe doubles the backoff
+        self.registry.record_failure("mch")
+        self.clock.advance(10)
+        with pytest.raises(DeviceUnavailable):
+            self.registry.check("mch")
+        self.clock.advance(10)
+        self.registry.check("mch")
+        self.registry.record_success("mch")
+        assert self.registry.state("mch") == BreakerState.CLOSED
+        assert self.registry.unavailable() == []
+
+    def test_probe_due(self):
+        """Test that the periodic probes only target the expired devices"""
+        self.registry.record_failure("mch-up")
+        self.registry.record_failure("mch-down")
+        assert self.registry.probe_due(lambda device: True) == {}
+
+        self.clock.advance(10)
+        results = self.registry.probe_due(lambda device: device == "mch-up")
+        assert results == {"mch-up": True, "mch-down": False}
+        assert self.registry.unavailable() == ["mch-down"]
+
+
+class TestFastFail:
+    def test_telnet_fast_fail(self):
+        """Test that a device refusing the connection fails fast afterwards"""
+        registry = HealthRegistry(backoff=60)
+        port = closed_port()
+        assert tcp_probe("127.0.0.1", port) is False
+        with pytest.raises(NoRouteToDevice) as excinfo:
+            NATMCHTelnet("127.0.0.1", port, health=registry)
+        assert not isinstance(excinfo.value, DeviceUnavailable)
+        with pytest.raises(DeviceUnavailable):
+            NATMCHTelnet("127.0.0.1", port, health=registry)
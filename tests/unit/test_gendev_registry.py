@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_registry
+~~~~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_registry module.
+"""
+import pytest
+
+from gendev_tools import gendev_registry
+from gendev_tools.gendev_registry import DriverRegistry
+from gendev_tools.gendev_err import DriverNotFound
+from gendev_tools.nat_mch.nat_mch import NATMCH
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class FakeEntryPoint:
+    def __init__(self, name, driver):
+        self.name = name
+        self.driver = driver
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return self.driver
+
+
+class TestDriverRegistry:
+    @pytest.fixture(autouse=True)
+    def entry_points(self, monkeypatch):
+        self.amc = FakeEntryPoint("ACME/AMC-42", NATMCH)
+        self.bad = FakeEntryPoint("acme/bad", dict)
+        monkeypatch.setattr(
+            gendev_registry, "_entry_points", lambda group: [self.amc, self.bad]
+        )
+
+    def test_builtin(self):
+        """Test that the NAT MCH driver is always available"""
+        registry = DriverRegistry()
+        assert ("nat", "mch") in registry.available()
+        assert registry.get("NAT", "MCH") is NATMCH
+
+    def test_lazy_loading(self):
+        """Test that the drivers are only loaded once, when first used"""
+        registry = DriverRegistry()
+        assert registry.available() == [
+            ("acme", "amc-42"),
+            ("acme", "bad"),
+            ("nat", "mch"),
+        ]
+        assert registry.loaded() == []
+        assert self.amc.loads == 0
+        assert registry.get("acme", "amc-42") is NATMCH
+        assert registry.get("Acme", "AMC-42") is NATMCH
+        assert self.amc.loads == 1
+        assert registry.loaded() == [("acme", "amc-42")]
+
+    def test_errors(self):
+        """Test the lookup of unknown or invalid drivers"""
+        registry = DriverRegistry()
+        with pytest.raises(DriverNotFound):
+            registry.get("NAT", "AMC")
+        with pytest.raises(TypeError):
+            registry.get("acme", "bad")
+
+    def test_register(self):
+        """Test the manual registration of drivers"""
+        registry = DriverRegistry()
+        registry.register("NAT", "MCH-PHYS", "gendev_tools.nat_mch.nat_mch:NATMCH")
+        assert registry.get("nat", "mch-phys") is NATMCH
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_selector
+~~~~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_selector module.
+"""
+import pytest
+import requests as rq
+
+from gendev_tools.gendev_clock import VirtualClock
+from gendev_tools.gendev_selector import TransportSelector
+from gendev_tools.gendev_err import (
+    ConnTimeout,
+    FeatureNotSupported,
+    NoRouteToDevice,
+)
+from gendev_tools.gendev_health import BreakerState, HealthRegistry
+from gendev_tools.gendev_interface import ConnType
+from gendev_tools.nat_mch.nat_mch import NATMCH
+from gendev_tools.nat_mch.nat_mch_telnet import NATMCHTelnet
+from .fake_mch import DEVICE_INFO, FakeMCHSession, FakeMCHWeb
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class FakeConn:
+    """Connection of an interface of the MCH, failing on demand."""
+
+    def __init__(self, name, calls, error=None):
+        self.name = name
+        self.calls = calls
+        self.error = error
+
+    def device_info(self, deadline=None):
+        self.calls.append(self.name)
+        if self.error is not None:
+            raise self.error
+        return DEVICE_INFO
+
+    def get_configuration(self, category=None, deadline=None):
+        self.calls.append(self.name)
+        raise self.error
+
+    def update_fw(self, fw_version, deadline=None):
+        self.calls.append(self.name)
+        raise ConnTimeout("Flashing")
+
+
+class TimeoutWeb(FakeMCHWeb):
+    """Web server of an MCH that stopped answering."""
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(url.split("/", 3)[3])
+        raise rq.exceptions.Timeout()
+
+
+class TestTransportSelector:
+    def test_rank(self):
+        """Test that the fastest healthy transport is chosen"""
+        selector = TransportSelector()
+        transports = ["web", "telnet", "ssh"]
+        # Without measurements, the preference order is kept
+        assert selector.rank("mch", transports, "info") == transports
+        selector.record_success("mch", "web", "info", 0.5)
+        selector.record_success("mch", "ssh", "info", 0.2)
+        # The unmeasured transports go first
+        assert selector.rank("mch", transports, "info") == ["telnet", "ssh", "web"]
+        selector.record_success("mch", "telnet", "info", 3.0)
+        assert selector.rank("mch", transports, "info") == ["ssh", "web", "telnet"]
+        # Other operations and devices have their own measurements
+        assert selector.rank("mch", transports, "other") == transports
+        assert selector.rank("mch2", transports, "info") == transports
+
+    def test_unhealthy(self):
+        """Test that failing transports go last until they are retried"""
+        clock = VirtualClock(1000.0)
+        selector = TransportSelector(error_threshold=0.5, retry_after=30, clock=clock)
+        selector.record_success("mch", "ssh", "info", 0.2)
+        selector.record_success("mch", "web", "info", 0.5)
+        selector.record_failure("mch", "ssh")
+        assert selector.rank("mch", ["ssh", "web"], "info") == ["ssh", "web"]
+        selector.record_failure("mch", "ssh")
+        assert selector.stats("mch", "ssh")["error_rate"] > 0.5
+        assert selector.rank("mch", ["ssh", "web"], "info") == ["web", "ssh"]
+        clock.advance(30)
+        assert selector.rank("mch", ["ssh", "web"], "info") == ["ssh", "web"]
+
+    def test_failover(self):
+        """Test that a failing transport fails over to the next one"""
+        selector = TransportSelector()
+
+        def broken():
+            raise NoRouteToDevice("down")
+
+        assert selector.call("mch", "info", {"web": broken, "cli": lambda: 42}) == 42
+        assert selector.stats("mch", "web")["error_rate"] > 0
+        assert "info" in selector.stats("mch", "cli")["latency"]
+        with pytest.raises(NoRouteToDevice):
+            selector.call("mch", "info", {"web": broken}, failover=False)
+        with pytest.raises(FeatureNotSupported):
+            selector.call("mch", "info", {})
+
+
+class TestNATMCHSelection:
+    @pytest.fixture
+    def mch(self):
+        mch = NATMCH(
+            "172.30.5.238",
+            allowed_conn=[ConnType.ETHER, ConnType.TELNET],
+            selector=TransportSelector(),
+        )
+        self.calls = []
+        self.opened = []
+        self.web_error = NoRouteToDevice("The web server is down")
+
+        def factory(name, error=None):
+            def create(deadline):
+                self.opened.append(name)
+                return FakeConn(name, self.calls, error)
+
+            return create
+
+        mch._conn_factories[ConnType.ETHER] = factory("web", self.web_error)
+        mch._conn_factories[ConnType.TELNET] = factory("telnet")
+        return mch
+
+    def test_failover(self, mch):
+        """Test that the MCH keeps working when the web interface is down"""
+        assert mch.device_info() == DEVICE_INFO
+        assert self.calls == ["web", "telnet"]
+        assert mch.device_info() == DEVICE_INFO
+        # The broken connection is opened again, but after Telnet
+        assert self.calls == ["web", "telnet", "telnet"]
+        assert self.opened == ["web", "telnet"]
+
+    def test_supported_ops(self, mch):
+        """Test that each operation only uses the interfaces supporting it"""
+        with pytest.raises(ConnTimeout):
+            mch.update_fw("V2.21.8")
+        assert self.calls == ["telnet"]
+        with pytest.raises(NoRouteToDevice):
+            mch.get_configuration("pcie")
+        mch = NATMCH("172.30.5.238", allowed_conn=[ConnType.TELNET])
+        with pytest.raises(FeatureNotSupported):
+            mch.get_configuration("pcie")
+        # No connection is opened until it's needed
+        assert mch._conns == {}
+
+    def test_real_interfaces(self, virtual_clock):
+        """Test the failover between the interfaces sharing a health registry"""
+        health = HealthRegistry(clock=virtual_clock)
+        http = TimeoutWeb()
+
+        def create():
+            mch = NATMCH(
+                "172.30.5.238",
+                allowed_conn=[ConnType.ETHER, ConnType.TELNET],
+                health=health,
+                selector=TransportSelector(clock=virtual_clock),
+                clock=virtual_clock,
+                http=http,
+            )
+            mch._conn_factories[ConnType.TELNET] = lambda deadline: NATMCHTelnet(
+                mch.ip_address,
+                session=FakeMCHSession(),
+                health=health,
+                clock=virtual_clock,
+            )
+            return mch
+
+        mch = create()
+        assert mch.device_info() == DEVICE_INFO
+        assert http.requests == ["index.asp"]
+        assert health.unavailable() == [("172.30.5.238", "http")]
+        assert health.state(mch.ip_address) == BreakerState.CLOSED
+
+        # Another MCH object tries the web interface first, which fails fast
+        # without counting it as a failure
+        mch = create()
+        assert mch.device_info() == DEVICE_INFO
+        assert http.requests == ["index.asp"]
+        assert mch.selector.stats(mch.ip_address, ConnType.ETHER)["error_rate"] == 0
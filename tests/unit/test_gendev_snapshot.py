@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_snapshot
+~~~~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_snapshot module.
+"""
+import os
+from collections import OrderedDict
+
+from gendev_tools.gendev_snapshot import SnapshotStore, OBJ_DELTA, OBJ_TEXT
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+BACKPLANE = "".join("set_param {} {}\n".format(i, i * 2) for i in range(200))
+
+
+def make_config(backplane=BACKPLANE, ntp="1"):
+    return OrderedDict(
+        [
+            (
+                "basecfg",
+                OrderedDict(
+                    [
+                        (
+                            "Base MCH parameter",
+                            OrderedDict(
+                                [
+                                    ("MCH global parameter", {"telnet_enable": "8"}),
+                                    ("SNTP parameter", {"ntp_enable": ntp}),
+                                ]
+                            ),
+                        )
+                    ]
+                ),
+            ),
+            ("backplane", {"Backplane Configuration": backplane}),
+        ]
+    )
+
+
+def count_objects(path):
+    return sum(len(files) for _, _, files in os.walk(os.path.join(path, "objects")))
+
+
+class TestSnapshotStore:
+    def test_roundtrip(self, tmp_path):
+        """Test that a snapshot is rebuilt keeping the order of the keys"""
+        store = SnapshotStore(str(tmp_path))
+        config = make_config()
+        store.put("mch-01", config)
+        assert store.get("mch-01") == config
+        assert list(store.get("mch-01")) == ["basecfg", "backplane"]
+        assert store.get("mch-02") is None
+
+    def test_deduplication(self, tmp_path):
+        """Test that identical configurations are stored only once"""
+        store = SnapshotStore(str(tmp_path))
+        store.put("mch-01", make_config(), timestamp=1)
+        objects = count_objects(str(tmp_path))
+        store.put("mch-02", make_config(), timestamp=1)
+        store.put("mch-01", make_config(), timestamp=2)
+        assert count_objects(str(tmp_path)) == objects
+        assert len(store.history("mch-01")) == 1
+
+        # Changing a section only adds the section and its parent trees
+        store.put("mch-01", make_config(ntp="0"), timestamp=3)
+        assert count_objects(str(tmp_path)) == objects + 4
+        assert store.get("mch-01", timestamp=2) == make_config()
+        assert store.get("mch-01", timestamp=3) == make_config(ntp="0")
+
+    def test_backplane_delta(self, tmp_path):
+        """Test that scripts are stored as deltas of the previous version"""
+        store = SnapshotStore(str(tmp_path), max_delta_chain=2)
+        versions = [BACKPLANE]
+        for i in range(4):
+            versions.append(versions[-1].replace("set_param {} ".format(i), "x "))
+
+        for timestamp, backplane in enumerate(versions):
+            store.put("mch-01", make_config(backplane), timestamp=timestamp)
+
+        kinds = []
+        for timestamp, digest in store.history("mch-01"):
+            config = store.get("mch-01", timestamp)
+            assert (
+                config["backplane"]["Backplane Configuration"]
+                == versions[int(timestamp)]
+            )
+            text_digest = store._index(digest)["backplane"]["Backplane Configuration"]
+            kinds.append(store._read(text_digest)[0])
+        # Full text, 2 deltas and then the chain is restarted
+        assert kinds[1:3] == [OBJ_DELTA, OBJ_DELTA]
+        assert kinds[0] != OBJ_DELTA and kinds[3] != OBJ_DELTA
+        assert kinds[4] == OBJ_DELTA
+
+    def test_script_after_value(self, tmp_path):
+        """Test a script replacing a value that wasn't a script"""
+        store = SnapshotStore(str(tmp_path))
+        store.put("mch-01", make_config(backplane={"set_param": "0"}), timestamp=1)
+        store.put("mch-01", make_config(), timestamp=2)
+        assert store.get("mch-01", timestamp=2) == make_config()
+        digest = store.history("mch-01")[-1][1]
+        text_digest = store._index(digest)["backplane"]["Backplane Configuration"]
+        assert store._read(text_digest)[0] == OBJ_TEXT
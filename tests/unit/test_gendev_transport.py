@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_transport
+~~~~~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_transport module.
+"""
+import time
+import pytest
+import requests as rq
+
+from gendev_tools.gendev_transport import (
+    Cassette,
+    RecordingHTTP,
+    RecordingTelnet,
+    ReplayHTTP,
+    ReplayResponse,
+    ReplayTelnet,
+)
+from gendev_tools.gendev_clock import VirtualClock
+from gendev_tools.gendev_err import CassetteMismatch, ConnTimeout
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.nat_mch.nat_mch_telnet import NATMCHTelnet
+from gendev_tools.nat_mch.nat_mch_web import NATMCHWeb
+from .fake_mch import DEVICE_INFO, FakeMCHSession
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class FakeHTTP:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get(self, url, **kwargs):
+        if url not in self.pages:
+            raise rq.exceptions.ConnectTimeout(url)
+        return ReplayResponse(url, 200, {"Content-Type": "text/html"}, self.pages[url])
+
+    def post(self, url, data=None, **kwargs):
+        return self.get(url)
+
+
+class TestTelnetTransport:
+    def test_record_replay(self, tmp_path, virtual_clock):
+        """Test that a replayed session behaves as the recorded one"""
+        cassette = Cassette()
+        session = RecordingTelnet(FakeMCHSession(), cassette)
+        mch = NATMCHTelnet(
+            "172.30.5.238",
+            session=session,
+            health=HealthRegistry(),
+            clock=virtual_clock,
+        )
+        assert mch.device_info() == DEVICE_INFO
+
+        path = str(tmp_path / "telnet.jsonl")
+        cassette.save(path)
+        replay = ReplayTelnet(Cassette.load(path))
+        mch = NATMCHTelnet(
+            "172.30.5.238", session=replay, health=HealthRegistry(), clock=virtual_clock
+        )
+        assert mch.device_info() == DEVICE_INFO
+
+    def test_mismatch(self):
+        """Test that a deviation from the recorded session is detected"""
+        cassette = Cassette()
+        RecordingTelnet(FakeMCHSession(), cassette).write(b"version\r")
+        replay = ReplayTelnet(cassette)
+        with pytest.raises(CassetteMismatch):
+            replay.write(b"ni\r")
+        with pytest.raises(CassetteMismatch):
+            replay.read_very_eager()
+
+
+class TestHTTPTransport:
+    def test_record_replay(self, tmp_path):
+        """Test the replay of the web interface, including the failures"""
+        pages = {
+            "http://mch/index.asp": b"<html><head><title>MCH Configuration"
+            b"</title></head><body></body></html>",
+        }
+        cassette = Cassette()
+        recorder = RecordingHTTP(FakeHTTP(pages), cassette)
+        recorder.get("http://mch/index.asp")
+        with pytest.raises(rq.exceptions.Timeout):
+            recorder.get("http://mch/goform/GetInfo")
+
+        path = str(tmp_path / "http.jsonl")
+        cassette.save(path)
+        web = NATMCHWeb(
+            "mch", http=ReplayHTTP(Cassette.load(path)), health=HealthRegistry()
+        )
+        with pytest.raises(ConnTimeout):
+            web.device_info()
+
+    def test_post(self, tmp_path):
+        """Test the replay of the submitted forms"""
+        pages = {"http://mch/goform/mch_cfg": b"OK"}
+        form = [("telnet_enable", "0"), ("telnet_timeout", "300")]
+        cassette = Cassette()
+        recorder = RecordingHTTP(FakeHTTP(pages), cassette)
+        assert recorder.post("http://mch/goform/mch_cfg", data=form).ok
+
+        path = str(tmp_path / "http.jsonl")
+        cassette.save(path)
+        replay = ReplayHTTP(Cassette.load(path))
+        with pytest.raises(CassetteMismatch):
+            replay.get("http://mch/goform/mch_cfg")
+        assert replay.post("http://mch/goform/mch_cfg", data=form).content == b"OK"
+
+        # A different form doesn't replay the recorded answer
+        replay = ReplayHTTP(Cassette.load(path))
+        with pytest.raises(CassetteMismatch):
+            replay.post("http://mch/goform/mch_cfg", data=dict(form[:1]))
+
+    def test_realtime(self):
+        """Test that the replay can reproduce the timing of the device"""
+        cassette = Cassette(
+            [{"op": "get", "url": "u", "status": 404, "headers": {}, "body": ""}]
+        )
+        cassette.events[0]["t"] = 0.2
+        start = time.monotonic()
+        response = ReplayHTTP(cassette, realtime=True).get("u")
+        assert time.monotonic() - start >= 0.2
+        assert not response.ok
+
+        # The recorded time passes on a virtual clock without waiting
+        clock = VirtualClock()
+        ReplayHTTP(cassette, realtime=True, clock=clock).get("u")
+        assert clock.monotonic() == pytest.approx(0.2)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_verify
+~~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_verify module.
+"""
+import copy
+import threading
+
+from gendev_tools.gendev_clock import VirtualClock
+from gendev_tools.gendev_deadline import Deadline
+from gendev_tools.gendev_err import NoRouteToDevice
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.gendev_verify import (
+    Verdict,
+    summarize,
+    verdict_matrix,
+    verify_device,
+    verify_fleet,
+)
+from .fake_mch import DEVICE_INFO
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+EXPECTED = {"fw_ver": "V2.21.8", "fpga_ver": "V1.14", "mcu_ver": "V1.2"}
+
+
+class FakeDevice:
+    def __init__(self, fw_ver="V2.21.8"):
+        self.info = copy.deepcopy(DEVICE_INFO)
+        self.info["Board"]["fw_ver"] = fw_ver
+        self.closed = False
+
+    def device_info(self, deadline=None):
+        return self.info
+
+    def close(self):
+        self.closed = True
+
+
+def rebooting(attempts, fw_ver="V2.21.8"):
+    """Factory of a device that is not reachable for the first attempts."""
+    calls = []
+
+    def factory(deadline, health):
+        calls.append(deadline)
+        if len(calls) <= attempts:
+            raise NoRouteToDevice("Connection refused")
+        return FakeDevice(fw_ver)
+
+    return factory
+
+
+def back_at(name, seconds, clock):
+    """Factory of a device that is reachable after some time, and checks the
+    health of the device as the interfaces do."""
+
+    def factory(deadline, health):
+        health.check(name)
+        if clock.monotonic() < seconds:
+            health.record_failure(name)
+            raise NoRouteToDevice("Connection refused")
+        health.record_success(name)
+        return FakeDevice()
+
+    return factory
+
+
+class TestVerify:
+    def test_matrix(self, virtual_clock):
+        """Test the verdicts of devices in every situation"""
+        devices = {
+            "mch-ok": rebooting(0),
+            "mch-slow": rebooting(2),
+            "mch-old": rebooting(0, fw_ver="V2.20.1"),
+            "mch-down": rebooting(1000),
+        }
+        results = verify_fleet(
+            devices,
+            EXPECTED,
+            timeout=60,
+            interval=5,
+            max_workers=1,
+            clock=virtual_clock,
+        )
+        assert verdict_matrix(results) == {
+            "mch-ok": {"fw_ver": "pass", "fpga_ver": "pass", "mcu_ver": "pass"},
+            "mch-slow": {"fw_ver": "pass", "fpga_ver": "pass", "mcu_ver": "pass"},
+            "mch-old": {"fw_ver": "fail", "fpga_ver": "pass", "mcu_ver": "pass"},
+            "mch-down": {
+                "fw_ver": "timeout",
+                "fpga_ver": "timeout",
+                "mcu_ver": "timeout",
+            },
+        }
+        assert summarize(results) == {"pass": 2, "fail": 1, "timeout": 1}
+
+        assert results["mch-slow"].attempts == 3
+        assert results["mch-slow"].elapsed == 10
+        assert results["mch-old"].mismatches == {
+            "fw_ver": {"expected": "V2.21.8", "given": "V2.20.1"}
+        }
+        down = results["mch-down"]
+        assert down.verdict == Verdict.TIMEOUT
+        assert "NoRouteToDevice" in down.error
+        # The deadline is shared by every device
+        assert virtual_clock.monotonic() <= 60
+
+    def test_concurrent(self):
+        """Test that the devices are checked at the same time"""
+        barrier = threading.Barrier(4, timeout=5)
+        devices = []
+
+        def factory(deadline, health):
+            # Every device waits here until all of them are being checked
+            barrier.wait()
+            devices.append(FakeDevice())
+            return devices[-1]
+
+        results = verify_fleet(
+            [("mch-{}".format(i), factory) for i in range(4)],
+            {"fw_ver": "2.21.8"},
+            timeout=10,
+        )
+        assert list(results) == ["mch-0", "mch-1", "mch-2", "mch-3"]
+        assert all(r.verdict == Verdict.PASS for r in results.values())
+        assert all(device.closed for device in devices)
+
+    def test_late_device(self, virtual_clock):
+        """Test the devices coming back late in the verification window"""
+        devices = {
+            "mch-late": back_at("mch-late", 170, virtual_clock),
+            "mch-last": back_at("mch-last", 297, virtual_clock),
+        }
+        results = verify_fleet(
+            devices,
+            EXPECTED,
+            timeout=300,
+            interval=10,
+            max_workers=1,
+            clock=virtual_clock,
+        )
+        # The device is attempted at every interval, not at the backoff of
+        # the circuit breaker
+        assert results["mch-late"].verdict == Verdict.PASS
+        assert results["mch-late"].elapsed == 170
+        # The last attempt is right at the deadline, not an interval before
+        assert results["mch-last"].verdict == Verdict.PASS
+
+        # The backoff of the breakers would skip the attempts after 160 s
+        clock = VirtualClock()
+        late = verify_device(
+            "mch-late",
+            back_at("mch-late", 170, clock),
+            EXPECTED,
+            Deadline(300, clock=clock),
+            interval=10,
+            clock=clock,
+            health=HealthRegistry(clock=clock),
+        )
+        assert late.verdict == Verdict.TIMEOUT
+        assert "DeviceUnavailable" in late.error
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_gendev_watch
+~~~~~~~~~~~~~~~~~
+
+Unit test for the gendev_watch module.
+"""
+import copy
+import pytest
+
+from gendev_tools.gendev_watch import EventKind, Watcher
+from gendev_tools.gendev_err import NoRouteToDevice
+from .fake_mch import DEVICE_INFO
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class FakeDevice:
+    def __init__(self):
+        self.info = copy.deepcopy(DEVICE_INFO)
+        self.basecfg = {"Backplane": {"Slot 1": "enabled"}, "IPMI": {"mode": "on"}}
+        self.error = None
+        self.polls = 0
+
+    def device_info(self):
+        self.polls += 1
+        if self.error is not None:
+            raise self.error
+        return copy.deepcopy(self.info)
+
+    def get_configuration(self, category):
+        assert category == "basecfg"
+        return copy.deepcopy(self.basecfg)
+
+
+class TestWatcher:
+    @pytest.fixture
+    def watcher(self):
+        self.events = []
+        watcher = Watcher(on_event=self.events.append)
+        self.device = FakeDevice()
+        watcher.add("mch-01", self.device, targets=["device_info", "basecfg"])
+        return watcher
+
+    def test_changes(self, watcher):
+        """Test that only the changes are reported"""
+        assert watcher.poll("mch-01") == []
+        assert watcher.poll("mch-01") == []
+        self.device.info["Board"]["fw_ver"] = "V2.22.1"
+        self.device.basecfg["IPMI"]["mode"] = "off"
+        del self.device.basecfg["Backplane"]
+        events = watcher.poll("mch-01")
+        assert [(e.target, e.kind, e.path, e.previous, e.current) for e in events] == [
+            ("device_info", EventKind.CHANGED, "Board::fw_ver", "V2.21.8", "V2.22.1"),
+            ("basecfg", EventKind.CHANGED, "Backplane::Slot 1", "enabled", None),
+            ("basecfg", EventKind.CHANGED, "IPMI::mode", "on", "off"),
+        ]
+        assert self.events == events
+        assert watcher.poll("mch-01") == []
+
+    def test_unreachable(self, watcher):
+        """Test that a failing device is only reported once"""
+        watcher.poll("mch-01")
+        self.device.error = NoRouteToDevice("down")
+        events = watcher.poll("mch-01")
+        assert [e.kind for e in events] == [EventKind.UNREACHABLE]
+        assert "down" in events[0].current
+        assert watcher.poll("mch-01") == []
+        self.device.error = None
+        self.device.info["Network"]["ip_address"] = "172.30.5.239"
+        events = watcher.poll("mch-01")
+        assert [(e.kind, e.path) for e in events] == [
+            (EventKind.RECOVERED, None),
+            (EventKind.CHANGED, "Network::ip_address"),
+        ]
+
+    def test_run(self):
+        """Test that each device is polled on its own schedule"""
+        watcher = Watcher(interval=0.05, jitter=0.2)
+        fast, slow = FakeDevice(), FakeDevice()
+        watcher.add("fast", fast)
+        watcher.add("slow", slow, interval=0.2)
+        watcher.run(duration=0.6)
+        assert 6 <= fast.polls <= 13
+        assert 2 <= slow.polls <= 4
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_nat_mch_backplane
+~~~~~~~~~~~~~~~~~~~~~~
+
+Unit test for the nat_mch_backplane module.
+"""
+from gendev_tools.gendev_drift import diff_config
+from gendev_tools.nat_mch.nat_mch_backplane import (
+    BackplaneScript,
+    parse_line,
+    parse_script,
+)
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+SCRIPT = """# NAT-MCH startup configuration
+version 2
+[Slot 1]
+enable = yes
+set_param 1 2
+// overridden below
+set_param 1 3
+
+[Slot 2]
+enable = no
+   malformed line with spaces
+reboot
+"""
+
+
+class TestNATMCHBackplane:
+    """Test the parser of the backplane startup script."""
+
+    def test_parse_line(self):
+        """Test the kinds of lines of the script."""
+        assert parse_line("  ") is None
+        assert parse_line("; comment") is None
+        assert parse_line("[ Slot 3 ]") == ("section", "Slot 3")
+        assert parse_line("a b = c = d") == ("entry", "a b", "c = d")
+        assert parse_line("set_param 4 8") == ("entry", "set_param 4", "8")
+        assert parse_line("reboot") == ("entry", "reboot", "")
+
+    def test_lookup(self):
+        """Test the lookup of values by section and key."""
+        script = BackplaneScript(SCRIPT)
+        assert list(script.sections) == ["", "Slot 1", "Slot 2"]
+        assert script.get("", "version") == "2"
+        assert script.get("Slot 1", "enable") == "yes"
+        assert script.get("Slot 1", "set_param 1") == "3"
+        assert script.get("Slot 2", "malformed line with") == "spaces"
+        assert script.get("Slot 3", "enable", "missing") == "missing"
+        assert len(script.sections["Slot 1"].entries) == 3
+
+    def test_digests(self):
+        """Test that the digests ignore comments and blank lines."""
+        script = BackplaneScript(SCRIPT)
+        other = BackplaneScript("\n\n# other comment\n" + SCRIPT.replace("  ", ""))
+        assert script.digest == other.digest
+        assert script.section_digests() == other.section_digests()
+
+    def test_diff(self):
+        """Test that only the changed sections are reported."""
+        script = BackplaneScript(SCRIPT)
+        other = BackplaneScript(
+            SCRIPT.replace("enable = no", "enable = yes") + "[Slot 3]\nenable = no\n"
+        )
+        assert script.diff(script) == {}
+        assert script.changed_sections(other) == ["Slot 2", "Slot 3"]
+        diff = script.diff(other)
+        assert diff == {
+            "Slot 2::enable": {"expected": "no", "given": "yes"},
+            "Slot 3::enable": {"expected": None, "given": "no"},
+        }
+        assert diff == diff_config(script.to_dict(), other.to_dict())
+
+    def test_from_config(self):
+        """Test the parsing of the output of get_configuration."""
+        config = {"Backplane Configuration": SCRIPT}
+        script = BackplaneScript.from_config(config)
+        assert script is BackplaneScript.from_config(dict(config))
+        assert script is parse_script(SCRIPT)
+        assert BackplaneScript.from_config({}).sections == {}
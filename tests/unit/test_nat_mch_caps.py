@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_nat_mch_caps
+~~~~~~~~~~~~~~~~~
+
+Unit test for the nat_mch_caps module.
+"""
+import pytest
+
+from gendev_tools.gendev_err import FeatureNotSupported, WebChanged
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.nat_mch.nat_mch_caps import CapabilityCache
+from gendev_tools.nat_mch.nat_mch_web import NATMCHWeb
+from .fake_mch import FakeMCHWeb
+from .test_nat_mch_web import pcie_page
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+FW_VER = "V2.21.8"
+
+# PCIe page of a firmware version with a different action for the forms
+PCIE_PAGE = pcie_page(link_action="/goform/pcie_width_link_ctrl_v2")
+
+
+class TestCapabilityCache:
+    def web(self, caps, pages=None):
+        self.http = FakeMCHWeb(pages)
+        return NATMCHWeb(
+            "172.30.5.238", http=self.http, health=HealthRegistry(), caps=caps
+        )
+
+    def test_persistence(self, tmp_path):
+        """Test that the capabilities are kept in the file"""
+        path = str(tmp_path / "caps.json")
+        caps = CapabilityCache(path)
+        assert caps.supported(FW_VER, "category", "pcie") is None
+        caps.learn(FW_VER, "category", "pcie", True, "relaxed")
+        for _ in range(caps.threshold):
+            caps.learn(FW_VER, "category", "basecfg", False)
+
+        caps = CapabilityCache(path)
+        assert caps.supported(FW_VER, "category", "pcie") is True
+        assert caps.variant(FW_VER, "pcie") == "relaxed"
+        assert caps.supported(FW_VER, "category", "basecfg") is False
+        assert caps.supported("V2.20.1", "category", "pcie") is None
+        caps.forget(FW_VER)
+        assert CapabilityCache(path).to_dict() == {}
+
+    def test_old_file(self, tmp_path):
+        """Test that the failures of a file without their time are expired"""
+        path = tmp_path / "caps.json"
+        path.write_text('{"V2.21.8": {"category": {"basecfg": {"supported": false}}}}')
+        caps = CapabilityCache(str(path))
+        assert caps.supported(FW_VER, "category", "basecfg") is None
+
+    def test_unknown_info(self):
+        """Test that an unknown information page doesn't break the requests"""
+        caps = CapabilityCache()
+        web = self.web(caps, {"goform/pcie_width_link_ctrl": pcie_page()})
+        self.http.pages["goform/GetInfo"] = b"<html></html>"
+        assert web.get_configuration("pcie")
+        assert caps.to_dict() == {}
+
+    def test_variant(self):
+        """Test that the parser variant understanding the page is learnt"""
+        caps = CapabilityCache()
+        web = self.web(caps, {"goform/pcie_width_link_ctrl": PCIE_PAGE})
+        pciedict = web.get_configuration("pcie")["PCIe parameter"]
+        assert list(pciedict["Link Width Configuration"]) == [
+            "Station_0",
+            "Station_1",
+            "Station_2",
+        ]
+        assert caps.variant(FW_VER, "pcie") == "relaxed"
+        # The firmware version is retrieved once per MCH
+        web.get_configuration("pcie")
+        assert self.http.requests.count("goform/GetInfo") == 1
+
+    def test_unsupported(self):
+        """Test that the unsupported categories are not requested again"""
+        caps = CapabilityCache()
+        web = self.web(caps)
+        for _ in range(caps.threshold):
+            assert caps.supported(FW_VER, "category", "basecfg") is None
+            assert web.get_configuration("basecfg") == {}
+        assert caps.supported(FW_VER, "category", "basecfg") is False
+
+        web = self.web(caps)
+        with pytest.raises(FeatureNotSupported):
+            web.get_configuration("basecfg")
+        assert "goform/change_mch_cfg" not in self.http.requests
+
+    def test_unknown_format(self):
+        """Test a page that no parser variant understands"""
+        caps = CapabilityCache(threshold=2)
+        web = self.web(caps, {"goform/pcie_width_link_ctrl": b"<html></html>"})
+        for _ in range(2):
+            with pytest.raises(WebChanged):
+                web.get_configuration("pcie")
+        with pytest.raises(FeatureNotSupported):
+            web.get_configuration("pcie")
+
+    def test_recovery(self, virtual_clock):
+        """Test that the failures expire, and a success clears them"""
+        caps = CapabilityCache(threshold=2, ttl=3600, clock=virtual_clock)
+        web = self.web(caps)
+        # A failure followed by a success doesn't count
+        web.get_configuration("pcie")
+        self.http.pages["goform/pcie_width_link_ctrl"] = PCIE_PAGE
+        assert web.get_configuration("pcie")
+        assert caps.supported(FW_VER, "category", "pcie") is True
+
+        del self.http.pages["goform/pcie_width_link_ctrl"]
+        for _ in range(2):
+            web.get_configuration("pcie")
+        with pytest.raises(FeatureNotSupported):
+            web.get_configuration("pcie")
+
+        # The category is checked again once the failures expire
+        virtual_clock.advance(3600)
+        self.http.pages["goform/pcie_width_link_ctrl"] = PCIE_PAGE
+        assert web.get_configuration("pcie")
+        assert caps.supported(FW_VER, "category", "pcie") is True
+        assert caps.variant(FW_VER, "pcie") == "relaxed"
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_nat_mch_crate
+~~~~~~~~~~~~~~~~~~
+
+Unit test for the nat_mch_crate module.
+"""
+import pytest
+
+from gendev_tools.gendev_err import NoRouteToDevice
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.gendev_interface import ConnType
+from gendev_tools.gendev_selector import TransportSelector
+from gendev_tools.nat_mch.nat_mch_crate import Crate, parse_fru_list
+from .fake_mch import DEVICE_INFO
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+SHOW_FRU = (
+    b"FRU Information:\r\n----------------\r\n"
+    b" FRU  Device   State  Name\r\n==========================\r\n"
+    b"  0   MCH      M4     NMCH-CM\r\n"
+    b"  5   AMC1     M4     DAMC-FMC25\r\n"
+    b"  6   AMC2     M1     DAMC-FMC2ZUP\r\n"
+    b" 40   CU1      M4     Schroff uTCA CU\r\n"
+)
+
+
+class FakeWeb:
+    def __init__(self):
+        self.requests = []
+
+    def get_configuration(self, category, deadline=None):
+        self.requests.append(category)
+        return {"Backplane": {"Slot 1": "enabled"}}
+
+
+class TestCrate:
+    @pytest.fixture
+    def crate(self, scripted_mch, virtual_clock):
+        self.opened = []
+        self.web = FakeWeb()
+        crate = Crate(
+            "crate-01",
+            "172.30.5.238",
+            categories=["basecfg"],
+            ttl=60,
+            health=HealthRegistry(clock=virtual_clock),
+            selector=TransportSelector(clock=virtual_clock),
+            clock=virtual_clock,
+        )
+
+        def open_cli(deadline):
+            self.opened.append(ConnType.TELNET)
+            return scripted_mch({b"show_fru": SHOW_FRU})
+
+        def open_web(deadline):
+            self.opened.append(ConnType.ETHER)
+            return self.web
+
+        crate.mch._conn_factories[ConnType.TELNET] = open_cli
+        crate.mch._conn_factories[ConnType.ETHER] = open_web
+        yield crate
+        crate.close()
+
+    def test_parse_fru_list(self):
+        """Test the parsing of the FRUs, ignoring the rest of lines"""
+        frus = parse_fru_list(SHOW_FRU)
+        assert list(frus) == ["MCH", "AMC1", "AMC2", "CU1"]
+        assert frus["CU1"] == {"fru_id": 40, "state": "M4", "name": "Schroff uTCA CU"}
+        assert parse_fru_list(b"garbage\r\n") == {}
+
+    def test_snapshot(self, crate, virtual_clock):
+        """Test that a snapshot costs one connection per interface"""
+        snapshot = crate.snapshot()
+        assert snapshot["MCH"] == DEVICE_INFO
+        assert list(snapshot["FRU"]) == ["MCH", "AMC1", "AMC2", "CU1"]
+        assert snapshot["Configuration"] == {
+            "basecfg": {"Backplane": {"Slot 1": "enabled"}}
+        }
+        assert set(self.opened) == {ConnType.TELNET, ConnType.ETHER}
+        # The commands are pipelined, without fixed waits
+        session = crate.mch._conns[ConnType.TELNET]._session
+        assert session.commands == [b"", b"version", b"ni", b"show_fru"]
+        assert virtual_clock.slept == 0
+
+        # The health and the inventory come from the cached snapshot
+        assert crate.health() == {"reachable": True, "degraded": ["AMC2"]}
+        assert crate.inventory()["AMC1"]["name"] == "DAMC-FMC25"
+        assert len(session.commands) == 4
+        assert self.web.requests == ["basecfg"]
+
+        # Expired snapshots are taken again, reusing the connections
+        virtual_clock.advance(60)
+        crate.snapshot()
+        assert len(session.commands) == 8
+        assert len(self.opened) == 2
+
+    def test_unreachable(self, crate):
+        """Test the health of a crate whose MCH doesn't answer"""
+
+        def broken(deadline):
+            raise NoRouteToDevice("down")
+
+        crate.mch._conn_factories[ConnType.TELNET] = broken
+        health = crate.health()
+        assert health["reachable"] is False
+        assert "down" in health["error"]
+        with pytest.raises(NoRouteToDevice):
+            crate.snapshot()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_nat_mch_moxa
+~~~~~~~~~~~~~~~~~
+
+Unit test for the nat_mch_moxa module, using a local TCP server as stand-in of
+the ports of a MOXA hub.
+"""
+import time
+import asyncio
+import pytest
+
+from gendev_tools.gendev_err import ConnTimeout, NoRouteToDevice
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.gendev_interface import ConnType
+from gendev_tools.nat_mch.nat_mch import NATMCH
+from gendev_tools.nat_mch.nat_mch_moxa import MoxaHub, NATMCHMoxa
+from .fake_mch import DEVICE_INFO, FakeSerialServer
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class TestNATMCHMoxa:
+    @pytest.fixture(autouse=True)
+    def short_sleep(self, monkeypatch):
+        # The CLI handling waits 1 second after each command
+        sleep = time.sleep
+        monkeypatch.setattr(time, "sleep", lambda seconds: sleep(min(seconds, 0.05)))
+
+    def test_device_info(self):
+        """Test that the CLI handling works over the raw TCP port"""
+        with FakeSerialServer() as server:
+            mch = NATMCHMoxa("127.0.0.1", server.port, health=HealthRegistry())
+            assert mch.device_info() == DEVICE_INFO
+
+    def test_nat_mch(self):
+        """Test the MOXA interface from the NAT MCH device"""
+        with FakeSerialServer() as server:
+            mch = NATMCH(
+                "172.30.5.238",
+                allowed_conn=[ConnType.MOXA],
+                health=HealthRegistry(),
+                moxa_address="127.0.0.1",
+                moxa_port=server.port,
+            )
+            assert mch.device_info() == DEVICE_INFO
+        with pytest.raises(ValueError):
+            NATMCH("172.30.5.238", allowed_conn=[ConnType.MOXA])
+
+
+class TestMoxaHub:
+    def test_concurrent_ports(self):
+        """Test that the ports of the hub are served concurrently"""
+        servers = [FakeSerialServer(delay=0.2) for _ in range(8)]
+        for server in servers:
+            server.__enter__()
+        try:
+            hub = MoxaHub("127.0.0.1", timeout=5, health=HealthRegistry())
+            start = time.monotonic()
+            results = hub.device_info([server.port for server in servers])
+            # 3 commands per port, serving the ports one by one takes ~4.8 s
+            assert time.monotonic() - start < 2
+        finally:
+            for server in servers:
+                server.__exit__()
+        assert results == {server.port: DEVICE_INFO for server in servers}
+
+    def test_failures(self):
+        """Test that a failing port doesn't affect the others"""
+        health = HealthRegistry()
+        with FakeSerialServer() as good, FakeSerialServer(delay=2) as slow:
+            closed = FakeSerialServer()
+            closed.server_close()
+            hub = MoxaHub("127.0.0.1", timeout=0.5, health=health)
+            results = hub.device_info([good.port, slow.port, closed.port])
+        assert results[good.port] == DEVICE_INFO
+        assert isinstance(results[slow.port], ConnTimeout)
+        assert isinstance(results[closed.port], NoRouteToDevice)
+        assert sorted(health.unavailable()) == sorted(
+            ["127.0.0.1:{}".format(slow.port), "127.0.0.1:{}".format(closed.port)]
+        )
+
+    def test_broken_connection(self, monkeypatch):
+        """Test that a connection lost while sending a command is reported"""
+
+        class BrokenWriter:
+            waited = False
+
+            def write(self, data):
+                pass
+
+            async def drain(self):
+                raise ConnectionResetError("Connection reset by peer")
+
+            def close(self):
+                pass
+
+            async def wait_closed(self):
+                self.waited = True
+
+        writer = BrokenWriter()
+
+        async def open_connection(*args, **kwargs):
+            return asyncio.StreamReader(), writer
+
+        monkeypatch.setattr(asyncio, "open_connection", open_connection)
+        health = HealthRegistry()
+        hub = MoxaHub("127.0.0.1", timeout=0.5, health=health)
+        results = hub.device_info([4001])
+        assert isinstance(results[4001], NoRouteToDevice)
+        assert writer.waited
+        assert health.unavailable() == ["127.0.0.1:4001"]
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_nat_mch_mux
+~~~~~~~~~~~~~~~~
+
+Unit test for the nat_mch_mux module.
+"""
+import time
+import asyncio
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+from gendev_tools.gendev_deadline import Deadline
+from gendev_tools.gendev_err import ConnTimeout
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.gendev_governor import Governor
+from gendev_tools.gendev_interface import ConnType
+from gendev_tools.gendev_selector import TransportSelector
+from gendev_tools.nat_mch.nat_mch import NATMCH
+from gendev_tools.nat_mch.nat_mch_mux import MuxRegistry, SessionMux
+from gendev_tools.nat_mch.nat_mch_telnet import NATMCHTelnet
+from .fake_mch import DEVICE_INFO, FakeMCHSession
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class ExclusiveSession(FakeMCHSession):
+    """Session failing when it is used by two threads at the same time."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self.broken = False
+
+    def _exclusive(self, function, *args):
+        assert self._lock.acquire(blocking=False), "Concurrent access"
+        try:
+            if self.broken:
+                raise EOFError("Connection closed")
+            time.sleep(0.001)
+            return function(*args)
+        finally:
+            self._lock.release()
+
+    def write(self, data):
+        return self._exclusive(super().write, data)
+
+    def read_until(self, match, timeout=None):
+        return self._exclusive(super().read_until, match, timeout)
+
+    def read_very_eager(self):
+        return self._exclusive(super().read_very_eager)
+
+
+class TestSessionMux:
+    @pytest.fixture
+    def mux(self, virtual_clock):
+        self.sessions = []
+
+        def factory():
+            self.sessions.append(ExclusiveSession())
+            return NATMCHTelnet(
+                "172.30.5.238",
+                session=self.sessions[-1],
+                health=HealthRegistry(),
+                clock=virtual_clock,
+            )
+
+        mux = SessionMux(factory)
+        yield mux
+        mux.close()
+
+    def test_threads(self, mux):
+        """Test that many threads share the session without interleaving"""
+        commands = ["version", "ni"] * 20
+        with ThreadPoolExecutor(8) as executor:
+            futures = list(executor.map(mux.submit_command, commands))
+        for command, future in zip(commands, futures):
+            output = future.result()
+            assert output.startswith(command)
+            expected = "Firmware" if command == "version" else "ip address"
+            assert expected in output
+        assert len(self.sessions) == 1
+
+    def test_async(self, mux):
+        """Test that the requests can be awaited from asyncio tasks"""
+
+        async def main():
+            return await asyncio.gather(
+                *(mux.async_call("device_info") for _ in range(5)),
+                mux.async_command("ni"),
+            )
+
+        results = asyncio.run(main())
+        assert results[:5] == [DEVICE_INFO] * 5
+        assert "ieee address" in results[5]
+
+    def test_reconnect(self, mux):
+        """Test that a broken session is replaced by a new one"""
+        assert mux.call("device_info").result() == DEVICE_INFO
+        self.sessions[0].broken = True
+        with pytest.raises(EOFError):
+            mux.call("device_info").result()
+        assert mux.call("device_info").result() == DEVICE_INFO
+        assert len(self.sessions) == 2
+
+    def test_registry(self, mux):
+        """Test that there's a single multiplexer per device"""
+        registry = MuxRegistry()
+        first = registry.get("mch-01", None)
+        assert registry.get("mch-01", None) is first
+        assert registry.get("mch-02", None) is not first
+        registry.close("mch-01")
+        assert registry.get("mch-01", None) is not first
+        registry.close()
+        with pytest.raises(RuntimeError):
+            first.submit_command("version")
+
+    def test_natmch(self, mux, virtual_clock):
+        """Test that the NATMCHs of a device share its Telnet session"""
+        registry = MuxRegistry()
+        mchs = []
+        for _ in range(2):
+            mch = NATMCH(
+                "172.30.5.238",
+                allowed_conn=[ConnType.TELNET],
+                selector=TransportSelector(),
+                governor=Governor(),
+                clock=virtual_clock,
+                muxes=registry,
+            )
+            mch._conn_factories[ConnType.TELNET] = lambda deadline: mux._factory()
+            mchs.append(mch)
+        try:
+            with ThreadPoolExecutor(8) as executor:
+                results = list(
+                    executor.map(lambda i: mchs[i % 2].device_info(), range(16))
+                )
+            assert results == [DEVICE_INFO] * 16
+            assert len(self.sessions) == 1
+        finally:
+            registry.close()
+
+    def test_natmch_deadline(self, mux):
+        """Test that a call queued in the multiplexer respects the deadline"""
+        registry = MuxRegistry()
+        shared = registry.get("172.30.5.238", mux._factory)
+        mch = NATMCH(
+            "172.30.5.238",
+            allowed_conn=[ConnType.TELNET],
+            selector=TransportSelector(),
+            governor=Governor(),
+            muxes=registry,
+        )
+        released = threading.Event()
+        try:
+            # Another thread keeps the session busy
+            shared.submit(lambda conn: released.wait(5))
+            start = time.monotonic()
+            with pytest.raises(ConnTimeout):
+                mch.device_info(deadline=Deadline(0.2))
+            assert time.monotonic() - start < 2
+        finally:
+            released.set()
+            registry.close()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_nat_mch_ssh
+~~~~~~~~~~~~~~~~
+
+Unit test for the nat_mch_ssh module, using a local SSH server as stand-in of
+the MCH.
+"""
+import time
+import socket
+import threading
+import pytest
+
+from gendev_tools.gendev_err import NoRouteToDevice
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.gendev_interface import ConnType
+from gendev_tools.nat_mch.nat_mch import NATMCH
+from gendev_tools.nat_mch.nat_mch_ssh import NATMCHSSH, SSHConnection
+from .fake_mch import CLI_OUTPUT, DEVICE_INFO, cli_answer
+
+paramiko = pytest.importorskip("paramiko")
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class FakeSSHServer:
+    """SSH server answering as the CLI of an MCH.
+
+    Each command of an exec channel takes *delay* seconds to complete.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.connections = 0
+        self.host_key = paramiko.RSAKey.generate(1024)
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        self.transports = []
+
+    def __enter__(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.start_server(server=_ServerInterface(self))
+            self.transports.append(transport)
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self, server):
+        self.server = server
+
+    def check_auth_password(self, username, password):
+        if (username, password) == ("root", "nat"):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, *args):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(
+            target=self._exec, args=(channel, command), daemon=True
+        ).start()
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=self._shell, args=(channel,), daemon=True).start()
+        return True
+
+    def _exec(self, channel, command):
+        time.sleep(self.server.delay)
+        channel.sendall(CLI_OUTPUT.get(command, b""))
+        channel.send_exit_status(0)
+        # The request is acknowledged by the transport after this thread is
+        # started, so closing the channel here could overtake the
+        # acknowledgement. The end of the output is signalled with EOF, and
+        # the channel is closed once the client closes it.
+        channel.shutdown_write()
+        while channel.recv(1024):
+            pass
+        channel.close()
+
+    def _shell(self, channel):
+        pending = b""
+        while True:
+            data = channel.recv(1024)
+            if not data:
+                return
+            pending += data
+            while b"\r" in pending:
+                command, pending = pending.split(b"\r", 1)
+                channel.sendall(cli_answer(command + b"\r"))
+
+
+class TestNATMCHSSH:
+    @pytest.fixture(autouse=True)
+    def short_sleep(self, monkeypatch):
+        # The CLI handling waits 1 second after each command
+        sleep = time.sleep
+        monkeypatch.setattr(time, "sleep", lambda seconds: sleep(min(seconds, 0.05)))
+
+    def test_channels(self):
+        """Test that the commands share the connection, and run concurrently"""
+        with FakeSSHServer(delay=0.5) as server:
+            mch = NATMCHSSH(
+                "127.0.0.1", server.port, health=HealthRegistry(), password="nat"
+            )
+            start = time.monotonic()
+            assert mch.device_info() == DEVICE_INFO
+            assert mch.device_info() == DEVICE_INFO
+            # 4 commands of 0.5 s, 2 at a time
+            assert time.monotonic() - start < 1.5
+            # The shell channel is used for the dialogs with the CLI
+            mch._send_command("version")
+            assert "Firmware V2.21.8" in mch._read_command()
+            mch._session.close()
+        assert server.connections == 1
+
+    def test_nat_mch(self):
+        """Test the SSH interface from the NAT MCH device"""
+        with FakeSSHServer() as server:
+            mch = NATMCH(
+                "127.0.0.1",
+                allowed_conn=[ConnType.SSH],
+                health=HealthRegistry(),
+                ssh_options={"port": server.port, "password": "nat"},
+            )
+            assert mch.device_info() == DEVICE_INFO
+
+    def test_authentication(self):
+        """Test that a rejected login is reported"""
+        health = HealthRegistry()
+        with FakeSSHServer() as server:
+            with pytest.raises(NoRouteToDevice):
+                NATMCHSSH("127.0.0.1", server.port, health=health, password="x")
+        assert health.unavailable() == [("127.0.0.1", "ssh")]
+
+    def test_shell_failure(self, monkeypatch):
+        """Test that the connection is closed when the shell can't be opened"""
+        closed = []
+
+        def shell(connection, timeout=None):
+            raise NoRouteToDevice("No shell")
+
+        close = SSHConnection.close
+        monkeypatch.setattr(SSHConnection, "shell", shell)
+        monkeypatch.setattr(
+            SSHConnection,
+            "close",
+            lambda connection: closed.append(connection) or close(connection),
+        )
+        health = HealthRegistry()
+        with FakeSSHServer() as server:
+            with pytest.raises(NoRouteToDevice):
+                NATMCHSSH("127.0.0.1", server.port, health=health, password="nat")
+        assert len(closed) == 1
+        assert health.unavailable() == [("127.0.0.1", "ssh")]
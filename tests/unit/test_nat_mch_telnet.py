@@ -6,11 +6,20 @@ test_nat_mch_telnet
 
 Unit test for the NATMCHTelnet module.
 """
+import time
 import pytest
 
-from gendev_tools.nat_mch.nat_mch_telnet import NATMCHTelnet
+from gendev_tools.nat_mch.nat_mch_telnet import (
+    NATMCHTelnet,
+    parse_board_info,
+    parse_device_info,
+    parse_network_info,
+)
 from gendev_tools.gendev_err import ConnTimeout
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.gendev_deadline import Deadline
 from pytest_testconfig import config
+from .fake_mch import CLI_OUTPUT, DEVICE_INFO, FakeMCHSession
 
 __author__ = "Felipe Torres González"
 __copyright__ = "Copyright 2021, ESS GenDev Tools"
@@ -47,3 +56,63 @@ class TestNATMCHTelnet:
         assert response[0] is False
         # response = self.valid_mch.update_fw(config["update_fw"]["valid_fw"])
         # assert response[0] is True
+
+
+class TestNATMCHTelnetParsers:
+    def test_noisy_console(self, virtual_clock):
+        """Test that non ASCII bytes in the console don't break the parsing"""
+        session = FakeMCHSession()
+        session.write(b"\xff\xfe garbage \x80\r")
+        mch = NATMCHTelnet(
+            "172.30.5.238",
+            session=session,
+            health=HealthRegistry(),
+            clock=virtual_clock,
+        )
+        assert mch._read_command().startswith("\ufffd\ufffd garbage \ufffd")
+        session.buffer = b"\x1b[0m\xe2\x96\x88 " + CLI_OUTPUT[b"version"]
+        with mch._read_raw() as raw:
+            assert parse_board_info(raw) == DEVICE_INFO["Board"]
+        assert mch.device_info() == DEVICE_INFO
+
+    def test_missing_fields(self):
+        """Test that a field missing in the output doesn't raise"""
+        assert parse_network_info(b"ip address : 172.30.5.238\r\n") == {
+            "ip_address": "172.30.5.238",
+            "mac_address": None,
+            "subnet_address": None,
+            "gateway_address": None,
+        }
+        assert parse_device_info(b"", CLI_OUTPUT[b"ni"]) == {}
+
+
+class TestFirmwareUpdate:
+    FW_PATH = b"172.30.4.69:fw/V2.21.8/mch_fw_V2.21.8.bin"
+
+    def test_success(self, scripted_mch, virtual_clock):
+        """Test a firmware update, including the flashing and the reboot"""
+        log = b"Erasing flash" + b"." * 120 + b"\r\nUpdate successful"
+        mch = scripted_mch({self.FW_PATH: log})
+        start = time.monotonic()
+        assert mch.update_fw("V2.21.8") == (True,)
+        assert time.monotonic() - start < 1
+        assert mch._session.commands[-1] == b"reboot"
+        # Commands (5 s), flash erase (30 s) and reboot (50 s)
+        assert virtual_clock.slept == 85
+        assert virtual_clock.monotonic() == 85
+
+    def test_missing_image(self, scripted_mch, virtual_clock):
+        """Test that a missing image is reported, without rebooting"""
+        mch = scripted_mch({self.FW_PATH: b"TFTP: could not get file"})
+        success, message = mch.update_fw("V2.21.8")
+        assert success is False
+        assert "couldn't be found" in message
+        assert b"reboot" not in mch._session.commands
+        assert virtual_clock.slept == 33
+
+    def test_deadline(self, scripted_mch, virtual_clock):
+        """Test that the waits of the update are bounded by the deadline"""
+        mch = scripted_mch()
+        with pytest.raises(ConnTimeout):
+            mch.update_fw("V2.21.8", deadline=Deadline(20, clock=virtual_clock))
+        assert virtual_clock.monotonic() == 20
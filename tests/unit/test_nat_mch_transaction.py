@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_nat_mch_transaction
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Unit test for the nat_mch_transaction module.
+"""
+import copy
+import pytest
+
+from gendev_tools.gendev_err import FeatureNotSupported
+from gendev_tools.gendev_interface import ConnType
+from gendev_tools.gendev_selector import TransportSelector
+from gendev_tools.nat_mch.nat_mch import NATMCH
+
+__author__ = "Felipe Torres González"
+__copyright__ = "Copyright 2021, ESS GenDev Tools"
+__license__ = "GPL-3.0"
+__version__ = "0.1"
+__maintainer__ = "Felipe Torres González"
+__email__ = "felipe.torresgonzalez@ess.eu"
+__status__ = "Development"
+
+
+class FakeMCHConfig:
+    """Configuration of an MCH, shared by its fake web and CLI interfaces.
+
+    The applied changes take effect after a reboot.
+    """
+
+    def __init__(self):
+        self.running = {
+            "basecfg": {"Backplane": {"Slot 1": "enabled"}, "IPMI": {"mode": "on"}},
+            "pcie": {"Virtual Switch 1": {"upstream": "AMC1"}},
+            "backplane": {"Backplane Configuration": "set slot 1\n"},
+        }
+        self.saved = copy.deepcopy(self.running)
+        self.ignored = set()
+        self.calls = []
+
+    # Web interface
+    def get_configuration(self, category, deadline=None):
+        self.calls.append(("get", category))
+        return copy.deepcopy(self.running[category])
+
+    def set_configuration(self, category, data, verify=True, deadline=None):
+        self.calls.append(("set", category))
+        if category in self.ignored:
+            return 0
+        for section, values in data.items():
+            if isinstance(values, dict):
+                self.saved[category].setdefault(section, {}).update(values)
+            else:
+                self.saved[category][section] = values
+        return 0
+
+    # Command line interface
+    def _reboot(self, sleep=50, deadline=None):
+        self.calls.append(("reboot",))
+        self.running = copy.deepcopy(self.saved)
+
+
+class TestConfigTransaction:
+    @pytest.fixture
+    def mch(self, virtual_clock):
+        self.device = FakeMCHConfig()
+        mch = NATMCH(
+            "172.30.5.238",
+            allowed_conn=[ConnType.ETHER, ConnType.TELNET],
+            selector=TransportSelector(clock=virtual_clock),
+            clock=virtual_clock,
+        )
+        mch._conn_factories[ConnType.ETHER] = lambda deadline: self.device
+        mch._conn_factories[ConnType.TELNET] = lambda deadline: self.device
+        return mch
+
+    def test_single_reboot(self, mch):
+        """Test that several categories are applied with a single reboot"""
+        with mch.transaction() as tx:
+            tx.stage("pcie", {"Virtual Switch 1": {"upstream": "AMC2"}})
+            tx.stage("basecfg", {"IPMI": {"mode": "off"}})
+            tx.stage("basecfg", {"Backplane": {"Slot 2": "enabled"}})
+            tx.stage("backplane", {"Backplane Configuration": "set slot 1\n"})
+        assert tx.result == 0
+        assert tx.applied == ["basecfg", "pcie"]
+        assert self.device.calls.count(("reboot",)) == 1
+        assert mch.clock.slept == 50
+        assert self.device.running["basecfg"]["IPMI"]["mode"] == "off"
+        # The read-back happens after the reboot
+        reboot = self.device.calls.index(("reboot",))
+        assert self.device.calls[reboot + 1 :] == [
+            ("get", "basecfg"),
+            ("get", "pcie"),
+            ("get", "backplane"),
+        ]
+
+    def test_nothing_to_apply(self, mch):
+        """Test that the MCH is not rebooted when it already has the changes"""
+        with mch.transaction() as tx:
+            tx.stage("basecfg", {"IPMI": {"mode": "on"}})
+        assert tx.result == 0
+        assert tx.applied == []
+        assert ("reboot",) not in self.device.calls
+
+    def test_verification(self, mch):
+        """Test that the values not taking effect are reported"""
+        self.device.ignored.add("pcie")
+        with mch.transaction() as tx:
+            tx.stage("pcie", {"Virtual Switch 1": {"upstream": "AMC2"}})
+            tx.stage("basecfg", {"IPMI": {"mode": "off"}})
+        assert tx.result == {
+            "pcie": {
+                "Virtual Switch 1::upstream": {"expected": "AMC2", "given": "AMC1"}
+            }
+        }
+        assert mch.set_configuration("basecfg", {"IPMI": {"mode": "on"}}) == 0
+        assert self.device.running["basecfg"]["IPMI"]["mode"] == "on"
+
+    def test_errors(self, mch):
+        """Test that a failing transaction keeps track of the applied changes"""
+
+        set_configuration = self.device.set_configuration
+
+        def unsupported(category, data, verify=True, deadline=None):
+            if category == "pcie":
+                raise FeatureNotSupported("Method not implemented yet.")
+            return set_configuration(category, data)
+
+        self.device.set_configuration = unsupported
+        tx = mch.transaction()
+        tx.stage("basecfg", {"IPMI": {"mode": "off"}})
+        tx.stage("pcie", {"Virtual Switch 1": {"upstream": "AMC2"}})
+        with pytest.raises(FeatureNotSupported):
+            tx.commit()
+        assert tx.applied == ["basecfg"]
+        assert ("reboot",) not in self.device.calls
+        with pytest.raises(ValueError):
+            tx.stage("network", {})
+
+    def test_unsupported_category(self, mch):
+        """Test that nothing is applied when a category can't be changed"""
+        tx = mch.transaction()
+        tx.stage("basecfg", {"IPMI": {"mode": "off"}})
+        tx.stage("backplane", {"Backplane Configuration": "set slot 2\n"})
+        with pytest.raises(FeatureNotSupported):
+            tx.commit()
+        assert tx.applied == []
+        assert ("set", "basecfg") not in self.device.calls
+        assert ("reboot",) not in self.device.calls
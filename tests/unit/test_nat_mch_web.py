@@ -6,11 +6,26 @@ test_nat_mch_web
 
 Unit test for the NATMCHWeb module.
 """
+import re
 import pytest
+from bs4 import BeautifulSoup
 from collections import OrderedDict
-from gendev_tools.nat_mch.nat_mch_web import NATMCHWeb
-from gendev_tools.gendev_err import NoRouteToDevice, FeatureNotSupported
+from concurrent.futures import ProcessPoolExecutor
+from gendev_tools.gendev_health import HealthRegistry
+from gendev_tools.nat_mch import nat_mch_web
+from gendev_tools.nat_mch.nat_mch_web import (
+    NATMCHWeb,
+    fill_forms,
+    parse_basecfg_page,
+    parse_page,
+    parse_pcie_page,
+    parse_pcie_page_relaxed,
+    read_title,
+    search_page_text,
+)
+from gendev_tools.gendev_err import NoRouteToDevice, FeatureNotSupported, WebChanged
 from pytest_testconfig import config
+from .fake_mch import DEVICE_INFO, WEB_PAGES, FakeMCHWeb, FakeResponse
 
 __author__ = ["Ross Elliot", "Felipe Torres González"]
 __copyright__ = "Copyright 2021, ESS GenDev Tools"
@@ -21,6 +36,159 @@ __email__ = "ross.elliot@ess.eu"
 __status__ = "Development"
 
 
+def pcie_page(link_action="/goform/pcie_width_link_ctrl", extra_rows=""):
+    """Build a PCIe configuration page with the layout of the MCH web server.
+
+    The *extra_rows* are added to the end of the virtual switches table.
+    """
+    stations = "".join(
+        '<table><tr><td><input type="radio" name="Station_{0}" value="1">'
+        '<input type="radio" name="Station_{0}" value="3" checked></td></tr>'
+        "</table>".format(i)
+        for i in range(3)
+    )
+    rows = "".join(
+        '<tr><td><b>{0}</b></td><td><select name="VS{0}_Up">'
+        '<option value="NONE"{1}>NONE</option>'
+        '<option value="AMC2_4"{2}>AMC2_4</option></select></td>'
+        '<td><input type="radio" name="AMC{3}_4" value="VS{0}"{4}>'
+        '<input type="radio" name="AMC{3}_4" value="VS9" checked disabled></td></tr>'.format(
+            i,
+            "" if i == 0 else " selected",
+            " selected" if i == 0 else "",
+            i + 1,
+            " checked" if i == 0 else "",
+        )
+        for i in range(2)
+    )
+    return (
+        "<html><head><title>MCH Configuration</title></head><body>"
+        '<form action="{}">{}</form>'
+        '<form action="/goform/pcie_vs_cfg_refresh"><table>'
+        "<tr><th>Virtual Switch</th></tr>"
+        "<tr><td><b>Max. Link Speed</b></td>"
+        '<td><input type="radio" name="LS1_4_Max" value="LS_2" checked></td></tr>'
+        "{}{}</table>"
+        '<input type="submit" value="Refresh"></form>'
+        "</body></html>".format(link_action, stations, rows, extra_rows)
+    ).encode("utf-8")
+
+
+def baseline_parse_pcie(content):
+    """The parser of the PCIe configuration page before it used XPath."""
+    mch_config = OrderedDict()
+    forms = BeautifulSoup(content, "lxml").body.find_all("form")
+
+    cfgtitle = "Link Width Configuration"
+    mch_config[cfgtitle] = OrderedDict()
+    curr_station = "Station_0"
+    for input in forms[0].find_all("input"):
+        if input["name"] == curr_station and "checked" in input.attrs:
+            mch_config[cfgtitle][curr_station] = input["value"]
+            curr_station = "Station_{}".format(int(curr_station[-1]) + 1)
+
+    cfgtitle = "PCIe Virtual Switch configurationt"
+    mch_config[cfgtitle] = OrderedDict()
+    indexes = ["none"] + [str(i) for i in range(6)] + ["Max. Link Speed"]
+    for row in forms[1].find_all("tr"):
+        title = row.find("b")
+        if title is None or title.text not in indexes:
+            continue
+        for s in row.find_all("select"):
+            for option in s.find_all("option"):
+                if "selected" in option.attrs:
+                    mch_config[cfgtitle][s["name"]] = option["value"]
+        for input in row.find_all("input"):
+            if "checked" in input.attrs and "disabled" not in input.attrs:
+                mch_config[cfgtitle][input["name"]] = input["value"]
+
+    pciecfg = OrderedDict()
+    pciecfg["PCIe parameter"] = mch_config
+    return pciecfg
+
+
+def basecfg_page():
+    """Build a base configuration page with the layout of the MCH web server."""
+    return (
+        "<html><body><form><table><tr><th> MCH global parameter </th></tr>"
+        '<tr><td>Telnet</td><td><select name="telnet_enable">'
+        '<option value="0">off</option><option value="8" selected>on</option>'
+        "</select></td></tr>"
+        '<tr><td>Timeout</td><td><input name="telnet_timeout" value="300"></td></tr>'
+        "</table><table><tr><th>Time Protocol / SNTP parameter</th></tr>"
+        '<tr><td>Server</td><td><input name="ntp_server_ip0" value="172">'
+        '<input name="ntp_server_ip1" value="30"><input name="ntp_server_ip2" '
+        'value="0"><input name="ntp_server_ip3" value="38"></td></tr>'
+        "</table></form></body></html>"
+    ).encode("utf-8")
+
+
+class TestNATMCHWebParsers:
+    def test_parse_basecfg_page(self):
+        """Test the parser of the base configuration page"""
+        cfgdict = parse_basecfg_page(basecfg_page())["Base MCH parameter"]
+        assert cfgdict == {
+            "MCH global parameter": {"telnet_enable": "8", "telnet_timeout": "300"},
+            "Time Protocol / SNTP parameter": {
+                "ntp_server_ip0": ["172", "30", "0", "38"]
+            },
+        }
+
+    def test_parse_page_pool(self):
+        """Test that parsing in a process pool gives the same result"""
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            for category, page in (("basecfg", basecfg_page()), ("pcie", pcie_page())):
+                parsed = parse_page(category, page, pool)
+                assert parsed == parse_page(category, page)
+                assert isinstance(parsed, OrderedDict)
+                assert list(parsed) == list(parse_page(category, page))
+
+    def test_parse_pcie_page(self):
+        """Test the parser of the PCIe configuration page"""
+        pciedict = parse_pcie_page(pcie_page())["PCIe parameter"]
+        assert pciedict["Link Width Configuration"] == {
+            "Station_0": "3",
+            "Station_1": "3",
+            "Station_2": "3",
+        }
+        assert list(pciedict["PCIe Virtual Switch configurationt"].items()) == [
+            ("LS1_4_Max", "LS_2"),
+            ("VS0_Up", "AMC2_4"),
+            ("AMC1_4", "VS0"),
+            ("VS1_Up", "NONE"),
+        ]
+
+    def test_parse_pcie_page_baseline(self):
+        """Test that the parser only takes the rows the previous parser took"""
+        page = pcie_page(
+            extra_rows='<tr><td><b>Status</b></td><td><select name="Mode">'
+            '<option value="auto" selected>auto</option></select>'
+            '<input type="radio" name="Reset" value="1" checked></td></tr>'
+            '<tr><td><input type="checkbox" name="Apply" value="1" checked>'
+            "</td></tr>"
+        )
+        assert parse_pcie_page(page) == baseline_parse_pcie(page)
+        assert parse_pcie_page(page) == parse_pcie_page(pcie_page())
+        assert parse_pcie_page(pcie_page()) == baseline_parse_pcie(pcie_page())
+
+    def test_parse_pcie_page_changed(self):
+        """Test that a change in the layout of the page is detected"""
+        with pytest.raises(WebChanged):
+            parse_pcie_page(pcie_page(link_action="/goform/other"))
+        with pytest.raises(WebChanged):
+            parse_pcie_page(b"")
+
+    def test_parse_pcie_page_relaxed(self):
+        """Test that the relaxed parser looks up the forms by their action"""
+        page = pcie_page(link_action="/goform/pcie_width_link_ctrl_v2")
+        page = page.replace(b"<body>", b'<body><form action="/goform/login"></form>')
+        assert parse_pcie_page_relaxed(page) == parse_pcie_page(pcie_page())
+        with pytest.raises(WebChanged):
+            parse_pcie_page(page)
+        with pytest.raises(WebChanged):
+            parse_pcie_page_relaxed(pcie_page(link_action="/goform/other"))
+
+
 class TestNATMCHWeb:
     def setup(self):
         self.valid_web = NATMCHWeb(config["Metadata"]["valid_ip_address"])
@@ -50,3 +218,175 @@ class TestNATMCHWeb:
         assert cfgdict["Base MCH parameter"] == config["Base MCH parameter"]
         pciedict = self.valid_web.get_configuration("pcie")
         assert pciedict["PCIe parameter"] == config["PCIe parameter"]
+
+
+class TestConditionalRequests:
+    @pytest.fixture
+    def parsed(self, monkeypatch):
+        """Pages parsed by the PCIe parser."""
+        parsed = []
+
+        def parser(content):
+            parsed.append(content)
+            return parse_pcie_page(content)
+
+        monkeypatch.setitem(nat_mch_web.PAGE_PARSERS, "pcie", parser)
+        return parsed
+
+    def web(self, etags):
+        self.http = FakeMCHWeb(
+            {
+                "goform/pcie_width_link_ctrl": pcie_page(),
+                "goform/web_cfg_backup_show_menu": b"<html></html>",
+                "nat_mch_startup_cfg.txt": b"# Backplane\n",
+            },
+            etags=etags,
+        )
+        return NATMCHWeb("172.30.5.238", http=self.http, health=HealthRegistry())
+
+    def test_etag(self, parsed):
+        """Test that an unchanged page is neither downloaded nor parsed again"""
+        web = self.web(etags=True)
+        first = web.get_configuration("pcie")
+        first["PCIe parameter"].clear()
+        assert web.get_configuration("pcie") == parse_pcie_page(pcie_page())
+        assert len(parsed) == 1
+        assert "If-None-Match" in self.http.headers[-1]
+
+        # A change of the page is parsed
+        self.http.pages["goform/pcie_width_link_ctrl"] = pcie_page().replace(
+            b'value="3" checked', b'value="3"'
+        )
+        web.get_configuration("pcie")
+        assert len(parsed) == 2
+
+    def test_digest(self, parsed):
+        """Test that a page without validators is compared by its content"""
+        web = self.web(etags=False)
+        for _ in range(3):
+            web.get_configuration("pcie")
+        assert len(parsed) == 1
+        assert "If-None-Match" not in self.http.headers[-1]
+
+        backplane = web.get_configuration("backplane")
+        assert backplane == {"Backplane Configuration": "# Backplane\n"}
+        assert web.get_configuration("backplane") == backplane
+
+
+class TestSetConfiguration:
+    def web(self):
+        page = basecfg_page().replace(b"<form>", b'<form action="/goform/mch_cfg">')
+        self.http = FakeMCHWeb(
+            {
+                "goform/change_mch_cfg": page,
+                "goform/pcie_width_link_ctrl": pcie_page(),
+            }
+        )
+        return NATMCHWeb("172.30.5.238", http=self.http, health=HealthRegistry())
+
+    def test_fill_forms(self):
+        """Test that only the given fields change, and the rest are kept"""
+        submits = fill_forms(
+            pcie_page(), {"Link Width Configuration": {"Station_1": 1}}
+        )
+        assert submits == [
+            (
+                "/goform/pcie_width_link_ctrl",
+                [("Station_0", "3"), ("Station_1", "1"), ("Station_2", "3")],
+            )
+        ]
+        assert fill_forms(pcie_page(), {"VS1_Up": "NONE"}) == []
+        with pytest.raises(ValueError):
+            fill_forms(pcie_page(), {"Station_9": "1"})
+
+    def test_set_configuration(self):
+        """Test that the changed forms are submitted"""
+        web = self.web()
+        data = {
+            "MCH global parameter": {"telnet_enable": "0"},
+            "Time Protocol / SNTP parameter": {"ntp_server_ip0": [172, 30, 0, 39]},
+        }
+        assert web.set_configuration("basecfg", data, verify=False) == 0
+        assert self.http.posts == [
+            (
+                "goform/mch_cfg",
+                [
+                    ("telnet_enable", "0"),
+                    ("telnet_timeout", "300"),
+                    ("ntp_server_ip0", "172"),
+                    ("ntp_server_ip1", "30"),
+                    ("ntp_server_ip2", "0"),
+                    ("ntp_server_ip3", "39"),
+                ],
+            )
+        ]
+
+        # The page still has the old values
+        assert web.set_configuration("basecfg", data) == {
+            "telnet_enable": {"expected": "0", "given": "8"},
+            "ntp_server_ip0": {
+                "expected": [172, 30, 0, 39],
+                "given": ["172", "30", "0", "38"],
+            },
+        }
+
+    def test_not_supported(self):
+        """Test that the backplane script can't be changed via the web"""
+        with pytest.raises(FeatureNotSupported):
+            self.web().set_configuration("backplane", {})
+
+
+class TestIncrementalParsing:
+    # Content of the pages after the fields read by the library
+    PADDING = b"<p>" + b"x" * 65536 + b"</p></body></html>"
+
+    def response(self, content):
+        return FakeResponse("http://mch/page", 200, {}, content)
+
+    def test_search_page_text(self):
+        """Test that the text searched is the same as the one of get_text"""
+        page = (
+            b"<html><body><table><tr><td>Firmware <b>Version</b></td>"
+            b"<!-- V0.0.0 -->\n<td>V2.21.8</td></tr></table>"
+            b"<p>IP Address\n172.30.5.238</p></body></html>"
+        )
+        patterns = {
+            "fw_ver": re.compile(r"Firmware Version\n(V\d{1,2}\.\d{1,2}\.\d{1,2})"),
+            "ip_address": re.compile(r"IP Address\n((\d{1,3}\.?){4})"),
+            "serial_num": re.compile(r"Board Serial Number\n(\d{6}-\d{4})"),
+        }
+        text = BeautifulSoup(page, "html.parser").get_text()
+        for chunk_size in (1, 7, 4096):
+            response = self.response(page)
+            matches = search_page_text(response, patterns, chunk_size)
+            assert matches["fw_ver"].group(1) == "V2.21.8"
+            assert matches["ip_address"].group(1) == "172.30.5.238"
+            assert matches["serial_num"] is None
+            assert matches["ip_address"].group(1) == (
+                patterns["ip_address"].search(text).group(1)
+            )
+            assert response.closed
+
+    def test_early_exit(self):
+        """Test that the pages are read only until the fields are found"""
+        http = FakeMCHWeb(
+            {
+                "index.asp": WEB_PAGES["index.asp"].replace(
+                    b"<body></body></html>", b"<body>" + self.PADDING
+                ),
+                "goform/GetInfo": WEB_PAGES["goform/GetInfo"].replace(
+                    b"</pre></body></html>", b"</pre>" + self.PADDING
+                ),
+            }
+        )
+        web = NATMCHWeb("172.30.5.238", http=http, health=HealthRegistry())
+        assert web.device_info() == DEVICE_INFO
+        for response in http.responses:
+            assert response.closed
+            assert response.read < 4096
+
+    def test_read_title(self):
+        """Test the title of pages with and without it"""
+        assert read_title(self.response(WEB_PAGES["index.asp"])) == "MCH Configuration"
+        assert read_title(self.response(b"<html><body></body></html>")) is None
+        assert read_title(self.response(b"")) is None